@@ -0,0 +1,168 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+import PIL
+
+from benchmarks.syntheticTree import generateTree
+from extraction.metadata.filedata import getRegularData
+from extraction.metadata.exifdata import getExifData
+from extraction.metadata.videodata import getVideoData
+from extraction.metadata.walker import scanMediaFiles, statEntry
+from transformation.transformation import transformData
+from renaming.renamer import JOURNAL_FILE_NAME, planRenames, executeRenames, rollbackRenames
+
+#### BENCHMARKS ####
+"""
+This module times the stages of the pipeline separately on a synthetic media tree: walking
+the tree, retrieving the regular metadata (stat), extracting EXIF data, reading the video
+container headers, building the DataFrame, transforming it, and renaming the files (which
+are renamed back afterwards, untimed). Every stage is repeated and the fastest run is
+reported. The results are written as JSON, and can be compared with the results of a
+previous run:
+
+    python -m benchmarks.runBenchmarks --files 5000 --output results.json
+    python -m benchmarks.runBenchmarks --files 5000 --compare results.json
+"""
+
+IMAGE_EXTENSIONS = (".gif", ".jpg", ".jpeg", ".png")
+VIDEO_EXTENSIONS = (".mov", ".mp4", ".mpg", ".mts")
+
+def _timeStage(stageFunction, repeat: int):
+    # The stages log their summaries (e.g. the DataFrame information) to stdout; the messages are discarded,
+    # but writing them is still part of the timing, as in a real run
+    timings: list[float] = []
+    result = None
+    for _ in range(repeat):
+        with open(os.devnull, "w") as devNull, contextlib.redirect_stdout(devNull):
+            startTime = time.perf_counter()
+            result = stageFunction()
+            timings.append(time.perf_counter() - startTime)
+    return min(timings), timings, result
+
+def runBenchmarks(treeFolder: str, repeat: int = 3) -> dict[str, dict[str, float]]:
+    """
+    Times every stage of the pipeline on an existing media tree.
+
+    Args:
+        treeFolder (str): The root folder of the media tree.
+        repeat (int): The number of runs per stage; the fastest run is reported.
+
+    Returns:
+        dict[str, dict[str, float]]: Per stage, the fastest time, all times, the number of items and the throughput.
+    """
+    stages: dict[str, dict[str, float]] = {}
+
+    def _addStage(stageName: str, stageFunction, itemCount=None):
+        seconds, timings, result = _timeStage(stageFunction, repeat)
+        items = itemCount if itemCount is not None else len(result)
+        stages[stageName] = {"seconds": seconds, "timings": timings, "items": items,
+                             "itemsPerSecond": items / seconds if seconds > 0 else None}
+        return result
+
+    supportedExtensions = IMAGE_EXTENSIONS + VIDEO_EXTENSIONS
+    mediaFiles = _addStage("walk", lambda: [
+        (root, fileEntry) for root, fileEntries, _ in scanMediaFiles(treeFolder, supportedExtensions) for fileEntry in fileEntries
+    ])
+
+    # Directory entries cache their stat result, so every run stats a fresh listing
+    def _statStage():
+        return [getRegularData(root, fileEntry.name, statEntry(fileEntry))
+                for root, fileEntries, _ in scanMediaFiles(treeFolder, supportedExtensions) for fileEntry in fileEntries]
+    regularData = _addStage("stat", _statStage)
+
+    imageIndices = [index for index, (fullPath, _) in enumerate(regularData)
+                    if os.path.splitext(fullPath)[1].lower() in IMAGE_EXTENSIONS]
+    exifData = _addStage("exif", lambda: [getExifData(regularData[index][0], dict(regularData[index][1])) for index in imageIndices])
+
+    videoIndices = [index for index, (fullPath, _) in enumerate(regularData)
+                    if os.path.splitext(fullPath)[1].lower() in VIDEO_EXTENSIONS]
+    videoData = _addStage("video", lambda: [getVideoData(regularData[index][0], dict(regularData[index][1])) for index in videoIndices])
+
+    # Combine the EXIF data of the images and the container data of the videos into the records
+    records = [metaDataDict for _, metaDataDict in regularData]
+    for index, metaDataDict in list(zip(imageIndices, exifData)) + list(zip(videoIndices, videoData)):
+        records[index] = metaDataDict
+
+    df = _addStage("dataframe", lambda: pd.DataFrame(records))
+    transformed = _addStage("transform", lambda: transformData(treeFolder, df=df.copy(), saveFile=False))
+
+    # Renaming changes the tree, so every run is rolled back (untimed) before the next one
+    journalPath = os.path.join(treeFolder, JOURNAL_FILE_NAME)
+    renameTimings: list[float] = []
+    for _ in range(repeat):
+        with open(os.devnull, "w") as devNull, contextlib.redirect_stdout(devNull):
+            startTime = time.perf_counter()
+            executeRenames(planRenames(transformed.reset_index()), journalPath=journalPath)
+            renameTimings.append(time.perf_counter() - startTime)
+            rollbackRenames(journalPath)
+            # The journal of a rolled-back run is not kept, so the runs do not pile up journals in the tree
+            os.remove(journalPath)
+    stages["rename"] = {"seconds": min(renameTimings), "timings": renameTimings, "items": len(transformed),
+                        "itemsPerSecond": len(transformed) / min(renameTimings) if min(renameTimings) > 0 else None}
+
+    return stages
+
+def compareResults(previousResults: dict, currentResults: dict) -> None:
+    """
+    Prints the change in time of every stage between two benchmark results.
+    """
+    print(f"{'stage':<12}{'previous (s)':>14}{'current (s)':>14}{'change':>10}")
+    for stageName, currentStage in currentResults["stages"].items():
+        previousStage = previousResults["stages"].get(stageName)
+        if previousStage is None:
+            print(f"{stageName:<12}{'-':>14}{currentStage['seconds']:>14.4f}{'new':>10}")
+            continue
+        change = (currentStage["seconds"] - previousStage["seconds"]) / previousStage["seconds"] * 100 if previousStage["seconds"] else 0.0
+        print(f"{stageName:<12}{previousStage['seconds']:>14.4f}{currentStage['seconds']:>14.4f}{change:>+9.1f}%")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the media metadata pipeline on a synthetic tree.")
+    parser.add_argument("--files", type=int, default=2000, help="number of media files in the synthetic tree")
+    parser.add_argument("--depth", type=int, default=2, help="number of folder levels below the root folder")
+    parser.add_argument("--fan-out", type=int, default=4, help="number of subfolders per folder")
+    parser.add_argument("--video-ratio", type=float, default=0.1, help="fraction of files that are videos")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic tree")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs per stage")
+    parser.add_argument("--tree", help="use (and keep) this folder for the synthetic tree instead of a temporary folder")
+    parser.add_argument("--output", help="write the results as JSON to this file instead of stdout")
+    parser.add_argument("--compare", help="compare the results with a previous JSON result file")
+    arguments = parser.parse_args()
+
+    treeFolder = arguments.tree or tempfile.mkdtemp(prefix="mediaBenchmark.")
+    try:
+        if not os.path.isdir(treeFolder) or not os.listdir(treeFolder):
+            generateTree(treeFolder, arguments.files, arguments.depth, arguments.fan_out,
+                         arguments.video_ratio, seed=arguments.seed)
+
+        results = {
+            "config": {"files": arguments.files, "depth": arguments.depth, "fanOut": arguments.fan_out,
+                       "videoRatio": arguments.video_ratio, "seed": arguments.seed, "repeat": arguments.repeat},
+            "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                            "pandas": pd.__version__, "pillow": PIL.__version__, "cpus": os.cpu_count()},
+            "stages": runBenchmarks(treeFolder, arguments.repeat),
+        }
+    finally:
+        if not arguments.tree:
+            shutil.rmtree(treeFolder, ignore_errors=True)
+
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as outputFile:
+            json.dump(results, outputFile, indent=2)
+    elif not arguments.compare:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if arguments.compare:
+        with open(arguments.compare, "r", encoding="utf-8") as previousFile:
+            compareResults(json.load(previousFile), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+#### STARTUP BUDGET ####
+"""
+This module checks that the command line interface starts quickly, as it is run many times
+by cron jobs and the like. It runs `main.py --help` and `main.py` on an empty folder several
+times, and compares the median wall-clock time of each with the startup time of the bare
+interpreter. The difference must stay within the budget, and neither run may import pandas,
+numpy or PIL (checked with `python -X importtime`). The exit status is 1 if a check fails,
+so it can be used as a regression check:
+
+    python -m benchmarks.startupBudget
+    python -m benchmarks.startupBudget --budget 0.15 --repeat 20
+"""
+
+REPOSITORY_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_SCRIPT = os.path.join(REPOSITORY_FOLDER, "main.py")
+
+# Modules that only the extraction, transformation and renaming stages may import
+HEAVY_MODULES: tuple[str, ...] = ("pandas", "numpy", "PIL")
+
+# The time a run may take on top of the bare interpreter, in seconds
+DEFAULT_BUDGET_SECONDS = 0.2
+
+def _runCommand(arguments: list[str]) -> tuple[float, set[str]]:
+    # The wall-clock time of a run, and the top-level packages it imported
+    startTime = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", *arguments], cwd=REPOSITORY_FOLDER,
+                               stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    seconds = time.perf_counter() - startTime
+
+    # Every line of -X importtime ends with the (indented) name of an imported module
+    importedPackages = {line.rsplit("|", 1)[-1].strip().split(".")[0]
+                        for line in completed.stderr.splitlines() if line.startswith("import time:")}
+    return seconds, importedPackages
+
+def measureStartup(repeat: int = 10) -> dict[str, dict]:
+    """
+    Runs the bare interpreter and the command line interface several times.
+
+    Args:
+        repeat (int): The number of runs per command; the median is reported.
+
+    Returns:
+        dict[str, dict]: Per command, the median time, all times and the heavy modules it imported.
+    """
+    with tempfile.TemporaryDirectory(prefix="mediaStartup.") as emptyFolder:
+        commands: dict[str, list[str]] = {
+            "interpreter": ["-c", "pass"],
+            "help": [MAIN_SCRIPT, "--help"],
+            "emptyFolder": [MAIN_SCRIPT, emptyFolder, "--progress", "off"],
+        }
+
+        results: dict[str, dict] = {}
+        for commandName, arguments in commands.items():
+            timings: list[float] = []
+            importedPackages: set[str] = set()
+            for _ in range(repeat):
+                seconds, packages = _runCommand(arguments)
+                timings.append(seconds)
+                importedPackages |= packages
+            results[commandName] = {"seconds": statistics.median(timings), "timings": timings,
+                                    "heavyModules": sorted(importedPackages & set(HEAVY_MODULES))}
+    return results
+
+def checkBudget(results: dict[str, dict], budgetSeconds: float) -> bool:
+    """
+    Prints the startup time of every command, and returns False if one is over the budget
+    or imports a heavy module.
+    """
+    interpreterSeconds = results["interpreter"]["seconds"]
+    withinBudget = True
+
+    print(f"{'command':<14}{'median (s)':>12}{'overhead (s)':>14}  result")
+    for commandName, result in results.items():
+        if commandName == "interpreter":
+            print(f"{commandName:<14}{result['seconds']:>12.4f}{'-':>14}")
+            continue
+
+        overhead = result["seconds"] - interpreterSeconds
+        problems: list[str] = []
+        if overhead > budgetSeconds:
+            problems.append(f"over the budget of {budgetSeconds} s")
+        if result["heavyModules"]:
+            problems.append(f"imports {', '.join(result['heavyModules'])}")
+        withinBudget = withinBudget and not problems
+        print(f"{commandName:<14}{result['seconds']:>12.4f}{overhead:>14.4f}  {'; '.join(problems) or 'ok'}")
+    return withinBudget
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check the startup time of the command line interface.")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET_SECONDS,
+                        help="the time a run may take on top of the bare interpreter, in seconds")
+    parser.add_argument("--repeat", type=int, default=10, help="number of runs per command")
+    arguments = parser.parse_args()
+
+    if not checkBudget(measureStartup(arguments.repeat), arguments.budget):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
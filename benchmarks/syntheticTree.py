@@ -0,0 +1,147 @@
+import os
+import random
+import struct
+from datetime import datetime, timedelta
+from io import BytesIO
+
+from PIL import Image
+
+#### SYNTHETIC MEDIA TREE ####
+"""
+This module generates a synthetic media tree for benchmarks. The tree has a configurable
+number of files spread over folders of a configurable depth and fan-out. Images are small
+JPEG and PNG files with realistic EXIF data (camera make and model, date/time, resolution,
+and GPS coordinates); videos are minimal MP4 files with a 'moov'/'mvhd' header followed by
+dummy payload. File names mix camera-style names with dates and names without any digits,
+and some files share the same date, so every stage of the pipeline has work to do.
+The generator is deterministic for a given seed.
+"""
+
+CAMERAS: list[tuple[str, str]] = [
+    ("Canon", "Canon EOS 5D Mark IV"), ("NIKON CORPORATION", "NIKON D750"),
+    ("Apple", "iPhone 12 Pro"), ("samsung", "SM-G991B"), ("SONY", "ILCE-7M3"),
+]
+FOLDER_NAMES: list[str] = ["Holiday", "Birthday", "Family", "Camping", "Wedding", "Trip", "Garden", "Misc"]
+
+# Seconds between 1904-01-01 (the MP4 epoch) and 1970-01-01
+MP4_EPOCH_OFFSET = 2082844800
+
+def _gpsCoordinate(value: float) -> tuple[float, float, float]:
+    degrees = int(abs(value))
+    minutes = int((abs(value) - degrees) * 60)
+    seconds = round(((abs(value) - degrees) * 60 - minutes) * 60, 2)
+    return float(degrees), float(minutes), seconds
+
+def _buildExif(randomGenerator: random.Random, dateTime: datetime) -> Image.Exif:
+    make, model = randomGenerator.choice(CAMERAS)
+    latitude = randomGenerator.uniform(-60, 60)
+    longitude = randomGenerator.uniform(-170, 170)
+
+    exif = Image.Exif()
+    exif[0x010F] = make
+    exif[0x0110] = model
+    exif[0x0131] = "Synthetic 1.0"
+    exif[0x0132] = dateTime.strftime("%Y:%m:%d %H:%M:%S")
+    exif[0x011A] = 72.0
+    exif[0x011B] = 72.0
+    exif[0x0128] = 2
+    exif[0x0112] = randomGenerator.choice([1, 3, 6, 8])
+    exif[0x8825] = {
+        1: "N" if latitude >= 0 else "S", 2: _gpsCoordinate(latitude),
+        3: "E" if longitude >= 0 else "W", 4: _gpsCoordinate(longitude),
+        6: round(randomGenerator.uniform(0, 500), 1),
+    }
+    return exif
+
+def _buildMp4(dateTime: datetime, durationSeconds: int, payloadSize: int) -> bytes:
+    creationTime = int(dateTime.timestamp()) + MP4_EPOCH_OFFSET
+    timescale = 1000
+
+    # mvhd version 0: creation and modification time, timescale and duration, followed by the fixed fields
+    mvhdBody = struct.pack(">B3xIIII", 0, creationTime, creationTime, timescale, durationSeconds * timescale)
+    mvhdBody += struct.pack(">IH10x", 0x00010000, 0x0100) + bytes(36) + bytes(24) + struct.pack(">I", 2)
+    mvhd = struct.pack(">I4s", 8 + len(mvhdBody), b"mvhd") + mvhdBody
+    moov = struct.pack(">I4s", 8 + len(mvhd), b"moov") + mvhd
+    ftyp = struct.pack(">I4s4sI4s4s", 24, b"ftyp", b"isom", 0x200, b"isom", b"mp41")
+    mdat = struct.pack(">I4s", 8 + payloadSize, b"mdat") + bytes(payloadSize)
+    return ftyp + moov + mdat
+
+def _buildFileName(randomGenerator: random.Random, dateTime: datetime, index: int, extension: str) -> str:
+    style = randomGenerator.random()
+    if style < 0.5:
+        return f"IMG_{dateTime:%Y%m%d_%H%M%S}_{index}{extension}"
+    if style < 0.8:
+        return f"DSC{index:05d}{extension}"
+    # A name without any digits, made unique by spelling the index in letters
+    letters = ""
+    while True:
+        index, remainder = divmod(index, 26)
+        letters = chr(97 + remainder) + letters
+        if index == 0:
+            return f"photo {letters}{extension}"
+
+def generateTree(rootFolder: str, fileCount: int = 1000, depth: int = 2, fanOut: int = 4,
+                 videoRatio: float = 0.1, pngRatio: float = 0.2, seed: int = 0) -> dict[str, int]:
+    """
+    Generates a synthetic media tree.
+
+    Args:
+        rootFolder (str): The folder to create the tree in.
+        fileCount (int): The total number of media files.
+        depth (int): The number of folder levels below the root folder.
+        fanOut (int): The number of subfolders per folder.
+        videoRatio (float): The fraction of files that are videos.
+        pngRatio (float): The fraction of images that are PNG files.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        dict[str, int]: The number of folders, images and videos that were generated.
+    """
+    randomGenerator = random.Random(seed)
+
+    # Build the folder tree breadth first
+    folders: list[str] = [rootFolder]
+    currentLevel: list[str] = [rootFolder]
+    for level in range(depth):
+        nextLevel: list[str] = []
+        for parentFolder in currentLevel:
+            for childIndex in range(fanOut):
+                folderName = f"{randomGenerator.choice(FOLDER_NAMES)} {2005 + (level * fanOut + childIndex) % 18}"
+                nextLevel.append(os.path.join(parentFolder, f"{folderName} {childIndex}"))
+        folders.extend(nextLevel)
+        currentLevel = nextLevel
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+
+    # Encode a few base images once; the EXIF data is added per file
+    baseImages: list[Image.Image] = [
+        Image.new("RGB", (96, 64), (randomGenerator.randrange(256), randomGenerator.randrange(256), randomGenerator.randrange(256)))
+        for _ in range(8)
+    ]
+
+    counts = {"folders": len(folders), "images": 0, "videos": 0}
+    startDate = datetime(2005, 1, 1)
+
+    for index in range(fileCount):
+        folder = randomGenerator.choice(folders)
+        # Round to whole hours now and then, so some files share the same date/time
+        dateTime = startDate + timedelta(seconds=randomGenerator.randrange(18 * 365 * 24 * 3600))
+        if randomGenerator.random() < 0.1:
+            dateTime = dateTime.replace(minute=0, second=0)
+
+        if randomGenerator.random() < videoRatio:
+            fileName = _buildFileName(randomGenerator, dateTime, index, randomGenerator.choice([".mp4", ".mov"]))
+            fileData = _buildMp4(dateTime, randomGenerator.randrange(1, 600), randomGenerator.randrange(1024, 16384))
+            counts["videos"] += 1
+        else:
+            imageFormat = "PNG" if randomGenerator.random() < pngRatio else "JPEG"
+            fileName = _buildFileName(randomGenerator, dateTime, index, ".png" if imageFormat == "PNG" else ".jpg")
+            buffer = BytesIO()
+            randomGenerator.choice(baseImages).save(buffer, format=imageFormat, exif=_buildExif(randomGenerator, dateTime))
+            fileData = buffer.getvalue()
+            counts["images"] += 1
+
+        with open(os.path.join(folder, fileName), "wb") as mediaFile:
+            mediaFile.write(fileData)
+
+    return counts
@@ -0,0 +1,128 @@
+import json
+import os
+import shutil
+from typing import Iterator
+
+from reporting.logger import getLogger
+from storage.records import dumpRecord, loadRecord
+
+#### EXTRACTION CHECKPOINT ####
+"""
+This module keeps the progress of an extraction on disk, so a run that crashes or is killed
+(a corrupt image, an unmounted share) can be resumed instead of starting over. The metadata
+records are written to the .mediaMetaData.checkpoint folder in the source folder in chunks
+of JSON lines (see storage/records.py), so reading a checkpoint back cannot run code, and a
+JSON manifest lists the completed chunks, the settings of the run and the warnings and
+errors about single files so far. Chunks and the manifest are written to a temporary file
+first and then moved into place, so a checkpoint is never half written: a chunk only counts
+once the manifest names it. A resumed run reads the records of the completed chunks back,
+and leaves their files out of the walk (see `processedPaths`); as the files are extracted in
+walk order, folders whose files were all checkpointed are skipped, and the folder the run
+stopped in continues with its first file that was not checkpointed. A checkpoint written
+with other settings (e.g. another EXIF tag allow-list) is discarded. The folder is removed
+once the metadata table has been written.
+"""
+
+logger = getLogger(__name__)
+
+CHECKPOINT_FOLDER_NAME = ".mediaMetaData.checkpoint"
+MANIFEST_FILE_NAME = "manifest.json"
+
+# Increase when the layout of the chunks or the manifest changes, so old checkpoints are discarded
+CHECKPOINT_VERSION = 2
+
+
+def _replaceAtomically(filePath: str, writeContent) -> None:
+    # Write next to the target and move it into place, so a killed run leaves the old file or the new one
+    temporaryPath = filePath + ".tmp"
+    with open(temporaryPath, "wb") as temporaryFile:
+        writeContent(temporaryFile)
+    os.replace(temporaryPath, filePath)
+
+
+class ExtractionCheckpoint:
+    """
+    The checkpoint of an extraction in the source folder.
+
+    Args:
+        sourceFolder (str): The path to the folder that is extracted.
+        settings (dict): The JSON-serializable settings that change the records, e.g. the EXIF
+                         tag allow-list. A checkpoint is only resumed with the same settings.
+        resume (bool): If True, the completed chunks of an existing checkpoint are kept;
+                       otherwise an existing checkpoint is discarded.
+    """
+
+    def __init__(self, sourceFolder: str, settings: dict, resume: bool = False) -> None:
+        self.folder = os.path.join(sourceFolder, CHECKPOINT_FOLDER_NAME)
+        # Compare the settings as they are read back from JSON, where tuples become lists
+        self.settings: dict = json.loads(json.dumps(settings))
+        self.chunkNames: list[str] = []
+        self.fileErrors: list[dict] = []
+
+        manifest = self._readManifest() if resume else None
+        if manifest is not None:
+            self.chunkNames = manifest["chunks"]
+            self.fileErrors = manifest["fileErrors"]
+            logger.info("Resuming the extraction from a checkpoint with %d chunks.", len(self.chunkNames))
+        else:
+            if resume:
+                logger.info("No checkpoint to resume from in %s; extracting all files.", self.folder)
+            shutil.rmtree(self.folder, ignore_errors=True)
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _readManifest(self) -> dict | None:
+        try:
+            with open(os.path.join(self.folder, MANIFEST_FILE_NAME), encoding="utf-8") as manifestFile:
+                manifest = json.load(manifestFile)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("version") != CHECKPOINT_VERSION or manifest.get("settings") != self.settings:
+            logger.warning("The checkpoint in %s was written with other settings and is discarded.", self.folder)
+            return None
+        return manifest
+
+    def _writeManifest(self) -> None:
+        manifest = {"version": CHECKPOINT_VERSION, "settings": self.settings,
+                    "chunks": self.chunkNames, "fileErrors": self.fileErrors}
+        content = json.dumps(manifest, default=str, ensure_ascii=False).encode("utf-8")
+        _replaceAtomically(os.path.join(self.folder, MANIFEST_FILE_NAME), lambda manifestFile: manifestFile.write(content))
+
+    @property
+    def chunkPaths(self) -> list[str]:
+        return [os.path.join(self.folder, chunkName) for chunkName in self.chunkNames]
+
+    def iterChunks(self) -> Iterator[list[dict]]:
+        """
+        Yields the records of the completed chunks, one chunk at a time, in the order they were added.
+        """
+        for chunkPath in self.chunkPaths:
+            with open(chunkPath, encoding="utf-8") as chunkFile:
+                yield [loadRecord(line) for line in chunkFile]
+
+    def processedPaths(self) -> frozenset[str]:
+        """
+        Returns the paths of the files whose records are in the completed chunks.
+        """
+        return frozenset(record["path"] for chunk in self.iterChunks() for record in chunk)
+
+    def addChunk(self, chunk: list[dict], fileErrors: list[dict]) -> str:
+        """
+        Writes a chunk of records, and the warnings and errors about single files logged since
+        the previous chunk, and then the manifest that makes the chunk part of the checkpoint.
+
+        Returns:
+            str: The path of the written chunk.
+        """
+        chunkName = f"chunk{len(self.chunkNames):06d}.jsonl"
+        chunkPath = os.path.join(self.folder, chunkName)
+        # One record per line; JSON escapes line breaks inside strings
+        content = "".join(dumpRecord(record) + "\n" for record in chunk).encode("utf-8")
+        _replaceAtomically(chunkPath, lambda chunkFile: chunkFile.write(content))
+
+        self.chunkNames.append(chunkName)
+        self.fileErrors.extend(fileErrors)
+        self._writeManifest()
+        return chunkPath
+
+    def remove(self) -> None:
+        shutil.rmtree(self.folder, ignore_errors=True)
@@ -1,20 +1,185 @@
+import os
+import tempfile
+from itertools import islice
+from typing import Callable, Iterable, Iterator
+
 import pandas as pd
 import PIL; from PIL import Image
 
+from extraction.checkpoint import ExtractionCheckpoint
+from extraction.metadata.walker import SUPPORTED_TYPES
+from storage.formats import FILE_ERRORS_FILE_NAME, getTablePath, openTableWriter, writeTable
+from profiling.profiler import profileStage
+from reporting.logger import collectFileErrors, getLogger
+
 #### DATA EXTRACTION ####
-## This module is used to extract data from image and video files in a specified folder. It retrieves metadata from exif data for images and regular metadata for both images and videos. The supported file types are specified as a list of tuples, where each tuple contains the file extensions for image and video files respectively. The function `extractData` takes a source folder path and an optional maximum image pixel limit to avoid decompression bomb errors. It retrieves the metadata for all files in the folder and its subfolders, and saves the extracted data as a CSV file in the source folder.
+## This module is used to extract data from image and video files in a specified folder. It retrieves metadata from exif data for images and regular metadata for both images and videos. The supported file types are specified as a list of tuples, where each tuple contains the file extensions for image and video files respectively. The function `extractData` retrieves the metadata for all files in the folder and its subfolders and streams it, in chunks of `chunkSize` files, to the metadata table (CSV, Parquet or Feather) in the source folder, or returns it as a DataFrame with `returnDataFrame`. The other arguments choose how the files are read (`engine`, `workers`, `useCache`, `exifTags`) and which library-wide columns are added (`detectDuplicates`, `perceptualHash`). The progress is checkpointed, so an interrupted run can be continued with `resume`, and files that could not be read completely are listed in the .mediaMetaData.errors table.
+
+logger = getLogger(__name__)
+
+# The columns of the table of files that could not be read completely
+FILE_ERROR_COLUMNS: list[str] = ["path", "level", "logger", "tag", "message"]
+
+# The values of every record that the library-wide columns are computed from
+LIBRARY_KEYS: tuple[str, ...] = ("path", "fileSize", "perceptualHash")
+
+def _getLibraryColumns(libraryData: dict[str, list], cache, workers: int, detectDuplicates: bool, perceptualHash: bool) -> dict[str, list]:
+    # Compute the columns that depend on all files at once, such as duplicates of earlier files
+    libraryColumns: dict[str, list] = {}
+    if detectDuplicates:
+        from extraction.metadata.duplicates import findDuplicates
+        with profileStage("duplicates"):
+            libraryColumns["contentHash"], libraryColumns["duplicateOf"] = findDuplicates(libraryData["path"], libraryData["fileSize"], cache, max(workers, 8))
+    if perceptualHash:
+        from extraction.metadata.perceptual import findSimilarImages
+        with profileStage("similarImages"):
+            libraryColumns["similarTo"] = findSimilarImages(libraryData["path"], libraryData["perceptualHash"])
+    return libraryColumns
+
+def _iterCheckpointedChunks(records: Iterable[dict], checkpoint: ExtractionCheckpoint, chunkSize: int,
+                            fileErrors: list[dict], cache=None) -> Iterator[list[dict]]:
+    # The chunks of a resumed run come first; they hold the files that were first in walk order
+    yield from checkpoint.iterChunks()
+
+    records = iter(records)
+    savedErrors: int = len(fileErrors)
+    while chunk := list(islice(records, chunkSize)):
+        # The cache is committed with every chunk, so a killed run keeps the EXIF data it read
+        if cache is not None:
+            cache.forgetEntries(fileError["path"] for fileError in fileErrors[savedErrors:])
+            cache.commit()
+        with profileStage("spill"):
+            checkpoint.addChunk(chunk, fileErrors[savedErrors:])
+        savedErrors = len(fileErrors)
+        yield chunk
+
+def _writeRecordsInChunks(records: Iterable[dict], sourceFolder: str, fileFormat: str, chunkSize: int,
+                          libraryPass: Callable[[dict[str, list]], dict[str, list]] | None = None,
+                          checkpoint: ExtractionCheckpoint | None = None, fileErrors: list[dict] | None = None, cache=None) -> int:
+    # Without a checkpoint, the chunks are spilled to a temporary folder that is removed afterwards
+    if checkpoint is None:
+        with tempfile.TemporaryDirectory(prefix="mediaMetaData.") as spillFolder:
+            return _writeRecordsInChunks(records, sourceFolder, fileFormat, chunkSize, libraryPass,
+                                         ExtractionCheckpoint(spillFolder, {}), fileErrors, cache)
+
+    # Keep the columns in order of first appearance, as pd.DataFrame(list[dict]) does
+    columns: dict[str, None] = {}
+    rowCount: int = 0
+    libraryData: dict[str, list] = {key: [] for key in LIBRARY_KEYS}
+
+    # Spill the records to disk in chunks while collecting the columns
+    for chunk in _iterCheckpointedChunks(records, checkpoint, chunkSize, fileErrors if fileErrors is not None else [], cache):
+        for record in chunk:
+            columns.update(dict.fromkeys(record))
+        if libraryPass is not None:
+            for key in LIBRARY_KEYS:
+                libraryData[key].extend(record.get(key) for record in chunk)
+
+    # The library-wide columns can only be computed once all files are known
+    libraryColumns: dict[str, list] = libraryPass(libraryData) if libraryPass is not None else {}
+    columns.update(dict.fromkeys(libraryColumns))
 
-def extractData(sourceFolder, maxImagePixels = None, supportedTypes = [(".gif", ".jpg", ".jpeg", ".png"), (".mov", ".mp4", ".mpg", ".mts")]) -> None:
+    # Write the chunks with all columns and a continuous index
+    tableWriter = openTableWriter(sourceFolder, fileFormat, list(columns))
+
+    for chunk in checkpoint.iterChunks():
+        chunkFrame = pd.DataFrame(chunk, columns=list(columns), index=range(rowCount, rowCount + len(chunk)))
+        for columnName, columnValues in libraryColumns.items():
+            chunkFrame[columnName] = columnValues[rowCount:rowCount + len(chunk)]
+        with profileStage("tableWrite"):
+            tableWriter.writeChunk(chunkFrame)
+        rowCount += len(chunk)
+
+    with profileStage("tableWrite"):
+        tableWriter.close()
+
+    return rowCount
+
+def _writeFileErrors(fileErrors: list[dict], sourceFolder: str, fileFormat: str) -> str | None:
+    # The table of a previous run is removed, so it does not list files that can be read now
+    errorsPath = getTablePath(sourceFolder, fileFormat, FILE_ERRORS_FILE_NAME)
+    if not fileErrors:
+        if os.path.exists(errorsPath):
+            os.remove(errorsPath)
+        return None
+
+    # Files that were in flight when a run was interrupted are extracted again, and logged twice
+    errorsFrame = pd.DataFrame(fileErrors, columns=FILE_ERROR_COLUMNS).drop_duplicates(ignore_index=True)
+    writeTable(errorsFrame, sourceFolder, fileFormat, FILE_ERRORS_FILE_NAME)
+    logger.warning("%d files could not be read completely; see %s", errorsFrame["path"].nunique(), errorsPath)
+    return errorsPath
+
+def extractData(sourceFolder, maxImagePixels = None, supportedTypes = SUPPORTED_TYPES, workers = 1, useCache = True, chunkSize = 10000, returnDataFrame = False, fileFormat = "csv", detectDuplicates = False, perceptualHash = False, exifTags = None, engine = "auto", maxInFlight = 64, checkpoint = True, resume = False) -> pd.DataFrame | None:
 
     # Set the maximum image pixels to avoid decompression bomb errors
     PIL.Image.MAX_IMAGE_PIXELS = maxImagePixels
 
-    # Get the list of metadata dictionaries for all files in the source folder
-    from extraction.metadata.dictionaries import getDataDictionaryList
-    ## This function retrieves exif and regular metadata from image and video files in the specified folder and its subfolders.
-    metadataList: list[dict] = getDataDictionaryList(sourceFolder, supportedTypes)
+    # Stream the metadata dictionaries for all files in the source folder
+    from extraction.metadata.dictionaries import iterDataDictionaries
+    from extraction.metadata.cache import ExtractionCache
+    cache = ExtractionCache(sourceFolder) if useCache else None
+    # Tags that are not on the allow-list are skipped before they are decoded, so they never become columns
+    exifTags = frozenset(exifTags) if exifTags is not None else None
+
+    # A checkpoint is only resumed by a run that would produce the same records
+    extractionCheckpoint: ExtractionCheckpoint | None = None
+    skipPaths: frozenset[str] = frozenset()
+    resumedErrors: list[dict] = []
+    if checkpoint or resume:
+        settings = {"supportedTypes": supportedTypes, "exifTags": sorted(exifTags) if exifTags is not None else None,
+                    "perceptualHash": perceptualHash}
+        extractionCheckpoint = ExtractionCheckpoint(sourceFolder, settings, resume)
+        skipPaths = extractionCheckpoint.processedPaths()
+        resumedErrors = list(extractionCheckpoint.fileErrors)
+        # The cached EXIF data of the checkpointed files is not looked up, but must not be evicted
+        if cache is not None:
+            cache.markSeen(skipPaths)
+
+    df: pd.DataFrame | None = None
+    fileErrors: list[dict] = []
+    completed = False
+    try:
+        with collectFileErrors() as fileErrors:
+            ## This generator retrieves exif and regular metadata from image and video files in the specified folder and its subfolders.
+            metadataRecords: Iterable[dict] = iterDataDictionaries(sourceFolder, supportedTypes, workers, cache, perceptualHash, exifTags,
+                                                                   engine, maxInFlight, skipPaths)
+
+            # Duplicates and similar images are found once all files are known, reusing cached hashes of unchanged files
+            libraryPass = (lambda libraryData: _getLibraryColumns(libraryData, cache, workers, detectDuplicates, perceptualHash)) \
+                if detectDuplicates or perceptualHash else None
+
+            # Either return the metadata records as a DataFrame, or write them to the CSV file in chunks
+            if returnDataFrame:
+                with profileStage("extraction"):
+                    if extractionCheckpoint is not None:
+                        metadataRecords = [record for chunk in _iterCheckpointedChunks(metadataRecords, extractionCheckpoint, chunkSize, fileErrors, cache)
+                                           for record in chunk]
+                    else:
+                        metadataRecords = list(metadataRecords)
+                with profileStage("dataFrame"):
+                    df = pd.DataFrame(metadataRecords)
+                if libraryPass is not None and not df.empty:
+                    libraryData = {key: df[key].tolist() if key in df.columns else [None] * len(df) for key in LIBRARY_KEYS}
+                    for columnName, columnValues in libraryPass(libraryData).items():
+                        df[columnName] = columnValues
+            else:
+                # The extraction stage includes spilling and writing the table, which are also timed separately
+                with profileStage("extraction"):
+                    _writeRecordsInChunks(metadataRecords, sourceFolder, fileFormat, chunkSize, libraryPass,
+                                          extractionCheckpoint, fileErrors, cache)
+        completed = True
+    finally:
+        # Files that could not be read are not cached, so every run lists them in the error table.
+        # An interrupted run has not seen every file, so it must not evict the entries of the others
+        if cache is not None:
+            cache.forgetEntries(fileError["path"] for fileError in fileErrors)
+            cache.close(evictUnseen = completed)
+
+    _writeFileErrors(resumedErrors + fileErrors, sourceFolder, fileFormat)
+    # The checkpoint is only removed once the run is complete
+    if extractionCheckpoint is not None:
+        extractionCheckpoint.remove()
 
-    # Create a dataframe from the list of dictionaries and save it as a CSV file
-    pd.DataFrame(metadataList).to_csv(path_or_buf = (sourceFolder + "\\.mediaMetaData.csv"), sep = ";")
+    return df
 
-#### ####
\ No newline at end of file
+#### ####
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Iterator
+
+from extraction.metadata.exifdata import getExifData
+from extraction.metadata.cache import ExtractionCache
+from extraction.metadata.dictionaries import extractIsolated
+from extraction.metadata.parallel import _getRegularEntryData, _getVideoDataProfiled, _iterSupportedFiles
+from profiling.profiler import getProfiler
+
+#### ASYNCHRONOUS LIST OF METADATA DICTIONARIES ####
+"""
+This module is the asynchronous counterpart of `iterDataDictionaries`, for media on network
+storage (SMB, NFS) where every stat and header read waits tens of milliseconds for a round
+trip. Every file is a coroutine that stats it, looks it up in the cache and reads its EXIF
+data or video headers; the blocking calls run in a thread pool, so up to `maxInFlight`
+round trips are waiting at the same time. The walker runs ahead of the results by at most a
+few times `maxInFlight` files (back-pressure), so memory use does not grow with the tree, and
+the results are yielded in the same order as the serial implementation. The cache is only
+used from the thread of the event loop, as its SQLite connection cannot be shared.
+"""
+
+# How many files the walker may run ahead of the file that is yielded next, per in-flight read
+READ_AHEAD_FACTOR = 4
+
+
+def _getExifDataProfiled(filePath: str, metaDataDictionary: dict, perceptualHash: bool, exifTags: frozenset | None) -> dict:
+    startTime = time.perf_counter()
+    metaDataDictionary = getExifData(filePath, metaDataDictionary, perceptualHash, exifTags)
+    if (profiler := getProfiler()) is not None:
+        profiler.recordFile("exif", filePath, time.perf_counter() - startTime)
+    return metaDataDictionary
+
+
+async def _getDataDictionaryAsync(threadPool: ThreadPoolExecutor, root: str, fileEntry: os.DirEntry,
+                                  imageExtensions: tuple[str, ...], cache: ExtractionCache | None,
+                                  perceptualHash: bool, exifTags: frozenset | None) -> dict:
+    loop = asyncio.get_running_loop()
+    fullPath, metaDataDict, fileStat = await loop.run_in_executor(threadPool, _getRegularEntryData, root, fileEntry)
+
+    if os.path.splitext(fileEntry.name)[1].lower() in imageExtensions:
+        requiredKeys = frozenset({"perceptualHash"}) if perceptualHash else frozenset()
+        if cache is not None and cache.loadExifData(fullPath, metaDataDict, fileStat, requiredKeys, exifTags):
+            return metaDataDict
+        metaDataDict = await loop.run_in_executor(threadPool, partial(extractIsolated, _getExifDataProfiled), fullPath, metaDataDict, perceptualHash, exifTags)
+    else:
+        if cache is not None and cache.loadExifData(fullPath, metaDataDict, fileStat):
+            return metaDataDict
+        metaDataDict = await loop.run_in_executor(threadPool, partial(extractIsolated, _getVideoDataProfiled), fullPath, metaDataDict)
+
+    if cache is not None:
+        cache.storeExifData(fullPath, metaDataDict)
+    return metaDataDict
+
+
+def iterDataDictionariesAsync(sourceFolder: str, supportedTypes: list[tuple[str, ...]], maxInFlight: int = 64,
+                              cache: ExtractionCache | None = None, perceptualHash: bool = False,
+                              exifTags: frozenset | None = None, skipPaths: frozenset[str] = frozenset()) -> Iterator[dict]:
+    """
+    Collects metadata for all supported media files within a given source folder, with many
+    stat and header reads waiting at the same time.
+
+    Args:
+        sourceFolder (str): The path to the root folder to scan.
+        supportedTypes (list[tuple]): A list where each tuple contains file extensions
+                                       for a specific media type (e.g., image, video).
+        maxInFlight (int): The maximum number of blocking reads (stat, EXIF, video headers)
+                           that run at the same time.
+        cache (ExtractionCache | None): If provided, EXIF data of unchanged files is reused
+                                        from the cache instead of being read.
+        perceptualHash (bool): If True, a perceptual hash is added to the metadata of images.
+        exifTags (frozenset | None): If provided, only these EXIF tags are extracted.
+        skipPaths (frozenset[str]): The paths of files that are left out.
+
+    Yields:
+        dict: A dictionary containing the metadata for a file, in the same order
+              as `iterDataDictionaries`.
+    """
+    imageExtensions = supportedTypes[0]
+    videoExtensions = supportedTypes[1]
+    supportedFiles = _iterSupportedFiles(sourceFolder, imageExtensions + videoExtensions, skipPaths)
+    maxPending = maxInFlight * READ_AHEAD_FACTOR
+
+    loop = asyncio.new_event_loop()
+    threadPool = ThreadPoolExecutor(max_workers=maxInFlight, thread_name_prefix="mediaMetaDataAsync")
+    pendingTasks: deque[asyncio.Task] = deque()
+
+    async def fillAndTakeNext() -> dict | None:
+        # Listing a folder is a round trip too, so the walker also runs in the thread pool
+        while len(pendingTasks) < maxPending:
+            supportedFile = await loop.run_in_executor(threadPool, next, supportedFiles, None)
+            if supportedFile is None:
+                break
+            pendingTasks.append(loop.create_task(_getDataDictionaryAsync(threadPool, *supportedFile, imageExtensions,
+                                                                         cache, perceptualHash, exifTags)))
+        return await pendingTasks.popleft() if pendingTasks else None
+
+    try:
+        # The loop only runs while the next result is awaited; the reads in the thread pool continue in between
+        while (metaDataDict := loop.run_until_complete(fillAndTakeNext())) is not None:
+            yield metaDataDict
+    finally:
+        for pendingTask in pendingTasks:
+            pendingTask.cancel()
+        if pendingTasks:
+            loop.run_until_complete(asyncio.gather(*pendingTasks, return_exceptions=True))
+        threadPool.shutdown(wait=True, cancel_futures=True)
+        loop.close()
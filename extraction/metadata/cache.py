@@ -0,0 +1,186 @@
+import json
+import os
+import sqlite3
+
+from extraction.metadata.exifschema import getTagSchema
+from profiling.profiler import getProfiler
+from reporting.logger import getLogger
+from storage.records import dumpRecord, loadRecord
+
+#### EXTRACTION CACHE ####
+"""
+This module keeps a persistent cache of extracted EXIF data (and the metadata read from
+video containers) in a SQLite sidecar file next to the metadata CSV. Entries are keyed on
+the file path and are only reused while the file size and modification time (in nanoseconds)
+are unchanged, so unchanged images are not re-opened on the next run. Entries of files that
+changed or were not seen during a run are evicted. The number of hits, misses and evictions
+is reported when the cache is closed. The EXIF data is stored as JSON (see
+storage/records.py), never pickled, so a cache file on a shared folder cannot make the
+extractor run code. The partial and full content hashes of the duplicate detection are kept
+in a second table with the same key. Entries remember the EXIF tag allow-list they were
+extracted with, and are only reused by runs whose tag schema it covers; entries without an
+allow-list only have the default tags of the EXIF sub-IFD. Runs that do not finish (e.g. an
+interrupted extraction that is resumed from its checkpoint) commit what they stored, but
+evict nothing.
+"""
+
+logger = getLogger(__name__)
+
+CACHE_FILE_NAME = ".mediaMetaData.cache.sqlite"
+
+# Increase when the layout of the cached rows changes, so stale caches are discarded
+SCHEMA_VERSION = 6
+
+# Keys that getExifData only adds on request; they are only loaded when requested
+OPTIONAL_EXIF_KEYS: frozenset[str] = frozenset({"perceptualHash"})
+
+
+class ExtractionCache:
+    def __init__(self, sourceFolder: str, cacheFileName: str = CACHE_FILE_NAME) -> None:
+        self.cachePath = os.path.join(sourceFolder, cacheFileName)
+        self.connection = sqlite3.connect(self.cachePath)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._seenPaths: set[str] = set()
+        self._hashesUsed = False
+        self._pendingEntries: dict[str, tuple[tuple[int, int], frozenset, frozenset | None]] = {}
+
+        # Discard caches that were written with a different row layout
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS files")
+            self.connection.execute("DROP TABLE IF EXISTS hashes")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, fileSize INTEGER NOT NULL, mtime INTEGER NOT NULL, exifData TEXT NOT NULL, exifTags TEXT)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "path TEXT PRIMARY KEY, fileSize INTEGER NOT NULL, mtime INTEGER NOT NULL, partialHash TEXT NOT NULL, fullHash TEXT)"
+        )
+
+    def loadExifData(self, filePath: str, metaDataDictionary: dict, fileStat: os.stat_result | OSError | None = None,
+                     requiredKeys: frozenset[str] = frozenset(), exifTags: frozenset | None = None) -> bool:
+        """
+        Adds the cached EXIF data of a file to its metadata dictionary. Returns False if the
+        file is new or changed, or if the cached entry lacks one of the optional `requiredKeys`
+        or was extracted with an allow-list that does not cover `exifTags`, in which case
+        `storeExifData` should be called after extraction. The stat result of the walker (or the
+        error of its failed stat) can be passed in, so the file is not stat'ed again. With `exifTags`, only those tags are
+        added from an entry that has more.
+        """
+        self._seenPaths.add(filePath)
+
+        if fileStat is None:
+            try:
+                fileStat = os.stat(filePath)
+            except OSError as e:
+                fileStat = e
+        if isinstance(fileStat, OSError):
+            self.misses += 1
+            return False
+        cacheKey = (fileStat.st_size, fileStat.st_mtime_ns)
+
+        cachedEntry = self.connection.execute(
+            "SELECT fileSize, mtime, exifData, exifTags FROM files WHERE path = ?", (filePath,)
+        ).fetchone()
+
+        if cachedEntry is not None and cachedEntry[:2] == cacheKey:
+            exifData: dict = loadRecord(cachedEntry[2])
+            # An entry without an allow-list has all tags of the main IFD, but only the default tags of the EXIF sub-IFD
+            cachedTags: frozenset | None = frozenset(json.loads(cachedEntry[3])) if cachedEntry[3] is not None else None
+            if requiredKeys <= exifData.keys() and getTagSchema(cachedTags).covers(getTagSchema(exifTags)):
+                self.hits += 1
+                # The allow-list names tags, which can become other columns (e.g. 'GPSInfo' becomes 'GPSLatitude')
+                columnNames = getTagSchema(exifTags).columnNames if exifTags is not None else None
+                metaDataDictionary.update((key, value) for key, value in exifData.items()
+                                          if (key in requiredKeys if key in OPTIONAL_EXIF_KEYS else columnNames is None or key in columnNames))
+                return True
+
+        if cachedEntry is not None:
+            self.evictions += 1
+        self.misses += 1
+        self._pendingEntries[filePath] = (cacheKey, frozenset(metaDataDictionary), exifTags)
+        return False
+
+    def storeExifData(self, filePath: str, metaDataDictionary: dict) -> None:
+        if filePath not in self._pendingEntries:
+            return
+        (fileSize, mtime), regularKeys, exifTags = self._pendingEntries.pop(filePath)
+
+        # Only the entries added by getExifData are cached; the regular data is always refreshed
+        exifData = {key: value for key, value in metaDataDictionary.items() if key not in regularKeys}
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files (path, fileSize, mtime, exifData, exifTags) VALUES (?, ?, ?, ?, ?)",
+            (filePath, fileSize, mtime, dumpRecord(exifData), json.dumps(sorted(exifTags)) if exifTags is not None else None),
+        )
+
+    def loadHashes(self, filePath: str, fileStat: os.stat_result) -> tuple[str, str | None] | None:
+        """
+        Returns the cached partial and full hash of a file, or None if the file is new or changed.
+        The full hash is None if it was not needed before.
+        """
+        self._seenPaths.add(filePath)
+        self._hashesUsed = True
+
+        cachedEntry = self.connection.execute(
+            "SELECT fileSize, mtime, partialHash, fullHash FROM hashes WHERE path = ?", (filePath,)
+        ).fetchone()
+
+        if cachedEntry is not None and cachedEntry[:2] == (fileStat.st_size, fileStat.st_mtime_ns):
+            return cachedEntry[2], cachedEntry[3]
+        return None
+
+    def storeHashes(self, filePath: str, fileStat: os.stat_result, partialHash: str, fullHash: str | None) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO hashes (path, fileSize, mtime, partialHash, fullHash) VALUES (?, ?, ?, ?, ?)",
+            (filePath, fileStat.st_size, fileStat.st_mtime_ns, partialHash, fullHash),
+        )
+
+    def markSeen(self, filePaths) -> None:
+        """
+        Keeps the entries of files that were not looked up during this run, e.g. files whose
+        metadata was taken from the checkpoint of an interrupted run, from being evicted.
+        """
+        self._seenPaths.update(filePaths)
+
+    def forgetEntries(self, filePaths) -> None:
+        """
+        Removes the entries of files, e.g. files that could not be read completely, so they are
+        read (and their problems reported) again by the next run.
+        """
+        self.connection.executemany("DELETE FROM files WHERE path = ?", ((filePath,) for filePath in set(filePaths)))
+
+    def commit(self) -> None:
+        # Makes the stored entries durable, e.g. at a checkpoint, so a killed run does not lose them
+        self.connection.commit()
+
+    def close(self, evictUnseen: bool = True) -> None:
+        """
+        Commits the stored entries and closes the cache. With `evictUnseen`, the entries of files
+        that were not seen during this run are evicted, which is only correct after a complete run.
+        """
+        if evictUnseen:
+            # Evict the entries of files that were not seen during this run
+            self.connection.execute("CREATE TEMP TABLE seenPaths (path TEXT PRIMARY KEY)")
+            self.connection.executemany("INSERT INTO seenPaths (path) VALUES (?)", ((path,) for path in self._seenPaths))
+            self.evictions += self.connection.execute(
+                "DELETE FROM files WHERE path NOT IN (SELECT path FROM seenPaths)"
+            ).rowcount
+            # The hashes are only evicted by runs with duplicate detection, which look up every candidate
+            if self._hashesUsed:
+                self.connection.execute("DELETE FROM hashes WHERE path NOT IN (SELECT path FROM seenPaths)")
+
+        self.connection.commit()
+        self.connection.close()
+
+        if (profiler := getProfiler()) is not None:
+            profiler.count("cacheHits", self.hits)
+            profiler.count("cacheMisses", self.misses)
+            profiler.count("cacheEvictions", self.evictions)
+
+        logger.info("Extraction cache: %d hits, %d misses, %d evictions.", self.hits, self.misses, self.evictions)
+
@@ -1,18 +1,42 @@
+import logging
 import os
+import time
+from typing import Callable, Iterator
 
 from extraction.metadata.filedata import getRegularData
 from extraction.metadata.exifdata import getExifData
+from extraction.metadata.videodata import getVideoData
+from extraction.metadata.cache import ExtractionCache
+from extraction.metadata.walker import scanMediaFiles, statEntry
+from profiling.profiler import getProfiler
+from reporting.logger import ProgressReporter, getLogger
 
 #### LIST OF METADATA DICTIONARIES ####
 """
-This module compiles a list of dictionaries, each containing the metadata for a file
-within a specified folder and its subfolders. It uses `os.walk` and the `getRegularData`
-and `getExifData` functions. Supported file types are defined by a list of tuples
-(e.g., image and video extensions). The resulting list of dictionaries can be
-used for further data processing.
+This module compiles a list of dictionaries, each containing the metadata for a file within
+a specified folder and its subfolders. It uses `scanMediaFiles` and the `getRegularData`,
+`getExifData` and `getVideoData` functions. Supported file types are defined by a list of
+tuples (e.g., image and video extensions). The resulting list of dictionaries can be used
+for further data processing. `iterDataDictionaries` yields the same dictionaries one at a
+time, so large trees can be streamed to disk without keeping every file's metadata in
+memory. `getDataDictionary` collects the metadata of a single file. The files are processed
+by one of the ENGINES: one at a time ("serial"), by thread and process pools ("parallel"),
+or as coroutines with many reads in flight, for network storage ("async"). An unexpected
+error while reading one file is logged as an error with the file (see `extractIsolated`),
+and the file keeps the metadata read so far, so a corrupt file neither aborts the run nor
+loses its row. Files whose metadata is already known (e.g. from the checkpoint of an
+interrupted run) can be left out with `skipPaths`. Folders and skipped files are only logged
+at DEBUG level; the progress of the whole extraction is reported by a `ProgressReporter`.
 """
 
-def getDataDictionaryList(sourceFolder: str, supportedTypes: list[tuple[str, ...]]) -> list[dict]:
+logger = getLogger(__name__)
+
+# The ways the files can be processed; "auto" is "serial" for one worker and "parallel" otherwise
+ENGINES: tuple[str, ...] = ("auto", "serial", "parallel", "async")
+
+def getDataDictionaryList(sourceFolder: str, supportedTypes: list[tuple[str, ...]], workers: int = 1,
+                          cache: ExtractionCache | None = None, perceptualHash: bool = False,
+                          exifTags: frozenset | None = None) -> list[dict]:
     """
     Collects metadata for all supported media files within a given source folder.
 
@@ -20,35 +44,143 @@ def getDataDictionaryList(sourceFolder: str, supportedTypes: list[tuple[str, ...
         sourceFolder (str): The path to the root folder to scan.
         supportedTypes (list[tuple]): A list where each tuple contains file extensions
                                        for a specific media type (e.g., image, video).
+        workers (int): The number of concurrent workers.
+        cache (ExtractionCache | None): An optional cache of previously extracted EXIF data.
+        perceptualHash (bool): If True, a perceptual hash is added to the metadata of images.
+        exifTags (frozenset | None): If provided, only these EXIF tags are extracted.
 
     Returns:
         list[dict]: A list of dictionaries, each containing the metadata for a file.
     """
-    metaDataDictionaryList: list[dict] = []
+    return list(iterDataDictionaries(sourceFolder, supportedTypes, workers, cache, perceptualHash, exifTags))
+
+def iterDataDictionaries(sourceFolder: str, supportedTypes: list[tuple[str, ...]], workers: int = 1,
+                         cache: ExtractionCache | None = None, perceptualHash: bool = False,
+                         exifTags: frozenset | None = None, engine: str = "auto", maxInFlight: int = 64,
+                         skipPaths: frozenset[str] = frozenset()) -> Iterator[dict]:
+    """
+    Yields the metadata of all supported media files within a given source folder.
+
+    Args:
+        sourceFolder (str): The path to the root folder to scan.
+        supportedTypes (list[tuple]): A list where each tuple contains file extensions
+                                       for a specific media type (e.g., image, video).
+        workers (int): The number of concurrent workers. With the "auto" engine, values
+                       above 1 use the thread and process pools of `iterDataDictionariesParallel`.
+        cache (ExtractionCache | None): If provided, EXIF data of unchanged images is
+                                        reused from the cache instead of being extracted.
+        perceptualHash (bool): If True, a perceptual hash is added to the metadata of images.
+        exifTags (frozenset | None): If provided, only these EXIF tags are extracted; other
+                                     tags never become columns.
+        engine (str): One of ENGINES. "async" suits network storage, where every file
+                      waits for round trips rather than for the CPU.
+        maxInFlight (int): The maximum number of reads waiting at the same time with the "async" engine.
+        skipPaths (frozenset[str]): The paths of files that are left out, e.g. files whose
+                                    metadata was checkpointed by an interrupted run.
+
+    Yields:
+        dict: A dictionary containing the metadata for a file, in walk order.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unsupported engine '{engine}'. Supported engines: {', '.join(ENGINES)}.")
+    if engine == "auto":
+        engine = "parallel" if workers > 1 else "serial"
+
+    if engine == "async":
+        from extraction.metadata.asyncEngine import iterDataDictionariesAsync
+        metaDataDicts = iterDataDictionariesAsync(sourceFolder, supportedTypes, maxInFlight, cache,
+                                                  perceptualHash=perceptualHash, exifTags=exifTags, skipPaths=skipPaths)
+    elif engine == "parallel":
+        from extraction.metadata.parallel import iterDataDictionariesParallel
+        metaDataDicts = iterDataDictionariesParallel(sourceFolder, supportedTypes, workers, cache,
+                                                     perceptualHash=perceptualHash, exifTags=exifTags, skipPaths=skipPaths)
+    else:
+        metaDataDicts = _iterDataDictionariesSerial(sourceFolder, supportedTypes, cache, perceptualHash, exifTags, skipPaths)
+
+    with ProgressReporter("Extracting metadata") as progress:
+        for metaDataDict in metaDataDicts:
+            progress.advance()
+            yield metaDataDict
+
+def logFolder(root: str, skippedNames: list[str]) -> None:
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Processing files in folder: %s", root)
+        for fileName in skippedNames:
+            logger.debug("Skipping unsupported file: %s", fileName)
+
+def extractIsolated(extract: Callable[..., dict], filePath: str, metaDataDictionary: dict, *args) -> dict:
+    """
+    Runs an extraction function, such as `getExifData` or `getVideoData`, for a single file.
+    Problems the function expects are logged by the function itself; any other error is logged
+    here with the file, and the metadata dictionary is returned with what was read so far.
+    """
+    try:
+        return extract(filePath, metaDataDictionary, *args)
+    except Exception as e:
+        logger.error("Could not extract metadata from %s: %s: %s", filePath, type(e).__name__, e, extra={"file": filePath})
+        return metaDataDictionary
 
+def _iterDataDictionariesSerial(sourceFolder: str, supportedTypes: list[tuple[str, ...]], cache: ExtractionCache | None,
+                                perceptualHash: bool, exifTags: frozenset | None,
+                                skipPaths: frozenset[str] = frozenset()) -> Iterator[dict]:
     imageExtensions = supportedTypes[0]
     videoExtensions = supportedTypes[1]
 
-    for root, _, files in os.walk(sourceFolder):
-        if files:
-            print(f"\nProcessing files in folder: {root}\n")
-
-        for fileName in files:
-            # Get extension once
-            _, fileExtension = os.path.splitext(fileName)
-            fileExtensionLower = fileExtension.lower()
-
-            # Call getRegularData once, as it's common for both
-            # fullPath is retrieved here and can be used for getExifData
-            fullPath, metaDataDict = getRegularData(root, fileName)
-
-            if fileExtensionLower in imageExtensions:
-                # Removed redundant os.path.exists check, rely on getExifData's error handling
-                metaDataDict = getExifData(fullPath, metaDataDict)
-                metaDataDictionaryList.append(metaDataDict)
-            elif fileExtensionLower in videoExtensions:
-                metaDataDictionaryList.append(metaDataDict)
-            else:
-                print(f"Skipping unsupported file: {fileName}")
-
-    return metaDataDictionaryList
\ No newline at end of file
+    # Unsupported files are filtered out by extension before anything is stat'ed
+    for root, fileEntries, skippedNames in scanMediaFiles(sourceFolder, imageExtensions + videoExtensions):
+        logFolder(root, skippedNames)
+
+        for fileEntry in fileEntries:
+            if fileEntry.path in skipPaths:
+                continue
+            # The stat result of the walker is used for the regular data and the cache key
+            yield getDataDictionary(root, fileEntry.name, supportedTypes, cache, statEntry(fileEntry), perceptualHash, exifTags)
+
+def getDataDictionary(root: str, fileName: str, supportedTypes: list[tuple[str, ...]], cache: ExtractionCache | None = None,
+                      fileStat: os.stat_result | OSError | None = None, perceptualHash: bool = False,
+                      exifTags: frozenset | None = None) -> dict:
+    """
+    Collects the metadata of a single supported media file.
+
+    Args:
+        root (str): The folder of the file.
+        fileName (str): The name of the file.
+        supportedTypes (list[tuple]): A list where each tuple contains file extensions
+                                       for a specific media type (e.g., image, video).
+        cache (ExtractionCache | None): If provided, EXIF data of an unchanged image is
+                                        reused from the cache instead of being extracted.
+        fileStat (os.stat_result | OSError | None): The stat result of the file, or the error of
+                                                    a failed stat, if already known.
+        perceptualHash (bool): If True, a perceptual hash is added to the metadata of images.
+        exifTags (frozenset | None): If provided, only these EXIF tags are extracted.
+
+    Returns:
+        dict: A dictionary containing the metadata for the file.
+    """
+    profiler = getProfiler()
+    startTime = time.perf_counter() if profiler is not None else 0.0
+
+    fullPath, metaDataDict = getRegularData(root, fileName, fileStat)
+    if profiler is not None:
+        profiler.recordFile("regular", fullPath, time.perf_counter() - startTime)
+        startTime = time.perf_counter()
+
+    if os.path.splitext(fileName)[1].lower() in supportedTypes[0]:
+        stageName = "exif"
+        requiredKeys = frozenset({"perceptualHash"}) if perceptualHash else frozenset()
+        # Removed redundant os.path.exists check, rely on getExifData's error handling
+        if cache is None or not cache.loadExifData(fullPath, metaDataDict, fileStat, requiredKeys, exifTags):
+            metaDataDict = extractIsolated(getExifData, fullPath, metaDataDict, perceptualHash, exifTags)
+            if cache is not None:
+                cache.storeExifData(fullPath, metaDataDict)
+    else:
+        stageName = "video"
+        # The recording time and duration of videos are read from the container headers
+        if cache is None or not cache.loadExifData(fullPath, metaDataDict, fileStat):
+            metaDataDict = extractIsolated(getVideoData, fullPath, metaDataDict)
+            if cache is not None:
+                cache.storeExifData(fullPath, metaDataDict)
+
+    if profiler is not None:
+        profiler.recordFile(stageName, fullPath, time.perf_counter() - startTime)
+    return metaDataDict
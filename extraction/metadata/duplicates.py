@@ -0,0 +1,142 @@
+import hashlib
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from extraction.metadata.cache import ExtractionCache
+from reporting.logger import getLogger
+
+#### DUPLICATE DETECTION ####
+"""
+This module finds files with identical content across the whole library, in three steps
+that each read as little as possible. First, files are grouped on their size, which is
+already known from the regular metadata; files with a unique size cannot have a copy.
+Second, the files that share their size get a partial hash of their first and last 64 KB.
+Third, only the files that also share their partial hash are read completely for a full
+hash. Files that are small enough are read completely in the second step, so they are
+never read twice. Hashes are stored in the extraction cache, keyed on size and modification
+time like the EXIF data, so unchanged files are not read again on the next run.
+"""
+
+logger = getLogger(__name__)
+
+# The number of bytes hashed at the start and at the end of a file for the partial hash
+PARTIAL_HASH_SIZE = 65536
+FULL_HASH_BLOCK_SIZE = 1048576
+
+
+def _newHash():
+    return hashlib.blake2b(digest_size=16)
+
+
+def _partialHash(filePath: str, fileSize: int) -> tuple[str, str | None]:
+    # Returns the partial hash, and the full hash if the partial hash covers the whole file
+    fileHash = _newHash()
+    with open(filePath, "rb") as mediaFile:
+        if fileSize <= 2 * PARTIAL_HASH_SIZE:
+            fileHash.update(mediaFile.read())
+            return fileHash.hexdigest(), fileHash.hexdigest()
+
+        fileHash.update(mediaFile.read(PARTIAL_HASH_SIZE))
+        mediaFile.seek(-PARTIAL_HASH_SIZE, os.SEEK_END)
+        fileHash.update(mediaFile.read(PARTIAL_HASH_SIZE))
+    return fileHash.hexdigest(), None
+
+
+def _fullHash(filePath: str) -> str:
+    fileHash = _newHash()
+    with open(filePath, "rb") as mediaFile:
+        while block := mediaFile.read(FULL_HASH_BLOCK_SIZE):
+            fileHash.update(block)
+    return fileHash.hexdigest()
+
+
+def _hashFiles(hashFunction, arguments: list[tuple], workers: int) -> list:
+    def _tryHash(argument: tuple):
+        try:
+            return hashFunction(*argument)
+        except OSError as e:
+            logger.warning("Could not hash file %s: %s", argument[0], e, extra={"file": argument[0]})
+            return None
+
+    # Hashing mostly waits on reads, so a thread pool is enough
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as threadPool:
+        return list(threadPool.map(_tryHash, arguments))
+
+
+def findDuplicates(filePaths: list[str], fileSizes: list[int], cache: ExtractionCache | None = None,
+                   workers: int = 8) -> tuple[list[str | None], list[str | None]]:
+    """
+    Finds the files with identical content.
+
+    Args:
+        filePaths (list[str]): The paths of the files, in walk order.
+        fileSizes (list[int]): The sizes of the files, in the same order.
+        cache (ExtractionCache | None): If provided, hashes of unchanged files are reused from the cache.
+        workers (int): The maximum number of threads that read files.
+
+    Returns:
+        tuple[list[str | None], list[str | None]]: Per file, the content hash (only for files that have
+                                                  the same size and partial hash as another file), and
+                                                  the path of the first file in walk order with the same
+                                                  content (None for the first copy and for unique files).
+    """
+    contentHashes: list[str | None] = [None] * len(filePaths)
+    duplicateOf: list[str | None] = [None] * len(filePaths)
+
+    # Only files that share their size with another file can have a copy; empty files are ignored
+    sizeGroups: dict[int, list[int]] = defaultdict(list)
+    for index, fileSize in enumerate(fileSizes):
+        if fileSize and fileSize > 0:
+            sizeGroups[int(fileSize)].append(index)
+    candidates: list[int] = [index for group in sizeGroups.values() if len(group) > 1 for index in group]
+
+    # Reuse the hashes of unchanged files; the cache is only used from this thread
+    cachedHashes: dict[int, tuple[str, str | None]] = {}
+    fileStats: dict[int, os.stat_result] = {}
+    for index in candidates:
+        try:
+            fileStats[index] = os.stat(filePaths[index])
+        except OSError:
+            continue
+        if cache is not None and (cachedEntry := cache.loadHashes(filePaths[index], fileStats[index])) is not None:
+            cachedHashes[index] = cachedEntry
+    candidates = [index for index in candidates if index in fileStats]
+
+    partialHashes: dict[int, str] = {index: cachedHashes[index][0] for index in cachedHashes}
+    fullHashes: dict[int, str] = {index: cachedHashes[index][1] for index in cachedHashes if cachedHashes[index][1] is not None}
+
+    uncachedIndices = [index for index in candidates if index not in cachedHashes]
+    for index, hashes in zip(uncachedIndices, _hashFiles(_partialHash, [(filePaths[index], int(fileSizes[index])) for index in uncachedIndices], workers)):
+        if hashes is not None:
+            partialHashes[index] = hashes[0]
+            if hashes[1] is not None:
+                fullHashes[index] = hashes[1]
+
+    # Only files that also share their partial hash are read completely
+    partialGroups: dict[tuple[int, str], list[int]] = defaultdict(list)
+    for index, partialHash in partialHashes.items():
+        partialGroups[(int(fileSizes[index]), partialHash)].append(index)
+    fullHashIndices = [index for group in partialGroups.values() if len(group) > 1 for index in group if index not in fullHashes]
+    for index, fullHash in zip(fullHashIndices, _hashFiles(_fullHash, [(filePaths[index],) for index in fullHashIndices], workers)):
+        if fullHash is not None:
+            fullHashes[index] = fullHash
+
+    if cache is not None:
+        for index in partialHashes:
+            cache.storeHashes(filePaths[index], fileStats[index], partialHashes[index], fullHashes.get(index))
+
+    # The first file in walk order with a given content is the original
+    firstPaths: dict[str, str] = {}
+    for index in sorted(index for group in partialGroups.values() if len(group) > 1 for index in group):
+        if index not in fullHashes:
+            continue
+        contentHashes[index] = fullHashes[index]
+        if fullHashes[index] in firstPaths:
+            duplicateOf[index] = firstPaths[fullHashes[index]]
+        else:
+            firstPaths[fullHashes[index]] = filePaths[index]
+
+    logger.info("Duplicate detection: %d files with a shared size, %d fully read, %d duplicates found.",
+                len(candidates), len(fullHashIndices), sum(value is not None for value in duplicateOf))
+    return contentHashes, duplicateOf
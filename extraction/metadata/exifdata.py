@@ -1,45 +1,46 @@
-from PIL import Image, ExifTags
+from PIL import Image
+
+from extraction.metadata.exifheader import readExifHeader
+from extraction.metadata.exifschema import normalizeExifData
+from extraction.metadata.perceptual import computeDHash
+from profiling.profiler import getProfiler
+from reporting.logger import getLogger
 
 #### EXIF DATA ####
 """
 This module extracts EXIF data from image files using the PIL library. The EXIF data
 is added to an existing metadata dictionary with human-readable tag names. This module
 is specifically for image files with EXIF data (e.g., JPEG, PNG) and will not add
-EXIF data if it's a video file or no EXIF data is present.
+EXIF data if it's a video file or no EXIF data is present. JPEG and PNG headers are
+read directly by `readExifHeader`; PIL is only used to open other formats. Optionally,
+a perceptual hash of the image is added as 'perceptualHash' (see `computeDHash`). With
+`exifTags`, only the listed tags are added; other tags are skipped before their values are
+decoded. The tags are normalized by `normalizeExifData` (see exifschema.py), which also
+flattens the EXIF and GPS sub-IFDs into columns. Files that cannot be read are logged as
+warnings, with the file as a structured field.
 """
 
-def getExifData(filePath: str, metaDataDictionary: dict) -> dict[str, str | int | bytes | None]:
-    try:
-        with Image.open(filePath) as imageData:
-            imageExifData = imageData.getexif()
+logger = getLogger(__name__)
 
-            if imageExifData:
-                for imageTagId, mediaMetaData in imageExifData.items():
-                    imageTag = ExifTags.TAGS.get(imageTagId, imageTagId)
+def getExifData(filePath: str, metaDataDictionary: dict, perceptualHash: bool = False,
+                exifTags: frozenset | None = None) -> dict[str, str | int | bytes | None]:
+    try:
+        # Read JPEG and PNG headers directly, fall back to PIL for other formats
+        imageExifData = readExifHeader(filePath)
 
-                    if isinstance(mediaMetaData, bytes):
-                        try:
-                            # Try decoding with UTF-8 first (most common)
-                            mediaMetaData = mediaMetaData.decode("utf-8")
-                        except UnicodeDecodeError:
-                            try:
-                                # Fallback to latin-1, common for EXIF text fields
-                                mediaMetaData = mediaMetaData.decode("latin-1")
-                            except UnicodeDecodeError:
-                                # If even latin-1 fails, log and set to None
-                                # This is the only UnicodeDecodeError warning we keep.
-                                print(f"Warning: EXIF tag '{imageTag}' for '{filePath}' bytes could not be decoded (utf-8 & latin-1 failed). Setting to None.")
-                                mediaMetaData = None
-                            except Exception as e:
-                                # Catch any other general exception for latin-1 decoding
-                                print(f"Warning: Unexpected error during latin-1 decoding for EXIF tag '{imageTag}' in '{filePath}': {e}. Setting to None.")
-                                mediaMetaData = None
-                        except Exception as e:
-                            # Catch any other general exception for utf-8 decoding
-                            print(f"Warning: Unexpected error during utf-8 decoding for EXIF tag '{imageTag}' in '{filePath}': {e}. Setting to None.")
-                            mediaMetaData = None
+        if imageExifData is not None:
+            normalizeExifData(filePath, imageExifData, metaDataDictionary, exifTags)
+        else:
+            if (profiler := getProfiler()) is not None:
+                profiler.count("exifPilFallbacks")
+            with Image.open(filePath) as imageData:
+                imageExifData = imageData.getexif()
 
-                    metaDataDictionary[imageTag] = mediaMetaData
+                if imageExifData:
+                    normalizeExifData(filePath, imageExifData, metaDataDictionary, exifTags)
     except Exception as e:
-        print(f"Warning: Could not extract EXIF data from {filePath}: {e}")
+        logger.warning("Could not extract EXIF data from %s: %s", filePath, e, extra={"file": filePath})
+
+    if perceptualHash:
+        metaDataDictionary["perceptualHash"] = computeDHash(filePath)
     return metaDataDictionary
\ No newline at end of file
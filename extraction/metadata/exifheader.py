@@ -0,0 +1,142 @@
+import io
+import re
+import struct
+
+from PIL import Image, ExifTags
+
+#### EXIF HEADER DATA ####
+"""
+This module reads EXIF data directly from the headers of JPEG and PNG files, without
+letting PIL detect the file format or set up an image decoder. Of JPEG files, only the
+marker segments before the image data are read, through a buffered read of the first few
+KB. PNG files can have metadata chunks after the image data, so their chunks are walked up
+to IEND, but unbuffered: only the 8-byte chunk headers (and the metadata chunks) are read,
+and the image data is skipped with seeks. Huge images are never decoded, and
+`MAX_IMAGE_PIXELS` does not apply. The raw EXIF block is parsed with `Image.Exif`,
+which gives the same tags as `Image.open(...).getexif()`. Other formats, and files
+with a structure this reader does not handle, return None so the caller can fall back to PIL.
+"""
+
+# The size of the read buffer of JPEG files; JPEG APP segments are at most 64 KB
+HEADER_READ_SIZE = 65536
+
+JPEG_SIGNATURE = b"\xff\xd8\xff"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+EXIF_PREFIX = b"Exif\x00\x00"
+XMP_PREFIX = b"http://ns.adobe.com/xap/1.0/\x00"
+XMP_ORIENTATION_PATTERN = re.compile(rb'tiff:Orientation(="|>)([0-9])')
+
+# PNG text chunk keywords that PIL turns into EXIF data; these files are left to PIL
+PNG_EXIF_KEYWORDS = (b"exif\x00", b"Raw profile type exif\x00", b"XML:com.adobe.xmp\x00")
+
+
+class _UnsupportedHeader(Exception):
+    pass
+
+
+def _readExact(fileObject, length: int) -> bytes:
+    data = fileObject.read(length)
+    if len(data) != length:
+        raise _UnsupportedHeader("unexpected end of file")
+    return data
+
+
+def _readJpegHeader(fileObject) -> tuple[bytes | None, bytes | None]:
+    exifData: bytes | None = None
+    xmpData: bytes | None = None
+
+    fileObject.seek(2)
+    while True:
+        if _readExact(fileObject, 1) != b"\xff":
+            raise _UnsupportedHeader("invalid JPEG marker")
+        marker = _readExact(fileObject, 1)[0]
+
+        # Skip fill bytes and markers without a segment
+        while marker == 0xFF:
+            marker = _readExact(fileObject, 1)[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            continue
+
+        # The image data starts at SOS; all metadata segments precede it
+        if marker in (0xDA, 0xD9):
+            return exifData, xmpData
+
+        segmentLength = struct.unpack(">H", _readExact(fileObject, 2))[0] - 2
+        if segmentLength < 0:
+            raise _UnsupportedHeader("invalid JPEG segment length")
+
+        if marker == 0xE1:
+            segment = _readExact(fileObject, segmentLength)
+            if segment.startswith(EXIF_PREFIX):
+                # PIL concatenates EXIF data that is split over several APP1 segments
+                exifData = segment if exifData is None else exifData + segment[6:]
+            elif segment.startswith(XMP_PREFIX):
+                xmpData = segment.split(b"\x00", 1)[1]
+        else:
+            fileObject.seek(segmentLength, 1)
+
+
+def _readPngHeader(fileObject) -> bytes | None:
+    exifData: bytes | None = None
+
+    fileObject.seek(len(PNG_SIGNATURE))
+    while True:
+        chunkLength, chunkType = struct.unpack(">I4s", _readExact(fileObject, 8))
+
+        if chunkType == b"eXIf":
+            if exifData is None:
+                exifData = EXIF_PREFIX + _readExact(fileObject, chunkLength)
+                fileObject.seek(4, 1)
+                continue
+        elif chunkType in (b"tEXt", b"zTXt", b"iTXt"):
+            keyword = fileObject.read(min(chunkLength, 80))
+            if keyword.startswith(PNG_EXIF_KEYWORDS):
+                raise _UnsupportedHeader("EXIF data in PNG text chunk")
+            fileObject.seek(chunkLength - len(keyword) + 4, 1)
+            continue
+        elif chunkType == b"IEND":
+            return exifData
+
+        # Skip the chunk data (including image data) and its CRC without reading it
+        fileObject.seek(chunkLength + 4, 1)
+
+
+def readExifHeader(filePath: str) -> Image.Exif | None:
+    """
+    Reads the EXIF data of a JPEG or PNG file from its header.
+
+    Args:
+        filePath (str): The path to the image file.
+
+    Returns:
+        Image.Exif | None: The EXIF data (empty if the file has none), or None if the file
+                           is not a JPEG or PNG file or its header could not be parsed.
+    """
+    imageExifData = Image.Exif()
+    xmpData: bytes | None = None
+
+    # Unbuffered, so seeking past the image data of a PNG file does not read ahead into it
+    with open(filePath, "rb", buffering=0) as fileObject:
+        signature = fileObject.read(len(PNG_SIGNATURE))
+        try:
+            if signature.startswith(JPEG_SIGNATURE):
+                # The JPEG segment headers are read byte by byte, so they go through a buffer
+                exifData, xmpData = _readJpegHeader(io.BufferedReader(fileObject, HEADER_READ_SIZE))
+            elif signature == PNG_SIGNATURE:
+                exifData = _readPngHeader(fileObject)
+            else:
+                return None
+        except (_UnsupportedHeader, struct.error):
+            return None
+
+    if exifData is not None:
+        imageExifData.load(exifData)
+
+    # PIL takes the orientation from the XMP data when the EXIF data does not contain it
+    if xmpData and ExifTags.Base.Orientation not in imageExifData:
+        match = XMP_ORIENTATION_PATTERN.search(xmpData)
+        if match:
+            imageExifData[ExifTags.Base.Orientation] = int(match[2])
+
+    return imageExifData
@@ -0,0 +1,188 @@
+import math
+
+from PIL import ExifTags, Image, TiffTags
+from PIL.TiffImagePlugin import IFDRational
+
+from profiling.profiler import getProfiler
+from reporting.logger import getLogger
+
+#### EXIF TAG SCHEMA ####
+"""
+This module normalizes the EXIF data of an image into metadata columns. A `TagSchema` is
+built once per EXIF tag allow-list: it maps the ids of the tags to keep to their names, so
+every tag costs a single dictionary lookup, and tags that are not on the schema are skipped
+before PIL decodes their values. Text stored as bytes is decoded as UTF-8, or as latin-1 if
+that fails. Rationals become floats. The pointer tags of the sub-IFDs are not stored as columns,
+because their values are only file offsets. The tags of the EXIF sub-IFD ('ExifOffset') on
+the schema are added as columns of their own (by default DEFAULT_EXIF_IFD_TAGS, e.g.
+'DateTimeOriginal'). The GPS sub-IFD ('GPSInfo') becomes the signed decimal 'GPSLatitude',
+'GPSLongitude' and 'GPSAltitude' columns. Tags of the TIFF specification are only read from
+the main IFD, so whether one schema extracts everything another does (`TagSchema.covers`)
+follows from their tags alone.
+"""
+
+logger = getLogger(__name__)
+
+# The names of the tags of the main IFD and the EXIF sub-IFD
+TAG_NAMES: dict[int, str] = dict(ExifTags.TAGS)
+
+# Tags whose value is the offset of a sub-IFD
+EXIF_IFD_TAG = int(ExifTags.IFD.Exif)
+GPS_IFD_TAG = int(ExifTags.IFD.GPSInfo)
+IFD_POINTER_TAGS: frozenset[int] = frozenset({EXIF_IFD_TAG, GPS_IFD_TAG, int(ExifTags.IFD.Interop)})
+
+# The tags of the TIFF specification (e.g. 'Make'), which are stored in the main IFD and not in the sub-IFDs
+MAIN_IFD_TAG_NAMES: frozenset[str] = frozenset(TAG_NAMES[tagId] for tagId in TiffTags.TAGS_V2 if tagId in TAG_NAMES)
+
+# The tags of the EXIF sub-IFD that become columns when no allow-list is given
+DEFAULT_EXIF_IFD_TAGS: tuple[str, ...] = (
+    "DateTimeOriginal", "DateTimeDigitized", "OffsetTimeOriginal", "ExposureTime", "FNumber",
+    "ISOSpeedRatings", "FocalLength", "LensMake", "LensModel", "ExifImageWidth", "ExifImageHeight",
+)
+
+# The columns the GPS sub-IFD is flattened into
+GPS_COLUMNS: tuple[str, ...] = ("GPSLatitude", "GPSLongitude", "GPSAltitude")
+
+
+class TagSchema:
+    def __init__(self, exifTags: frozenset | None = None) -> None:
+        pointerNames = {TAG_NAMES[tagId] for tagId in IFD_POINTER_TAGS if tagId in TAG_NAMES}
+        if exifTags is None:
+            self.mainTags: dict[int, str] = {tagId: name for tagId, name in TAG_NAMES.items() if tagId not in IFD_POINTER_TAGS}
+            exifIfdNames = frozenset(DEFAULT_EXIF_IFD_TAGS)
+            self.gpsColumns: tuple[str, ...] = GPS_COLUMNS
+        else:
+            self.mainTags = {tagId: name for tagId, name in TAG_NAMES.items() if name in exifTags and tagId not in IFD_POINTER_TAGS}
+            exifIfdNames = frozenset(exifTags) - pointerNames - MAIN_IFD_TAG_NAMES
+            # 'GPSInfo' on the allow-list keeps all GPS columns
+            self.gpsColumns = GPS_COLUMNS if "GPSInfo" in exifTags else tuple(name for name in GPS_COLUMNS if name in exifTags)
+
+        # Tags without a name are only kept without an allow-list, under their id, as before
+        self.keepUnknownTags: bool = exifTags is None
+        self.exifIfdTags: dict[int, str] = {tagId: name for tagId, name in TAG_NAMES.items() if name in exifIfdNames}
+
+        # The columns this schema can add, e.g. to filter cached EXIF data on
+        self.columnNames: frozenset[str] = frozenset(self.mainTags.values()) | frozenset(self.exifIfdTags.values()) | frozenset(self.gpsColumns)
+
+    def covers(self, other: "TagSchema") -> bool:
+        """
+        Returns True if this schema reads every tag `other` reads, from the same IFDs. The schema
+        without an allow-list only covers the EXIF sub-IFD tags of DEFAULT_EXIF_IFD_TAGS.
+        """
+        return (other.mainTags.keys() <= self.mainTags.keys() and other.exifIfdTags.keys() <= self.exifIfdTags.keys()
+                and set(other.gpsColumns) <= set(self.gpsColumns) and (self.keepUnknownTags or not other.keepUnknownTags))
+
+
+_tagSchemas: dict[frozenset | None, TagSchema] = {}
+
+
+def getTagSchema(exifTags: frozenset | None = None) -> TagSchema:
+    """
+    Returns the schema of an EXIF tag allow-list (or of all tags), built on first use.
+    """
+    tagSchema = _tagSchemas.get(exifTags)
+    if tagSchema is None:
+        tagSchema = _tagSchemas[exifTags] = TagSchema(exifTags)
+    return tagSchema
+
+
+def _decodeText(value: bytes):
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        if (profiler := getProfiler()) is not None:
+            profiler.count("exifLatin1Fallbacks")
+        # Every byte sequence is valid latin-1, so this cannot fail
+        return value.decode("latin-1")
+
+
+def _toFloat(value: IFDRational) -> float:
+    # Store rationals (e.g. XResolution) as plain floats, as they are read back from the CSV file
+    return float(value)
+
+
+# The conversion of a decoded value, by its type; other values are kept as they are
+_NORMALIZERS = {bytes: _decodeText, IFDRational: _toFloat}
+
+
+def _toDegrees(value) -> float | None:
+    # Degrees, minutes and seconds as three rationals, or a single value
+    try:
+        if isinstance(value, tuple):
+            degrees = sum(float(part) / divisor for part, divisor in zip(value, (1, 60, 3600)))
+        else:
+            degrees = float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return None if math.isnan(degrees) else degrees
+
+
+def _isNegativeReference(reference, negativeReferences: tuple) -> bool:
+    if isinstance(reference, bytes):
+        reference = reference.decode("latin-1")
+    if isinstance(reference, str):
+        reference = reference.strip("\x00 ").upper()
+    return reference in negativeReferences
+
+
+def _getGpsColumns(gpsData: dict) -> dict[str, float | None]:
+    latitude = _toDegrees(gpsData[2]) if 2 in gpsData else None
+    if latitude is not None and _isNegativeReference(gpsData.get(1), ("S",)):
+        latitude = -latitude
+    longitude = _toDegrees(gpsData[4]) if 4 in gpsData else None
+    if longitude is not None and _isNegativeReference(gpsData.get(3), ("W",)):
+        longitude = -longitude
+    # An altitude reference of 1 means below sea level
+    altitude = _toDegrees(gpsData[6]) if 6 in gpsData else None
+    if altitude is not None and _isNegativeReference(gpsData.get(5), (1, b"\x01", "\x01")):
+        altitude = -altitude
+    return {"GPSLatitude": latitude, "GPSLongitude": longitude, "GPSAltitude": altitude}
+
+
+def normalizeExifData(filePath: str, imageExifData: Image.Exif, metaDataDictionary: dict,
+                      exifTags: frozenset | None = None) -> None:
+    """
+    Adds the tags of an image's EXIF data that are on the schema to its metadata dictionary.
+
+    Args:
+        filePath (str): The path of the image, for the warnings.
+        imageExifData (Image.Exif): The EXIF data of the image.
+        metaDataDictionary (dict): The metadata dictionary of the image.
+        exifTags (frozenset | None): If provided, only these tags (and GPS columns) are added.
+    """
+    tagSchema = getTagSchema(exifTags)
+    mainTags = tagSchema.mainTags
+
+    # Iterating over the ids does not decode the values; only the values of kept tags are decoded
+    for tagId in list(imageExifData):
+        tagName = mainTags.get(tagId)
+        if tagName is None:
+            # Named tags that are not on the schema, and the sub-IFD pointers, are skipped
+            if not tagSchema.keepUnknownTags or tagId in TAG_NAMES:
+                continue
+            tagName = tagId
+        value = imageExifData[tagId]
+        normalizer = _NORMALIZERS.get(type(value))
+        metaDataDictionary[tagName] = normalizer(value) if normalizer is not None else value
+
+    # The sub-IFDs are only parsed if the image has them and the schema wants their tags
+    if tagSchema.exifIfdTags and EXIF_IFD_TAG in imageExifData:
+        try:
+            exifIfdData = imageExifData.get_ifd(EXIF_IFD_TAG)
+        except Exception as e:
+            logger.warning("Could not read the EXIF sub-IFD of %s: %s", filePath, e, extra={"file": filePath, "tag": "ExifOffset"})
+            exifIfdData = {}
+        for tagId, value in exifIfdData.items():
+            tagName = tagSchema.exifIfdTags.get(tagId)
+            if tagName is not None and tagName not in metaDataDictionary:
+                normalizer = _NORMALIZERS.get(type(value))
+                metaDataDictionary[tagName] = normalizer(value) if normalizer is not None else value
+
+    if tagSchema.gpsColumns and GPS_IFD_TAG in imageExifData:
+        try:
+            gpsColumns = _getGpsColumns(imageExifData.get_ifd(GPS_IFD_TAG))
+        except Exception as e:
+            logger.warning("Could not read the GPS data of %s: %s", filePath, e, extra={"file": filePath, "tag": "GPSInfo"})
+            return
+        for columnName in tagSchema.gpsColumns:
+            metaDataDictionary[columnName] = gpsColumns[columnName]
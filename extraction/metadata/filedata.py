@@ -2,16 +2,24 @@ import os
 import re
 from datetime import datetime
 
+from reporting.logger import getLogger
+
 #### REGULAR DATA ####
 """
-This module extracts regular metadata from image and video files. Regular metadata
-includes the file path, file name, folder name, file type, file size, creation time,
-and modified time. Creation and modified times are formatted as 'YYYYMMDD_HHMMSS' strings.
-This module does not process files without regular metadata, like text files.
+This module extracts regular metadata from image and video files. Regular metadata includes
+the file path, file name, folder name, file type, file size, creation time, and modified
+time. Creation, modified and recorded times are `datetime` values (truncated to whole
+seconds), so they end up as datetime64 columns; the 'YYYYMMDD_HHMMSS' string form is only
+rendered when files are renamed. 'recordedDateOnly' is True if the recorded time comes from
+a file name with a date but no time, so the new name keeps the date only. All file system
+data comes from a single stat call, or from the stat result passed in by the directory
+walker. This module does not process files without regular metadata, like text files.
 """
 
 NON_NUMERIC_PATTERN = re.compile(r"[^0-9]")
 
+logger = getLogger(__name__)
+
 def processString(inputString: str | None) -> str:
     if inputString is None:
         return ""
@@ -30,36 +38,66 @@ def processString(inputString: str | None) -> str:
         return f"{truncatedString[:8]}_{truncatedString[8:]}"
 
 
-def getCreationModifiedTime(filePath: str) -> tuple[str, str, str]:
+def parseRecordedTime(recordedString: str) -> datetime | None:
+    # processString returns either 'YYYYMMDD_HHMMSS', 'YYYYMMDD' or an empty string
+    for recordedFormat in ("%Y%m%d_%H%M%S", "%Y%m%d"):
+        try:
+            return datetime.strptime(recordedString, recordedFormat)
+        except ValueError:
+            pass
+    return None
+
+def getCreationModifiedTime(filePath: str, fileStat: os.stat_result | OSError | None = None,
+                            recordedString: str | None = None) -> tuple[datetime | None, datetime | None, datetime | None]:
     try:
-        creationTimestamp = os.path.getctime(filePath)
-        modifiedTimestamp = os.path.getmtime(filePath)
+        if fileStat is None:
+            fileStat = os.stat(filePath)
+        # The error of a stat that already failed is not retried
+        if isinstance(fileStat, OSError):
+            raise fileStat
+        creationTimestamp = fileStat.st_ctime
+        modifiedTimestamp = fileStat.st_mtime
 
-        fileCreation = datetime.fromtimestamp(creationTimestamp).strftime("%Y%m%d_%H%M%S")
-        fileModified = datetime.fromtimestamp(modifiedTimestamp).strftime("%Y%m%d_%H%M%S")
+        fileCreation = datetime.fromtimestamp(creationTimestamp).replace(microsecond=0)
+        fileModified = datetime.fromtimestamp(modifiedTimestamp).replace(microsecond=0)
     except OSError:
-        fileCreation = ""
-        fileModified = ""
+        fileCreation = None
+        fileModified = None
 
-    fileRecorded = processString(os.path.basename(filePath))
+    # The file name can be processed by the caller already
+    if recordedString is None:
+        recordedString = processString(os.path.basename(filePath))
+    fileRecorded = parseRecordedTime(recordedString)
 
     return fileCreation, fileModified, fileRecorded
 
-def getRegularData(rootDirectory: str, fileName: str) -> tuple[str, dict[str, str | int | None]]:
+def getRegularData(rootDirectory: str, fileName: str, fileStat: os.stat_result | OSError | None = None) -> tuple[str, dict[str, str | int | datetime | None]]:
     fullPath = os.path.join(rootDirectory, fileName)
-    print(f"Retrieving metadata for file: {fullPath}")
+    logger.debug("Retrieving metadata for file: %s", fullPath)
+
+    # A single stat call gives the creation and modified time and the file size; a failed stat
+    # (also one of the walker) is passed on as its error, so the file is not stat'ed again
+    if fileStat is None:
+        try:
+            fileStat = os.stat(fullPath)
+        except OSError as e:
+            fileStat = e
 
-    fileCreation, fileModified, fileRecorded = getCreationModifiedTime(fullPath)
+    recordedString = processString(fileName)
+    fileCreation, fileModified, fileRecorded = getCreationModifiedTime(fullPath, fileStat, recordedString)
+    # A time of exactly midnight may also be written out in the file name; only a bare date ('YYYYMMDD') has no time
+    recordedDateOnly = fileRecorded is not None and len(recordedString) == 8
 
-    metaDataDictionary: dict[str, str | int | None] = {
+    metaDataDictionary: dict[str, str | int | datetime | None] = {
         "path": fullPath,
         "file": fileName,
         "folder": os.path.basename(rootDirectory),
         "type": os.path.splitext(fileName)[1].lower(),
-        "fileSize": os.path.getsize(fullPath) if os.path.exists(fullPath) else 0,
+        "fileSize": fileStat.st_size if not isinstance(fileStat, OSError) else 0,
         "creation": fileCreation,
         "modified": fileModified,
         "recorded": fileRecorded,
+        "recordedDateOnly": recordedDateOnly,
         "indicated": None,
     }
     return fullPath, metaDataDictionary
\ No newline at end of file
@@ -0,0 +1,139 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Iterator
+
+from PIL import Image
+
+from extraction.metadata.filedata import getRegularData
+from extraction.metadata.exifdata import getExifData
+from extraction.metadata.videodata import getVideoData
+from extraction.metadata.cache import ExtractionCache
+from extraction.metadata.walker import scanMediaFiles, statEntry
+from extraction.metadata.dictionaries import extractIsolated, logFolder
+from profiling.profiler import enableProfiling, disableProfiling, getProfiler
+from reporting.logger import captureLogRecords, getLogger, replayLogRecords
+
+#### PARALLEL LIST OF METADATA DICTIONARIES ####
+"""
+This module is the concurrent counterpart of `iterDataDictionaries`. The folder tree is
+walked once with `scanMediaFiles`, after which the supported files are processed in batches:
+a bounded thread pool stats the directory entries, retrieves the regular metadata and reads
+the video container headers (mostly waiting on I/O), and a process pool
+decodes the EXIF data of the images (PIL header parsing, mostly CPU). Results are collected
+with `map` and yielded batch by batch, in the same order as the serial implementation.
+The warnings logged in the worker processes are passed back with the results, and logged
+by the main process. Unexpected errors of single files are isolated by `extractIsolated`.
+"""
+
+def _initExifWorker(maxImagePixels: int | None, logLevel: int) -> None:
+    # Worker processes do not inherit the limit set by extractData and the log level on platforms that spawn
+    Image.MAX_IMAGE_PIXELS = maxImagePixels
+    getLogger().setLevel(logLevel)
+
+def _iterSupportedFiles(sourceFolder: str, supportedExtensions: tuple[str, ...],
+                        skipPaths: frozenset[str] = frozenset()) -> Iterator[tuple[str, os.DirEntry]]:
+    for root, fileEntries, skippedNames in scanMediaFiles(sourceFolder, supportedExtensions):
+        logFolder(root, skippedNames)
+
+        for fileEntry in fileEntries:
+            if fileEntry.path not in skipPaths:
+                yield root, fileEntry
+
+def _getRegularEntryData(root: str, fileEntry: os.DirEntry) -> tuple[str, dict, os.stat_result | OSError]:
+    # The stat result is kept, so the cache does not stat the file again
+    startTime = time.perf_counter()
+    fileStat = statEntry(fileEntry)
+    fullPath, metaDataDict = getRegularData(root, fileEntry.name, fileStat)
+    if (profiler := getProfiler()) is not None:
+        profiler.recordFile("regular", fullPath, time.perf_counter() - startTime)
+    return fullPath, metaDataDict, fileStat
+
+def _getVideoDataProfiled(filePath: str, metaDataDictionary: dict) -> dict:
+    startTime = time.perf_counter()
+    metaDataDictionary = getVideoData(filePath, metaDataDictionary)
+    if (profiler := getProfiler()) is not None:
+        profiler.recordFile("video", filePath, time.perf_counter() - startTime)
+    return metaDataDictionary
+
+def _getExifDataInWorker(filePath: str, metaDataDictionary: dict, perceptualHash: bool = False,
+                        exifTags: frozenset | None = None, profile: bool = False) -> tuple[dict, list, float, dict[str, int]]:
+    # Worker processes have their own log handlers and profiler; the log records, latency and counters are sent back with the result
+    profiler = enableProfiling() if profile else None
+    startTime = time.perf_counter()
+    with captureLogRecords() as logRecords:
+        metaDataDictionary = extractIsolated(getExifData, filePath, metaDataDictionary, perceptualHash, exifTags)
+    seconds = time.perf_counter() - startTime
+    if profiler is not None:
+        disableProfiling()
+    return metaDataDictionary, logRecords, seconds, profiler.counters if profiler is not None else {}
+
+def iterDataDictionariesParallel(sourceFolder: str, supportedTypes: list[tuple[str, ...]],
+                                 workers: int, cache: ExtractionCache | None = None,
+                                 batchSize: int = 1024, perceptualHash: bool = False,
+                                 exifTags: frozenset | None = None, skipPaths: frozenset[str] = frozenset()) -> Iterator[dict]:
+    """
+    Collects metadata for all supported media files within a given source folder concurrently.
+
+    Args:
+        sourceFolder (str): The path to the root folder to scan.
+        supportedTypes (list[tuple]): A list where each tuple contains file extensions
+                                       for a specific media type (e.g., image, video).
+        workers (int): The maximum number of threads and processes to use.
+        cache (ExtractionCache | None): If provided, only images that are not in the cache
+                                        are sent to the process pool.
+        batchSize (int): The number of files submitted to the pools at once.
+        perceptualHash (bool): If True, a perceptual hash is added to the metadata of images.
+        exifTags (frozenset | None): If provided, only these EXIF tags are extracted.
+        skipPaths (frozenset[str]): The paths of files that are left out.
+
+    Yields:
+        dict: A dictionary containing the metadata for a file, in the same order
+              as `iterDataDictionaries`.
+    """
+    imageExtensions = supportedTypes[0]
+    videoExtensions = supportedTypes[1]
+    supportedFiles = _iterSupportedFiles(sourceFolder, imageExtensions + videoExtensions, skipPaths)
+    requiredKeys = frozenset({"perceptualHash"}) if perceptualHash else frozenset()
+    profiler = getProfiler()
+
+    with ThreadPoolExecutor(max_workers=workers) as threadPool, \
+         ProcessPoolExecutor(max_workers=workers, initializer=_initExifWorker,
+                             initargs=(Image.MAX_IMAGE_PIXELS, getLogger().level)) as processPool:
+        while batch := list(islice(supportedFiles, batchSize)):
+            # Retrieve the regular metadata; map keeps the order of the batch
+            regularData = list(threadPool.map(lambda entry: _getRegularEntryData(*entry), batch))
+            metaDataDicts = [metaDataDict for _, metaDataDict, _ in regularData]
+
+            # Decode the EXIF data of the images in the batch that are not cached in the process pool
+            imageIndices = [index for index, (_, fileEntry) in enumerate(batch)
+                            if os.path.splitext(fileEntry.name)[1].lower() in imageExtensions
+                            and (cache is None or not cache.loadExifData(regularData[index][0], metaDataDicts[index], regularData[index][2], requiredKeys, exifTags))]
+            exifResults = list(processPool.map(partial(_getExifDataInWorker, perceptualHash=perceptualHash, exifTags=exifTags, profile=profiler is not None),
+                                               [regularData[index][0] for index in imageIndices],
+                                               [metaDataDicts[index] for index in imageIndices],
+                                               chunksize=max(1, len(imageIndices) // (workers * 4))))
+            for index, (_, logRecords, seconds, counters) in zip(imageIndices, exifResults):
+                replayLogRecords(logRecords)
+                if profiler is not None:
+                    profiler.recordFile("exif", regularData[index][0], seconds)
+                    for counterName, amount in counters.items():
+                        profiler.count(counterName, amount)
+            exifResults = [metaDataDict for metaDataDict, _, _, _ in exifResults]
+
+            # Read the container headers of the videos that are not cached in the thread pool
+            videoIndices = [index for index, (_, fileEntry) in enumerate(batch)
+                            if os.path.splitext(fileEntry.name)[1].lower() not in imageExtensions
+                            and (cache is None or not cache.loadExifData(regularData[index][0], metaDataDicts[index], regularData[index][2]))]
+            videoResults = threadPool.map(partial(extractIsolated, getVideoData if profiler is None else _getVideoDataProfiled),
+                                          [regularData[index][0] for index in videoIndices],
+                                          [metaDataDicts[index] for index in videoIndices])
+
+            for index, metaDataDict in list(zip(imageIndices, exifResults)) + list(zip(videoIndices, videoResults)):
+                metaDataDicts[index] = metaDataDict
+                if cache is not None:
+                    cache.storeExifData(regularData[index][0], metaDataDict)
+
+            yield from metaDataDicts
@@ -0,0 +1,138 @@
+from PIL import Image, ImageOps
+
+from reporting.logger import getLogger
+
+#### PERCEPTUAL HASHES ####
+"""
+This module computes perceptual hashes of images and groups images that look alike, such as
+resized or re-encoded copies from phone backups. The hash is a 64-bit difference hash (dHash):
+the image is reduced to 9x8 grey pixels and every bit tells whether a pixel is brighter than
+its right neighbour. JPEG files are decoded at a reduced scale with PIL's draft mode, so the
+full image is never decoded. Images whose hashes differ in at most `maxDistance` bits are
+grouped through a BK-tree, which only compares a hash with the part of the tree that can be
+within that distance, instead of comparing every pair of images.
+"""
+
+logger = getLogger(__name__)
+
+HASH_WIDTH = 8
+HASH_HEIGHT = 8
+
+# The smallest size JPEG files are decoded at; the draft scale is at least this size
+DRAFT_SIZE = (64, 64)
+
+
+def computeDHash(filePath: str) -> str | None:
+    """
+    Computes the difference hash of an image as a 16-character hexadecimal string.
+    Returns None if the image cannot be decoded.
+    """
+    try:
+        with Image.open(filePath) as image:
+            image.draft("L", DRAFT_SIZE)
+            # Rotate as displayed, so copies with the rotation applied get the same hash
+            image = ImageOps.exif_transpose(image).convert("L").resize((HASH_WIDTH + 1, HASH_HEIGHT), Image.Resampling.LANCZOS)
+            pixels = list(image.getdata())
+    except Exception as e:
+        logger.warning("Could not compute perceptual hash of %s: %s", filePath, e, extra={"file": filePath})
+        return None
+
+    hashValue = 0
+    for row in range(HASH_HEIGHT):
+        for column in range(HASH_WIDTH):
+            leftPixel = pixels[row * (HASH_WIDTH + 1) + column]
+            hashValue = (hashValue << 1) | (leftPixel > pixels[row * (HASH_WIDTH + 1) + column + 1])
+    return f"{hashValue:016x}"
+
+
+class BKTree:
+    """
+    A BK-tree of integer hashes under the Hamming distance. Every node keeps its children by
+    their distance to the node, so a search within `maxDistance` of a hash only descends into
+    children whose distance lies within `maxDistance` of the hash's distance to the node.
+    """
+
+    def __init__(self) -> None:
+        self.root: tuple[int, dict[int, tuple]] | None = None
+
+    def add(self, hashValue: int) -> None:
+        if self.root is None:
+            self.root = (hashValue, {})
+            return
+
+        nodeHash, children = self.root
+        while True:
+            distance = (hashValue ^ nodeHash).bit_count()
+            if distance == 0:
+                return
+            if distance not in children:
+                children[distance] = (hashValue, {})
+                return
+            nodeHash, children = children[distance]
+
+    def search(self, hashValue: int, maxDistance: int) -> list[int]:
+        matches: list[int] = []
+        pendingNodes = [self.root] if self.root is not None else []
+
+        while pendingNodes:
+            nodeHash, children = pendingNodes.pop()
+            distance = (hashValue ^ nodeHash).bit_count()
+            if distance <= maxDistance:
+                matches.append(nodeHash)
+            pendingNodes.extend(child for childDistance, child in children.items()
+                                if distance - maxDistance <= childDistance <= distance + maxDistance)
+        return matches
+
+
+def findSimilarImages(filePaths: list[str], perceptualHashes: list[str | None], maxDistance: int = 6) -> list[str | None]:
+    """
+    Groups images with similar perceptual hashes.
+
+    Args:
+        filePaths (list[str]): The paths of the files, in walk order.
+        perceptualHashes (list[str | None]): The perceptual hashes of the files, in the same order.
+                                             Files without a hash (e.g. videos) are not grouped.
+        maxDistance (int): The maximum number of differing bits between similar images.
+
+    Returns:
+        list[str | None]: Per file, the path of the first file in walk order of its group of
+                          similar images (None for that first file and for files without a match).
+    """
+    # Identical hashes are only added to the tree once
+    hashIndices: dict[int, list[int]] = {}
+    for index, perceptualHash in enumerate(perceptualHashes):
+        if isinstance(perceptualHash, str) and perceptualHash:
+            hashIndices.setdefault(int(perceptualHash, 16), []).append(index)
+
+    bkTree = BKTree()
+    for hashValue in hashIndices:
+        bkTree.add(hashValue)
+
+    # Join the hashes within the distance with union-find, so similarity is transitive within a group
+    parents: dict[int, int] = {hashValue: hashValue for hashValue in hashIndices}
+
+    def _findRoot(hashValue: int) -> int:
+        while parents[hashValue] != hashValue:
+            parents[hashValue] = parents[parents[hashValue]]
+            hashValue = parents[hashValue]
+        return hashValue
+
+    for hashValue in hashIndices:
+        for matchingHash in bkTree.search(hashValue, maxDistance):
+            rootHash, matchingRoot = _findRoot(hashValue), _findRoot(matchingHash)
+            if rootHash != matchingRoot:
+                parents[matchingRoot] = rootHash
+
+    # The first file in walk order of every group is the original
+    similarTo: list[str | None] = [None] * len(filePaths)
+    firstPaths: dict[int, str] = {}
+    for index in sorted(index for indices in hashIndices.values() for index in indices):
+        groupRoot = _findRoot(int(perceptualHashes[index], 16))
+        if groupRoot in firstPaths:
+            similarTo[index] = firstPaths[groupRoot]
+        else:
+            firstPaths[groupRoot] = filePaths[index]
+
+    logger.info("Near-duplicate search: %d distinct perceptual hashes, %d similar images found.",
+                len(hashIndices), sum(value is not None for value in similarTo))
+    return similarTo
@@ -0,0 +1,206 @@
+import os
+import struct
+from datetime import datetime
+
+from reporting.logger import getLogger
+
+#### VIDEO DATA ####
+"""
+This module reads the recording date/time and the duration of video files from their container
+headers, in pure Python and with small reads only. MP4 and QuickTime files (.mp4, .mov) are
+read box by box: only the 8 or 16 byte box headers are read, and the payload ('mdat') is
+skipped with a seek until the 'moov' box is found, which may be at the start or at the end of
+the file. The creation time and duration come from its 'mvhd' box, or from the first 'tkhd'
+box if 'mvhd' has no creation time. AVCHD files (.mts, .m2ts) keep the recording time in the
+'MDPM' block of the H.264 stream, which is found in the first packets; their duration follows
+from the clock references (PCR) of the first and last packets. The date/time is stored in the
+'DateTime' column in the EXIF format, so it is used by `selectDateTime` like the EXIF date/time
+of images, and the duration in seconds in the 'duration' column. Other containers (e.g. MPEG
+program streams, .mpg) have no standard recording time and are left unchanged.
+"""
+
+logger = getLogger(__name__)
+
+MP4_EXTENSIONS = (".mp4", ".mov", ".m4v", ".3gp")
+MTS_EXTENSIONS = (".mts", ".m2ts")
+
+# Seconds between 1904-01-01 (the MP4 epoch) and 1970-01-01
+MP4_EPOCH_OFFSET = 2082844800
+
+# The number of bytes read at the start and at the end of an AVCHD file
+MTS_SCAN_SIZE = 262144
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+PCR_CLOCK_RATE = 27000000
+
+# The H.264 user data that holds the AVCHD recording information
+MDPM_MARKER = bytes.fromhex("17ee8c60f84d11d98cd60800200c9a66") + b"MDPM"
+
+EXIF_DATETIME_FORMAT = "%Y:%m:%d %H:%M:%S"
+
+
+def _iterBoxes(videoFile, start: int, end: int):
+    # Yields the type, payload start and end of the boxes between start and end, reading only their headers
+    position = start
+    while position + 8 <= end:
+        videoFile.seek(position)
+        header = videoFile.read(8)
+        if len(header) < 8:
+            return
+        boxSize, boxType = struct.unpack(">I4s", header)
+        headerSize = 8
+        if boxSize == 1:
+            boxSize = struct.unpack(">Q", videoFile.read(8))[0]
+            headerSize = 16
+        elif boxSize == 0:
+            boxSize = end - position
+        if boxSize < headerSize:
+            return
+        yield boxType, position + headerSize, min(position + boxSize, end)
+        position += boxSize
+
+
+def _readCreationAndDuration(videoFile, payloadStart: int, isTrackHeader: bool) -> tuple[int, float | None]:
+    # mvhd and tkhd start with a version byte; version 1 has 64-bit times
+    videoFile.seek(payloadStart)
+    version = videoFile.read(4)[0]
+    if version == 1:
+        creationTime, _ = struct.unpack(">QQ", videoFile.read(16))
+        if isTrackHeader:
+            return creationTime, None
+        timescale, duration = struct.unpack(">IQ", videoFile.read(12))
+    else:
+        creationTime, _ = struct.unpack(">II", videoFile.read(8))
+        if isTrackHeader:
+            return creationTime, None
+        timescale, duration = struct.unpack(">II", videoFile.read(8))
+    return creationTime, duration / timescale if timescale else None
+
+
+def readMp4Metadata(filePath: str) -> tuple[datetime | None, float | None]:
+    """
+    Reads the creation time (in local time) and the duration in seconds of an MP4 or QuickTime file.
+    """
+    fileSize = os.path.getsize(filePath)
+    creationTime, duration = 0, None
+
+    with open(filePath, "rb") as videoFile:
+        for boxType, payloadStart, boxEnd in _iterBoxes(videoFile, 0, fileSize):
+            if boxType != b"moov":
+                continue
+
+            trackBoxes = []
+            for childType, childStart, childEnd in _iterBoxes(videoFile, payloadStart, boxEnd):
+                if childType == b"mvhd":
+                    creationTime, duration = _readCreationAndDuration(videoFile, childStart, isTrackHeader=False)
+                elif childType == b"trak":
+                    trackBoxes.append((childStart, childEnd))
+
+            # Some cameras only set the creation time of the tracks
+            for trackStart, trackEnd in trackBoxes:
+                if creationTime:
+                    break
+                for trackChildType, trackChildStart, _ in _iterBoxes(videoFile, trackStart, trackEnd):
+                    if trackChildType == b"tkhd":
+                        creationTime, _ = _readCreationAndDuration(videoFile, trackChildStart, isTrackHeader=True)
+                        break
+            break
+
+    # MP4 times are seconds since 1904 in UTC; a creation time of 0 means it was not set
+    if creationTime <= MP4_EPOCH_OFFSET:
+        return None, duration
+    return datetime.fromtimestamp(creationTime - MP4_EPOCH_OFFSET), duration
+
+
+def _fromBcd(value: int) -> int:
+    return (value >> 4) * 10 + (value & 0x0F)
+
+
+def _parseMdpmDateTime(data: bytes) -> datetime | None:
+    markerPosition = data.find(MDPM_MARKER)
+    if markerPosition < 0 or markerPosition + len(MDPM_MARKER) >= len(data):
+        return None
+
+    # The marker is followed by the number of tags, and then 5 bytes per tag: the tag and 4 bytes of data
+    position = markerPosition + len(MDPM_MARKER)
+    tagCount = data[position]
+    tags: dict[int, bytes] = {}
+    for tagIndex in range(tagCount):
+        tagStart = position + 1 + tagIndex * 5
+        if tagStart + 5 > len(data):
+            break
+        tags[data[tagStart]] = data[tagStart + 1:tagStart + 5]
+
+    # Tag 0x18 holds the time zone, the year and the month, tag 0x19 the day and the time, all in BCD
+    if 0x18 not in tags or 0x19 not in tags:
+        return None
+    _, yearHigh, yearLow, month = tags[0x18]
+    day, hour, minute, second = tags[0x19]
+    try:
+        return datetime(_fromBcd(yearHigh) * 100 + _fromBcd(yearLow), _fromBcd(month), _fromBcd(day),
+                        _fromBcd(hour), _fromBcd(minute), _fromBcd(second))
+    except ValueError:
+        return None
+
+
+def _iterPcrValues(data: bytes):
+    # AVCHD uses 192-byte packets (a 4-byte timecode before every transport packet)
+    for packetSize, syncOffset in ((192, 4), (TS_PACKET_SIZE, 0)):
+        start = next((offset for offset in range(packetSize)
+                      if all(offset + syncOffset + packetIndex * packetSize < len(data)
+                             and data[offset + syncOffset + packetIndex * packetSize] == TS_SYNC_BYTE for packetIndex in range(3))), None)
+        if start is not None:
+            break
+    else:
+        return
+
+    for packetStart in range(start + syncOffset, len(data) - TS_PACKET_SIZE + 1, packetSize):
+        packet = data[packetStart:packetStart + TS_PACKET_SIZE]
+        # Packets with an adaptation field that has the PCR flag set
+        if packet[0] != TS_SYNC_BYTE or not (packet[3] >> 4) & 0x2 or packet[4] < 7 or not packet[5] & 0x10:
+            continue
+        pcrBase = (packet[6] << 25) | (packet[7] << 17) | (packet[8] << 9) | (packet[9] << 1) | (packet[10] >> 7)
+        yield pcrBase * 300 + (((packet[10] & 0x01) << 8) | packet[11])
+
+
+def readMtsMetadata(filePath: str) -> tuple[datetime | None, float | None]:
+    """
+    Reads the recording time (in local time) and the duration in seconds of an AVCHD file.
+    """
+    fileSize = os.path.getsize(filePath)
+    with open(filePath, "rb") as videoFile:
+        headData = videoFile.read(MTS_SCAN_SIZE)
+        videoFile.seek(max(0, fileSize - MTS_SCAN_SIZE))
+        tailData = videoFile.read(MTS_SCAN_SIZE)
+
+    firstPcr = next(_iterPcrValues(headData), None)
+    lastPcr = None
+    for lastPcr in _iterPcrValues(tailData):
+        pass
+
+    duration = (lastPcr - firstPcr) / PCR_CLOCK_RATE if firstPcr is not None and lastPcr is not None and lastPcr > firstPcr else None
+    return _parseMdpmDateTime(headData), duration
+
+
+def getVideoData(filePath: str, metaDataDictionary: dict) -> dict[str, str | float | None]:
+    """
+    Adds the recording date/time ('DateTime', in the EXIF format) and the duration ('duration',
+    in seconds) of a video file to its metadata dictionary, if the container has them.
+    """
+    fileExtension = os.path.splitext(filePath)[1].lower()
+    try:
+        if fileExtension in MP4_EXTENSIONS:
+            recordedTime, duration = readMp4Metadata(filePath)
+        elif fileExtension in MTS_EXTENSIONS:
+            recordedTime, duration = readMtsMetadata(filePath)
+        else:
+            return metaDataDictionary
+    except (OSError, struct.error, IndexError) as e:
+        logger.warning("Could not read video metadata from %s: %s", filePath, e, extra={"file": filePath})
+        return metaDataDictionary
+
+    if recordedTime is not None:
+        metaDataDictionary["DateTime"] = recordedTime.strftime(EXIF_DATETIME_FORMAT)
+    if duration is not None:
+        metaDataDictionary["duration"] = round(duration, 3)
+    return metaDataDictionary
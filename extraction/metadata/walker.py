@@ -0,0 +1,98 @@
+import os
+import time
+from typing import Iterator
+
+from profiling.profiler import getProfiler
+
+#### DIRECTORY WALKER ####
+"""
+This module walks a folder tree with `os.scandir` instead of `os.walk`. The directory entries
+are yielded per folder, in the same order as `os.walk`, so the stat result of every file can
+be taken from its entry once (`statEntry`) and passed to `getRegularData`, instead of separate
+`getctime`, `getmtime`, `exists` and `getsize` calls. Files are filtered on their extension
+before anything is stat'ed, and folders created by NAS software, file managers and the like
+(see IGNORED_DIRECTORIES) are not descended into.
+"""
+
+# The image and video extensions that are processed
+SUPPORTED_TYPES: list[tuple[str, ...]] = [(".gif", ".jpg", ".jpeg", ".png"), (".mov", ".mp4", ".mpg", ".mts")]
+
+# Folders that only contain thumbnails, indexes or deleted files
+IGNORED_DIRECTORIES: frozenset[str] = frozenset({
+    "@eaDir",           # Synology thumbnails and indexes
+    ".@__thumb",        # QNAP thumbnails
+    ".thumbnails",      # Freedesktop thumbnails
+    "#recycle",         # Synology recycle bin
+    "$RECYCLE.BIN",     # Windows recycle bin
+    ".Trashes",         # macOS trash on external volumes
+})
+
+
+def statEntry(entry: os.DirEntry) -> os.stat_result | OSError:
+    """
+    Returns the stat result of a directory entry, or the error if the file cannot be stat'ed
+    (e.g. a broken symbolic link), so the file is not stat'ed again later on. The result is
+    cached by the entry itself.
+    """
+    try:
+        return entry.stat()
+    except OSError as e:
+        return e
+
+
+def scanMediaFiles(sourceFolder: str, supportedExtensions: tuple[str, ...] | None = None,
+                   ignoredDirectories: frozenset[str] = IGNORED_DIRECTORIES,
+                   recursive: bool = True) -> Iterator[tuple[str, list[os.DirEntry], list[str]]]:
+    """
+    Walks a folder tree top-down, in the same order as `os.walk`.
+
+    Args:
+        sourceFolder (str): The path to the root folder to scan.
+        supportedExtensions (tuple[str, ...] | None): The lowercase file extensions to keep.
+                                                      If None, all files are kept.
+        ignoredDirectories (frozenset[str]): The names of folders that are not descended into.
+        recursive (bool): If False, only the files directly in the source folder are listed.
+
+    Yields:
+        tuple[str, list[os.DirEntry], list[str]]: Per folder that contains files: the folder path,
+                                                  the entries of the supported files, and the names
+                                                  of the skipped (unsupported) files.
+    """
+    pendingFolders: list[str] = [sourceFolder]
+    profiler = getProfiler()
+
+    while pendingFolders:
+        folder = pendingFolders.pop()
+        startTime = time.perf_counter()
+        fileEntries: list[os.DirEntry] = []
+        skippedNames: list[str] = []
+        subFolders: list[str] = []
+
+        # Unreadable folders are skipped, as os.walk does without an error handler
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        isDirectory = entry.is_dir()
+                    except OSError:
+                        isDirectory = False
+
+                    if isDirectory:
+                        # Like os.walk, symbolic links to folders are not followed
+                        if recursive and entry.name not in ignoredDirectories and not entry.is_symlink():
+                            subFolders.append(entry.path)
+                    elif supportedExtensions is None or os.path.splitext(entry.name)[1].lower() in supportedExtensions:
+                        fileEntries.append(entry)
+                    else:
+                        skippedNames.append(entry.name)
+        except OSError:
+            continue
+        if profiler is not None:
+            profiler.addStageTime("walk", time.perf_counter() - startTime)
+            profiler.count("foldersScanned")
+
+        if fileEntries or skippedNames:
+            yield folder, fileEntries, skippedNames
+
+        # Visit the subfolders in listing order
+        pendingFolders.extend(reversed(subFolders))
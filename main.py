@@ -1,75 +1,79 @@
-from extraction.extraction import extractData
-from transformation.transformation import transformData
+from extraction.metadata.walker import SUPPORTED_TYPES, scanMediaFiles
+from profiling.profiler import enableProfiling, disableProfiling
+from reporting.logger import configureLogging, shutdownLogging
 
+import argparse
 import os
-import pandas as pd
-import shutil
+from typing import TYPE_CHECKING
+
+# pandas, numpy and PIL are only imported by the stages that need them, so '--help' and runs
+# on folders without media files start quickly (see benchmarks/startupBudget.py)
+if TYPE_CHECKING:
+    import pandas as pd
 
 #### RENAMING FILES ####
-## This module is used to rename files based on the metadata stored in a DataFrame. It reads the metadata from a CSV file, checks for duplicates in the 'indicated' column, and renames files accordingly. The new file names are constructed using the 'indicated', 'folder', and 'file' columns from the DataFrame, while removing any non-alphabetic characters.
+## This module is used to rename files based on the metadata stored in a DataFrame. The renames are planned up front by `planRenames`, which checks for duplicates in the 'indicated' column and detects name collisions, and then executed by `executeRenames` with a bounded thread pool and a journal. The new file names are constructed using the 'indicated', 'folder', and 'file' columns from the DataFrame, while removing any non-alphabetic characters, or from the fields of another naming template (e.g. "{indicated}_{suffix}_{Make}{type}").
 
-# This function removes all non-alphabetic characters from a string.
-def removeNonAlpha(fileString: str) -> str:
-    return ''.join(character for character in fileString if character.isalpha())
+# removeNonAlpha is still importable from main; the renamer (and with it pandas) is only imported on first use
+def __getattr__(name: str):
+    if name == "removeNonAlpha":
+        from renaming.renamer import removeNonAlpha
+        return removeNonAlpha
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # This function renames files based on the metadata stored in a DataFrame.
-def renameFilesFromDataFrame(df: pd.DataFrame) -> None:
-    # Create a Series to keep track of the counts for each 'indicated' value
-    indicated_counts = {}
-
-    for index, row in df.iterrows():
-        initialPath: str = row['path']
-        initialFileName: str = os.path.basename(initialPath)
-        
-        original_indicated = str(row['indicated'])
-        
-        # Check for duplicates and append appropriate suffix
-        if original_indicated not in indicated_counts:
-            indicated_counts[original_indicated] = 0
-            current_indicated = f"{original_indicated}_0"
-        else:
-            indicated_counts[original_indicated] += 1
-            current_indicated = f"{original_indicated}_{indicated_counts[original_indicated]}"
-            
-        # Update the 'indicated' value for the current row with the suffixed version
-        # This modification is only for the current iteration's newFileName construction
-        # It does not alter the original DataFrame in place, which is generally safer
-        # if you need the original 'indicated' for other purposes later.
-        row_indicated_for_filename = current_indicated
-
-        if removeNonAlpha(str(row['file']).split('.')[0]) != "":
-            newFileName: str = row_indicated_for_filename + "_" + \
-                               removeNonAlpha(str(row['folder'])) + "_" + \
-                               removeNonAlpha(str(row['file']).split('.')[0]) + \
-                               str(row['type'])
-        else:
-            if removeNonAlpha(str(row['folder'])) == "":
-                newFileName: str = row_indicated_for_filename + \
-                str(row['type'])
-            else:
-                newFileName: str = row_indicated_for_filename + "_" + \
-                removeNonAlpha(str(row['folder'])) + \
-                str(row['type'])
-            
-        directory: str = os.path.dirname(initialPath)
-        newPath: str = os.path.join(directory, newFileName)
-
-        if os.path.exists(initialPath):
-            try:
-                shutil.move(initialPath, newPath)
-                print(f"Renamed '{initialFileName}' to '{newFileName}', in directory: '{directory}'")
-            except Exception as e:
-                print(f"Error renaming '{initialFileName}' to '{newFileName}': {e}")
-        else:
-            print(f"File not found: '{initialFileName}' in directory: '{directory}'")
+def renameFilesFromDataFrame(df: "pd.DataFrame", sourceFolder: str | None = None, dryRun: bool = False, workers: int = 8,
+                             template: str | None = None) -> "pd.DataFrame":
+    from renaming.renamer import DEFAULT_NAME_TEMPLATE, JOURNAL_FILE_NAME, planRenames, executeRenames
+
+    # Plan every rename first, so collisions are detected before any file is moved
+    plan: pd.DataFrame = planRenames(df, template or DEFAULT_NAME_TEMPLATE)
+
+    # The journal next to the metadata file allows an interrupted run to be resumed or rolled back
+    journalPath: str | None = os.path.join(sourceFolder, JOURNAL_FILE_NAME) if sourceFolder else None
+    executeRenames(plan, journalPath = journalPath, workers = workers, dryRun = dryRun)
+    return plan
+
+# This function maps the paths of the renamed files in a DataFrame indexed by path to their new paths, so it matches the files on disk.
+def applyRenamesToDataFrame(df: "pd.DataFrame", plan: "pd.DataFrame") -> "pd.DataFrame":
+    from renaming.renamer import RENAME
+
+    # Only the renames that were carried out; a move can fail, and a dry run moves nothing
+    renames = plan.loc[plan["status"] == RENAME]
+    renames = renames.loc[[os.path.exists(target) and not os.path.exists(source)
+                           for source, target in renames[["source", "target"]].itertuples(index=False)]]
+    if renames.empty:
+        return df
+
+    df = df.rename(index = dict(zip(renames["source"], renames["target"])))
+    if "file" in df.columns:
+        df.loc[renames["target"], "file"] = [os.path.basename(target) for target in renames["target"]]
+    return df
 #### ####
 
 
 
 #### MAIN FUNCTION ####        
-## This is the main function that runs the program. It prompts the user for the source folder, checks if it exists, and then calls the extractData and transformData functions to extract and transform the data. It also reads the CSV file and renames files based on the DataFrame.
+## This is the main function that runs the program. It prompts the user for the source folder, checks if it exists, and then calls the extractData and transformData functions to extract and transform the data. The DataFrame is passed from extraction to transformation and renaming in memory; the CSV file is only written once, by transformData. With `profile`, the time spent in every stage is written as JSON to .mediaMetaData.profile.json in the source folder. Messages below `logLevel` are not shown, the progress is shown as a bar or as summary lines (`progress`), and warnings and errors are written as JSON lines to .mediaMetaData.log.jsonl in the source folder. The "parallel" engine uses `workers` processes, by default one per CPU. With `exifTags`, only the listed EXIF tags are extracted; with `rareTagDensity`, tags that at most that fraction of the files have are moved to .mediaMetaData.rareTags.csv. The progress of the extraction is checkpointed, so with `resume`, a run that crashed or was killed continues from its last checkpoint; files that could not be read are listed in .mediaMetaData.errors.csv. The extraction, transformation and renaming modules (and with them pandas and PIL) are only imported once the folder is known to contain media files. With `dryRun`, the planned renames are only logged; with `journalAction` ("resume" or "rollback"), nothing is extracted, and the rename run recorded in .mediaRename.journal.jsonl is resumed or rolled back instead.
+
+def _finishRenameJournal(sourceFolder: str, journalAction: str) -> None:
+    from renaming.renamer import JOURNAL_FILE_NAME, resumeRenames, rollbackRenames
 
-def main(sourceFolder: str) -> None: 
+    journalPath = os.path.join(sourceFolder, JOURNAL_FILE_NAME)
+    if not os.path.exists(journalPath):
+        print(f"No rename journal found in '{sourceFolder}'. Exiting program.")
+        exit()
+    summary = resumeRenames(journalPath) if journalAction == "resume" else rollbackRenames(journalPath)
+    print(f"\nRename journal {'resumed' if journalAction == 'resume' else 'rolled back'}: {summary}")
+
+def _hasMediaFiles(sourceFolder: str) -> bool:
+    # Stops at the first supported file, so a non-empty folder is not walked twice
+    return any(fileEntries for _, fileEntries, _ in scanMediaFiles(sourceFolder, SUPPORTED_TYPES[0] + SUPPORTED_TYPES[1]))
+
+def main(sourceFolder: str, profile: bool = False, logLevel: str = "INFO", progress: str = "auto",
+         exifTags: list[str] | None = None, rareTagDensity: float | None = None, buildIndex: bool = False,
+         engine: str = "auto", maxInFlight: int = 64, nameTemplate: str | None = None, resume: bool = False,
+         dryRun: bool = False, journalAction: str | None = None, workers: int | None = None) -> None: 
     # Check if the source folder is provided and exists
     if sourceFolder is None:
         print("No source folder provided. Exiting program.")
@@ -78,33 +82,74 @@ def main(sourceFolder: str) -> None:
         print(f"Source folder '{sourceFolder}' does not exist. Exiting program.")
         exit()
     else:
-        # Attempt to extract and transform data from the source folder
-        extractData(sourceFolder)
-        transformData(sourceFolder, dropEmptyCols = True, dropFloatCols = True)
-        print("\nData extraction and transformation completed successfully.")
-
-        # Attempt to read the CSV file and rename files based on the DataFrame if this is set to True
+        # Time the stages of the run and write the report next to the CSV file, if requested
+        if profile:
+            enableProfiling()
+        configureLogging(logLevel, sourceFolder = sourceFolder, progress = progress)
         try:
-            if True:
-                print("\nRenaming files based on metadata...")
-                renameFilesFromDataFrame(df = pd.read_csv(sourceFolder + "\\.mediaMetaData.csv", sep=";"))
+            # Resuming or rolling back a rename run only needs its journal
+            if journalAction is not None:
+                _finishRenameJournal(sourceFolder, journalAction)
+                return
+
+            if not _hasMediaFiles(sourceFolder):
+                print(f"No supported media files found in '{sourceFolder}'. Exiting program.")
+                exit()
+
+            from extraction.extraction import extractData
+            from transformation.transformation import transformData
+
+            # The parallel engine gets a process per CPU unless told otherwise; the other engines run in one process
+            if workers is None:
+                workers = (os.cpu_count() or 1) if engine == "parallel" else 1
+
+            # Attempt to extract and transform data from the source folder, passing the DataFrame in memory
+            df = extractData(sourceFolder, supportedTypes = SUPPORTED_TYPES, returnDataFrame = True, exifTags = exifTags,
+                             engine = engine, workers = workers, maxInFlight = maxInFlight, resume = resume)
+            df = transformData(sourceFolder, dropEmptyCols = True, dropFloatCols = True, df = df, rareTagDensity = rareTagDensity)
+            if df is None:
+                print("No metadata to rename files with. Exiting program.")
+                exit()
+            print("\nData extraction and transformation completed successfully.")
+
+            # Attempt to rename files based on the transformed DataFrame if this is set to True
+            try:
+                if True:
+                    print("\nRenaming files based on metadata...")
+                    plan = renameFilesFromDataFrame(df = df.reset_index(), sourceFolder = sourceFolder, template = nameTemplate,
+                                                    dryRun = dryRun)
+
+                    # Update the queryable index after renaming, with the paths the files have now
+                    if buildIndex:
+                        from storage.index import updateIndex
+                        updateIndex(applyRenamesToDataFrame(df, plan), sourceFolder)
         
-        # Handle potential errors when reading the CSV file or renaming files
-        except FileNotFoundError as e:
-            print(f"File not found: {e}. Please ensure the CSV file exists in the source folder.")
-            exit()
-        except KeyError as e:
-            print(f"Key error occurred: {e}. Please check the column names in the CSV file.")
-            exit()
-        except OSError as e:
-            print(f"OS error occurred: {e}. Please check if the source folder exists, or if the CSV file is currently opened by a user. Exiting program.")
-            exit()
-        except ValueError as e:
-            print(f"Value error occurred: {e}. Please check the data in the CSV file.")
-            exit()
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}. Exiting program.")
-            exit()
+            # Handle potential errors when reading the CSV file or renaming files
+            except FileExistsError as e:
+                print(f"{e} Exiting program.")
+                exit()
+            except FileNotFoundError as e:
+                print(f"File not found: {e}. Please ensure the CSV file exists in the source folder.")
+                exit()
+            except KeyError as e:
+                print(f"Key error occurred: {e}. Please check the column names in the CSV file.")
+                exit()
+            except OSError as e:
+                print(f"OS error occurred: {e}. Please check if the source folder exists, or if the CSV file is currently opened by a user. Exiting program.")
+                exit()
+            except ValueError as e:
+                print(f"Value error occurred: {e}. Please check the data in the CSV file.")
+                exit()
+            except Exception as e:
+                print(f"An unexpected error occurred: {e}. Exiting program.")
+                exit()
+        finally:
+            logPath = shutdownLogging()
+            if logPath is not None:
+                print(f"\nWarnings and errors written to: {logPath}")
+            if profile:
+                reportPath = disableProfiling().writeReport(sourceFolder)
+                print(f"\nProfile written to: {reportPath}")
 
 #### ####
 
@@ -113,9 +158,41 @@ def main(sourceFolder: str) -> None:
 #### RUN THE MAIN FUNCTION ####
 # This ensures that the main function is called when the script is run directly.
 if __name__ == "__main__":
-    print("\nPlease enter name of source folder: ")
-    sourceFolder: str = input("")
-    main(sourceFolder)
+    parser = argparse.ArgumentParser(description="Extract, transform and rename media files based on their metadata.")
+    parser.add_argument("sourceFolder", nargs="?", help="the source folder; asked for if not given")
+    parser.add_argument("--profile", action="store_true", help="write stage timings to .mediaMetaData.profile.json")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="the lowest level of the messages shown; DEBUG shows every file")
+    parser.add_argument("--progress", default="auto", choices=["auto", "bar", "summary", "off"], help="how the progress of long stages is shown")
+    parser.add_argument("--exif-tags", type=lambda value: [tag.strip() for tag in value.split(",") if tag.strip()],
+                        help="a comma-separated list of the EXIF tags to extract, e.g. 'Make,Model,DateTime'; all tags if not given")
+    parser.add_argument("--rare-tags", type=float, metavar="DENSITY",
+                        help="move EXIF tags that at most this fraction of the files have to .mediaMetaData.rareTags.csv")
+    parser.add_argument("--index", action="store_true", help="update the queryable metadata index .mediaMetaData.index.sqlite")
+    parser.add_argument("--engine", default="auto", choices=["auto", "serial", "parallel", "async"],
+                        help="how the files are processed; 'async' keeps many reads in flight, for network storage")
+    parser.add_argument("--workers", type=int, help="the number of processes of the parallel engine; one per CPU if not given. "
+                                                   "With the auto engine, more than one selects the parallel engine")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="the maximum number of reads in flight with the async engine")
+    parser.add_argument("--name-template", help="the naming template of the new file names, e.g. '{indicated}_{suffix}_{Make}{type}'; "
+                                                "the default is '{indicated}_{suffix}_{folder}_{file}{type}'")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted extraction from its last checkpoint in .mediaMetaData.checkpoint")
+    parser.add_argument("--dry-run", action="store_true", help="log the planned renames without moving any file")
+    journalGroup = parser.add_mutually_exclusive_group()
+    journalGroup.add_argument("--resume-renames", dest="journal_action", action="store_const", const="resume",
+                              help="finish the interrupted rename run recorded in .mediaRename.journal.jsonl, without extracting")
+    journalGroup.add_argument("--rollback-renames", dest="journal_action", action="store_const", const="rollback",
+                              help="move the files renamed by the run in .mediaRename.journal.jsonl back, without extracting")
+    arguments = parser.parse_args()
+
+    sourceFolder: str | None = arguments.sourceFolder
+    if sourceFolder is None:
+        print("\nPlease enter name of source folder: ")
+        sourceFolder = input("")
+    main(sourceFolder, profile = arguments.profile, logLevel = arguments.log_level, progress = arguments.progress,
+         exifTags = arguments.exif_tags, rareTagDensity = arguments.rare_tags, buildIndex = arguments.index,
+         engine = arguments.engine, maxInFlight = arguments.max_in_flight, nameTemplate = arguments.name_template,
+         resume = arguments.resume, dryRun = arguments.dry_run, journalAction = arguments.journal_action,
+         workers = arguments.workers)
     print("\nProgram completed successfully.\n")
     exit()
 #### ####
\ No newline at end of file
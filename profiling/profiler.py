@@ -0,0 +1,191 @@
+import bisect
+import functools
+import heapq
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+#### PROFILING ####
+"""
+This module measures where the time of a run goes. A `Profiler` keeps wall-clock timers per
+stage (e.g. walking the tree, writing the table, `selectDateTime`), per-file latencies per
+stage with a histogram and the slowest files, and counters (e.g. EXIF tags that needed the
+latin-1 fallback). Profiling is off unless `enableProfiling` is called; the instrumented code
+asks `getProfiler()` for the active profiler (or uses `profileStage` and `profiled`) and skips
+all measuring when there is none, so the overhead of a normal run is one check per file and
+stage. The report is written as JSON next to the metadata table.
+"""
+
+PROFILE_FILE_NAME = ".mediaMetaData.profile.json"
+
+# The upper bounds of the latency histogram buckets, in milliseconds
+HISTOGRAM_BOUNDS_MS: list[float] = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+
+class _FileLatencies:
+    def __init__(self, slowestCount: int) -> None:
+        self.count = 0
+        self.totalSeconds = 0.0
+        self.bucketCounts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        self.slowestCount = slowestCount
+        self.slowestFiles: list[tuple[float, str]] = []
+
+    def add(self, filePath: str, seconds: float) -> None:
+        self.count += 1
+        self.totalSeconds += seconds
+        self.bucketCounts[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, seconds * 1000)] += 1
+
+        # Keep the slowest files in a min-heap of fixed size
+        if len(self.slowestFiles) < self.slowestCount:
+            heapq.heappush(self.slowestFiles, (seconds, filePath))
+        elif seconds > self.slowestFiles[0][0]:
+            heapq.heapreplace(self.slowestFiles, (seconds, filePath))
+
+    def _percentileMs(self, fraction: float) -> float | None:
+        # The upper bound of the bucket that contains the percentile; None if it is above the last bound
+        if self.count == 0:
+            return None
+        cumulativeCount = 0
+        for bucketIndex, bucketCount in enumerate(self.bucketCounts[:-1]):
+            cumulativeCount += bucketCount
+            if cumulativeCount >= fraction * self.count:
+                return HISTOGRAM_BOUNDS_MS[bucketIndex]
+        return None
+
+    def report(self) -> dict:
+        bucketLabels = [f"<={bound}ms" for bound in HISTOGRAM_BOUNDS_MS] + [f">{HISTOGRAM_BOUNDS_MS[-1]}ms"]
+        return {
+            "files": self.count,
+            "totalSeconds": round(self.totalSeconds, 6),
+            "meanMs": round(self.totalSeconds / self.count * 1000, 3) if self.count else None,
+            "p50Ms": self._percentileMs(0.5),
+            "p90Ms": self._percentileMs(0.9),
+            "p99Ms": self._percentileMs(0.99),
+            "histogram": {label: bucketCount for label, bucketCount in zip(bucketLabels, self.bucketCounts) if bucketCount},
+            "slowestFiles": [{"path": filePath, "ms": round(seconds * 1000, 3)}
+                             for seconds, filePath in sorted(self.slowestFiles, reverse=True)],
+        }
+
+
+class Profiler:
+    """
+    Collects stage timers, per-file latencies and counters. All methods are thread-safe.
+
+    Args:
+        slowestCount (int): The number of slowest files reported per stage.
+    """
+
+    def __init__(self, slowestCount: int = 20) -> None:
+        self.slowestCount = slowestCount
+        self.startTime = time.perf_counter()
+        self.stageSeconds: dict[str, float] = {}
+        self.stageCalls: dict[str, int] = {}
+        self.fileLatencies: dict[str, _FileLatencies] = {}
+        self.counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def addStageTime(self, stageName: str, seconds: float) -> None:
+        with self._lock:
+            self.stageSeconds[stageName] = self.stageSeconds.get(stageName, 0.0) + seconds
+            self.stageCalls[stageName] = self.stageCalls.get(stageName, 0) + 1
+
+    @contextmanager
+    def stage(self, stageName: str):
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addStageTime(stageName, time.perf_counter() - startTime)
+
+    def recordFile(self, stageName: str, filePath: str, seconds: float) -> None:
+        with self._lock:
+            if stageName not in self.fileLatencies:
+                self.fileLatencies[stageName] = _FileLatencies(self.slowestCount)
+            self.fileLatencies[stageName].add(filePath, seconds)
+
+    def count(self, counterName: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[counterName] = self.counters.get(counterName, 0) + amount
+
+    def report(self) -> dict:
+        """
+        Returns the collected measurements. Stages with per-file latencies also get their
+        throughput in files per second of stage time (or of per-file time, if the stage has no timer).
+        """
+        with self._lock:
+            stages: dict[str, dict] = {}
+            for stageName in sorted(self.stageSeconds.keys() | self.fileLatencies.keys()):
+                stageReport: dict = {}
+                if stageName in self.stageSeconds:
+                    stageReport["seconds"] = round(self.stageSeconds[stageName], 6)
+                    stageReport["calls"] = self.stageCalls[stageName]
+                if stageName in self.fileLatencies:
+                    latencies = self.fileLatencies[stageName]
+                    stageReport.update(latencies.report())
+                    stageSeconds = self.stageSeconds.get(stageName, latencies.totalSeconds)
+                    stageReport["filesPerSecond"] = round(latencies.count / stageSeconds, 1) if stageSeconds > 0 else None
+                stages[stageName] = stageReport
+
+            return {
+                "totalSeconds": round(time.perf_counter() - self.startTime, 6),
+                "stages": stages,
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def writeReport(self, sourceFolder: str) -> str:
+        """
+        Writes the report as JSON next to the metadata table, and returns its path.
+        """
+        reportPath = os.path.join(sourceFolder, PROFILE_FILE_NAME)
+        with open(reportPath, "w", encoding="utf-8") as reportFile:
+            json.dump(self.report(), reportFile, indent=2)
+        return reportPath
+
+
+_activeProfiler: Profiler | None = None
+
+
+def enableProfiling(slowestCount: int = 20) -> Profiler:
+    """
+    Starts profiling, and returns the new active profiler.
+    """
+    global _activeProfiler
+    _activeProfiler = Profiler(slowestCount)
+    return _activeProfiler
+
+
+def disableProfiling() -> Profiler | None:
+    """
+    Stops profiling, and returns the profiler that was active.
+    """
+    global _activeProfiler
+    profiler, _activeProfiler = _activeProfiler, None
+    return profiler
+
+
+def getProfiler() -> Profiler | None:
+    return _activeProfiler
+
+
+def profileStage(stageName: str):
+    """
+    Returns a context manager that times a stage, or does nothing if profiling is off.
+    """
+    return _activeProfiler.stage(stageName) if _activeProfiler is not None else nullcontext()
+
+
+def profiled(stageName: str):
+    """
+    Decorates a function so every call is timed as a stage while profiling is on.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _activeProfiler is None:
+                return function(*args, **kwargs)
+            with _activeProfiler.stage(stageName):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,341 @@
+import json
+import logging
+import os
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+from transformation.datetimeFilter import formatIndicated
+from profiling.profiler import getProfiler, profiled
+from reporting.logger import ProgressReporter, getLogger
+
+#### RENAME PLANNING AND EXECUTION ####
+"""
+This module renames files based on the metadata stored in a DataFrame, in two steps. First,
+`planRenames` computes the new file name of every row at once: the rendered 'indicated'
+date/time with a '_N' counter for duplicates, followed by the alphabetic characters of the
+'folder' and 'file' columns and the file type, or the fields of another naming template.
+Collisions are detected before anything is moved: targets that occur twice in the plan,
+targets that already exist on disk, and targets that are the source of another rename.
+Second, `executeRenames` moves the files with a bounded thread pool, and records every
+completed move in a journal next to the metadata file, so an interrupted run can be resumed
+with `resumeRenames` or undone with `rollbackRenames`. A journal is closed with a 'finished'
+entry; a new run refuses to start while the journal of an interrupted run is left, and moves
+a finished journal aside under a timestamped name, so earlier runs can still be rolled back.
+Skipped files are logged at DEBUG level and failed renames as warnings; the progress of the
+moves is reported by a `ProgressReporter`.
+"""
+
+logger = getLogger(__name__)
+
+JOURNAL_FILE_NAME = ".mediaRename.journal.jsonl"
+
+# The statuses of the rows in a rename plan
+RENAME = "rename"
+UNCHANGED = "unchanged"
+NO_DATE = "no date"
+MISSING = "missing"
+CONFLICT = "conflict"
+
+# This function removes all non-alphabetic characters from a string.
+def removeNonAlpha(fileString: str) -> str:
+    return ''.join(character for character in fileString if character.isalpha())
+
+# Everything but letters; for ASCII text this removes exactly the characters str.isalpha rejects
+NON_ALPHA_PATTERN = r"[\W\d_]+"
+
+# The default naming template: the rendered 'indicated' value, its counter, the folder and file names and the type
+DEFAULT_NAME_TEMPLATE = "{indicated}_{suffix}_{folder}_{file}{type}"
+
+# Template fields that are not cleaned and never left out
+FIXED_NAME_FIELDS: frozenset[str] = frozenset({"indicated", "suffix", "type"})
+
+def _cleanValues(values: pd.Series) -> pd.Series:
+    # Folder and file names repeat a lot, so every distinct value is only cleaned once
+    codes, uniqueValues = pd.factorize(values.astype(str).fillna(""))
+    uniqueValues = pd.Series(uniqueValues, dtype="string")
+
+    # The regex engine only knows ASCII letters, so other text is cleaned character by character
+    cleanedValues = uniqueValues.str.replace(NON_ALPHA_PATTERN, "", regex=True).astype(object)
+    isAscii = uniqueValues.str.isascii().to_numpy(dtype=bool)
+    cleanedValues[~isAscii] = [removeNonAlpha(value) for value in uniqueValues[~isAscii]]
+    return pd.Series(cleanedValues.to_numpy()[codes], index=values.index, dtype=object)
+
+def _parseNameTemplate(template: str) -> tuple[list[tuple[str, str]], str]:
+    # The (text before, field) pairs of a template, and the text after the last field
+    segments: list[tuple[str, str]] = []
+    literalText = ""
+    for text, fieldName, formatSpec, conversion in string.Formatter().parse(template):
+        literalText += text
+        if fieldName is None:
+            continue
+        if not fieldName or formatSpec or conversion:
+            raise ValueError(f"Naming template fields must be plain column names, e.g. '{{folder}}': '{template}'.")
+        segments.append((literalText, fieldName))
+        literalText = ""
+    return segments, literalText
+
+def buildNewFileNames(df: pd.DataFrame, template: str = DEFAULT_NAME_TEMPLATE) -> pd.Series:
+    """
+    Builds the new file name of every row. Rows without an 'indicated' value get no name.
+    The '_N' counters come from the 'indicatedSuffix' column if every row with a date has one
+    (e.g. a table merged from shards, whose counters are numbered across all shards).
+
+    The template names the fields of the new name: 'indicated', 'suffix' (the counter), 'type'
+    (the extension, with its dot), 'file' (the file name without extension) and any other
+    column of the DataFrame, such as 'folder' or 'Make'. Only the letters of these other fields
+    are kept. Fields that are empty at the end of the name (before fixed fields such as 'type')
+    are left out with the text before them, so the default template gives
+    '20190102_030405_0_Holiday_IMG.jpg' for 'IMG_1234.jpg', or '20190102_030405_0_Holiday.jpg'
+    for '1234.jpg'.
+
+    Args:
+        df (pd.DataFrame): The metadata, with 'indicated', 'type' and the template's columns.
+        template (str): The naming template, e.g. "{indicated}_{suffix}_{Make}{type}".
+
+    Returns:
+        pd.Series: The new file names, with the same index as the DataFrame.
+    """
+    segments, trailingText = _parseNameTemplate(template)
+    unknownFields = [fieldName for _, fieldName in segments if fieldName not in FIXED_NAME_FIELDS | {"file"} and fieldName not in df.columns]
+    if unknownFields:
+        raise KeyError(f"The naming template uses columns that are not in the metadata: {', '.join(unknownFields)}.")
+
+    indicatedNames: pd.Series = formatIndicated(df['indicated'], df.get('indicatedDateOnly'))
+    hasDate: pd.Series = indicatedNames.notna()
+    rows: pd.DataFrame = df[hasDate]
+
+    # Number the duplicates of every 'indicated' value in the order of the DataFrame, unless the counters are given
+    if "indicatedSuffix" in df.columns and df.loc[hasDate, "indicatedSuffix"].notna().all():
+        suffixes: pd.Series = df.loc[hasDate, "indicatedSuffix"].astype("int64")
+    else:
+        suffixes = indicatedNames[hasDate].groupby(indicatedNames[hasDate], sort=False).cumcount()
+
+    fieldValues: list[pd.Series] = []
+    for _, fieldName in segments:
+        if fieldName == "indicated":
+            fieldValues.append(indicatedNames[hasDate].astype(object))
+        elif fieldName == "suffix":
+            fieldValues.append(suffixes.astype(str).astype(object))
+        elif fieldName == "type":
+            fieldValues.append(rows['type'].astype(str).astype(object))
+        elif fieldName == "file":
+            # The file name up to its first dot
+            fieldValues.append(_cleanValues(rows['file'].astype(str).str.replace(r"(?s)\..*", "", regex=True)))
+        else:
+            fieldValues.append(_cleanValues(rows[fieldName]))
+
+    # Build the names from the end, so a cleaned field is left out while it and every cleaned field after it are empty
+    newFileNames = pd.Series(trailingText, index=rows.index, dtype=object)
+    isTrailingEmpty = pd.Series(True, index=rows.index)
+    for (literalText, fieldName), values in reversed(list(zip(segments, fieldValues))):
+        if fieldName in FIXED_NAME_FIELDS:
+            newFileNames = literalText + values + newFileNames
+            continue
+        isTrailingEmpty &= values == ""
+        newFileNames = newFileNames.where(isTrailingEmpty, literalText + values + newFileNames)
+
+    return newFileNames.reindex(df.index)
+
+def _listDirectories(directories) -> set[str]:
+    # List every directory once instead of checking every path separately
+    existingPaths: set[str] = set()
+    for directory in directories:
+        try:
+            existingPaths.update(os.path.join(directory, fileName) for fileName in os.listdir(directory))
+        except OSError:
+            pass
+    return existingPaths
+
+@profiled("renamePlan")
+def planRenames(df: pd.DataFrame, template: str = DEFAULT_NAME_TEMPLATE) -> pd.DataFrame:
+    """
+    Plans the renames of the files in a DataFrame, without moving anything.
+
+    Args:
+        df (pd.DataFrame): The metadata, with 'path', 'indicated', 'folder', 'file' and 'type' columns.
+        template (str): The naming template of the new file names (see `buildNewFileNames`).
+
+    Returns:
+        pd.DataFrame: The plan, with 'source', 'target' and 'status' columns. Only rows with
+                      the status "rename" are moved by `executeRenames`.
+    """
+    sources: pd.Series = df['path'].astype(str)
+    newFileNames: pd.Series = buildNewFileNames(df, template)
+    directories: pd.Series = sources.map(os.path.dirname)
+    targets: pd.Series = pd.Series([os.path.join(directory, newFileName) if isinstance(newFileName, str) else None
+                                    for directory, newFileName in zip(directories, newFileNames)], index=df.index, dtype=object)
+
+    plan = pd.DataFrame({"source": sources, "target": targets, "status": RENAME}, index=df.index)
+    existingPaths: set[str] = _listDirectories(directories.unique())
+
+    # Detect collisions up front: duplicate targets, targets on disk, and targets that are moved away
+    isMovedAway: pd.Series = targets.notna() & (sources != targets)
+    isDuplicateTarget: pd.Series = targets.duplicated(keep=False) & targets.notna()
+    isExistingTarget: pd.Series = targets.isin(existingPaths) & isMovedAway
+    isOtherSource: pd.Series = targets.isin(set(sources[isMovedAway])) & isMovedAway
+
+    plan.loc[isDuplicateTarget | isExistingTarget | isOtherSource, "status"] = CONFLICT
+    plan.loc[~sources.isin(existingPaths), "status"] = MISSING
+    plan.loc[targets.notna() & (sources == targets), "status"] = UNCHANGED
+    plan.loc[targets.isna(), "status"] = NO_DATE
+
+    return plan
+
+def _appendJournal(journalFile, journalLock: threading.Lock, entry: dict) -> None:
+    with journalLock:
+        journalFile.write(json.dumps(entry) + "\n")
+        journalFile.flush()
+
+def _moveFiles(moves: list[tuple[int, str, str]], journalFile, journalEvent: str, workers: int, description: str) -> tuple[int, int]:
+    journalLock = threading.Lock()
+    profiler = getProfiler()
+
+    def _moveFile(move: tuple[int, str, str]) -> bool:
+        moveId, source, target = move
+        try:
+            # Sources and targets are in the same directory, so a rename is enough
+            startTime = time.perf_counter()
+            os.rename(source, target)
+            if profiler is not None:
+                profiler.recordFile("rename", source, time.perf_counter() - startTime)
+        except OSError as e:
+            logger.warning("Could not rename '%s' to '%s': %s", source, os.path.basename(target), e, extra={"file": source, "target": target})
+            return False
+        _appendJournal(journalFile, journalLock, {journalEvent: moveId})
+        return True
+
+    moved = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as threadPool, ProgressReporter(description, total=len(moves)) as progress:
+        for result in threadPool.map(_moveFile, moves):
+            moved += result
+            failed += not result
+            progress.advance()
+    return moved, failed
+
+def _readJournal(journalPath: str) -> tuple[list[dict], set[int], set[int], bool]:
+    moves: list[dict] = []
+    doneIds: set[int] = set()
+    undoneIds: set[int] = set()
+    isFinished = False
+
+    with open(journalPath, "r", encoding="utf-8") as journalFile:
+        for line in journalFile:
+            # A line may have been cut off if the run was interrupted while writing it
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "source" in entry:
+                moves.append(entry)
+            elif "done" in entry:
+                doneIds.add(entry["done"])
+            elif "undone" in entry:
+                undoneIds.add(entry["undone"])
+            elif "finished" in entry:
+                isFinished = True
+    return moves, doneIds, undoneIds, isFinished
+
+def _finishJournal(journalFile) -> None:
+    # Marks the run as complete; a journal without this entry belongs to an interrupted run
+    journalFile.write(json.dumps({"finished": True}) + "\n")
+    journalFile.flush()
+
+def _rotateJournal(journalPath: str) -> None:
+    if not os.path.exists(journalPath):
+        return
+    moves, doneIds, undoneIds, isFinished = _readJournal(journalPath)
+    # Journals without a 'finished' entry count as finished once all moves are done, or all undone
+    isPending = any(move["id"] not in doneIds for move in moves) or (undoneIds and undoneIds != doneIds)
+    if not isFinished and isPending:
+        raise FileExistsError(f"The rename journal '{journalPath}' belongs to a run that was interrupted. "
+                              "Resume it (--resume-renames) or roll it back (--rollback-renames) first.")
+    if not moves:
+        return
+
+    # Keep the journal of the previous run, so its renames can still be rolled back
+    modifiedTime = datetime.fromtimestamp(os.path.getmtime(journalPath))
+    journalRoot, journalExtension = os.path.splitext(journalPath)
+    os.replace(journalPath, f"{journalRoot}.{modifiedTime:%Y%m%d_%H%M%S_%f}{journalExtension}")
+
+@profiled("renameExecute")
+def executeRenames(plan: pd.DataFrame, journalPath: str | None = None, workers: int = 8, dryRun: bool = False) -> dict[str, int]:
+    """
+    Executes the renames of a plan made by `planRenames`.
+
+    Args:
+        plan (pd.DataFrame): The rename plan.
+        journalPath (str | None): The path of the journal. If None, no journal is written. The
+                                  journal of a previous run is kept under a timestamped name.
+        workers (int): The maximum number of threads that move files.
+        dryRun (bool): If True, logs the planned renames without moving anything.
+
+    Returns:
+        dict[str, int]: The number of rows per status, and the number of renamed and failed files.
+
+    Raises:
+        FileExistsError: If the journal of an interrupted run is at `journalPath`.
+    """
+    summary: dict[str, int] = plan["status"].value_counts().to_dict()
+
+    if logger.isEnabledFor(logging.DEBUG):
+        for source, status in plan.loc[plan["status"].isin([CONFLICT, MISSING, NO_DATE]), ["source", "status"]].itertuples(index=False):
+            logger.debug("Skipping '%s': %s.", source, status)
+
+    renames: pd.DataFrame = plan[plan["status"] == RENAME]
+    if dryRun:
+        for source, target in renames[["source", "target"]].itertuples(index=False):
+            logger.info("Would rename '%s' to '%s', in directory: '%s'", os.path.basename(source), os.path.basename(target), os.path.dirname(source))
+        return summary
+
+    moves = [(moveId, source, target) for moveId, (source, target) in enumerate(renames[["source", "target"]].itertuples(index=False))]
+    if journalPath:
+        _rotateJournal(journalPath)
+
+    # Write the whole plan to the journal before the first file is moved
+    with open(journalPath if journalPath else os.devnull, "w", encoding="utf-8") as journalFile:
+        for moveId, source, target in moves:
+            journalFile.write(json.dumps({"id": moveId, "source": source, "target": target}) + "\n")
+        journalFile.flush()
+
+        summary["renamed"], summary["failed"] = _moveFiles(moves, journalFile, "done", workers, "Renaming files")
+        _finishJournal(journalFile)
+
+    logger.info("Renamed %d files, %d failed, %d conflicts, %d unchanged, %d not found, %d without a date.",
+                summary["renamed"], summary["failed"], summary.get(CONFLICT, 0), summary.get(UNCHANGED, 0),
+                summary.get(MISSING, 0), summary.get(NO_DATE, 0))
+    return summary
+
+def resumeRenames(journalPath: str, workers: int = 8) -> dict[str, int]:
+    """
+    Resumes an interrupted run of `executeRenames` from its journal.
+    """
+    moves, doneIds, _, _ = _readJournal(journalPath)
+    pendingMoves = [(move["id"], move["source"], move["target"]) for move in moves
+                    if move["id"] not in doneIds and os.path.exists(move["source"]) and not os.path.exists(move["target"])]
+
+    with open(journalPath, "a", encoding="utf-8") as journalFile:
+        renamed, failed = _moveFiles(pendingMoves, journalFile, "done", workers, "Resuming renames")
+        _finishJournal(journalFile)
+
+    logger.info("Resumed renaming: %d files renamed, %d failed, %d already done.", renamed, failed, len(doneIds))
+    return {"renamed": renamed, "failed": failed, "alreadyDone": len(doneIds)}
+
+def rollbackRenames(journalPath: str, workers: int = 8) -> dict[str, int]:
+    """
+    Moves the files renamed by `executeRenames` (or `resumeRenames`) back to their original names.
+    """
+    moves, doneIds, undoneIds, _ = _readJournal(journalPath)
+    rollbackMoves = [(move["id"], move["target"], move["source"]) for move in moves
+                     if move["id"] in doneIds - undoneIds and os.path.exists(move["target"]) and not os.path.exists(move["source"])]
+
+    with open(journalPath, "a", encoding="utf-8") as journalFile:
+        restored, failed = _moveFiles(rollbackMoves, journalFile, "undone", workers, "Rolling back renames")
+        _finishJournal(journalFile)
+
+    logger.info("Rolled back renaming: %d files restored, %d failed.", restored, failed)
+    return {"restored": restored, "failed": failed}
@@ -0,0 +1,289 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener
+
+#### LOGGING ####
+"""
+This module replaces the per-file `print` calls with logging. All messages go to the
+"mediaMetaData" logger (or one of its children, see `getLogger`): per-file and per-folder
+messages are DEBUG, summaries are INFO, and problems with single files (e.g. EXIF tags that
+cannot be decoded) are WARNING. Without configuration, INFO and above are written to stdout
+as before. `configureLogging` sets the level and moves the writing to a background thread,
+so logging stays off the hot path; warnings and errors are also buffered and written as JSON
+lines to .mediaMetaData.log.jsonl in the source folder. Instead of a line per file, long
+stages report their progress with a `ProgressReporter`: a progress bar on a terminal, or an
+aggregated throughput line every few seconds otherwise. `collectFileErrors` also keeps the
+warnings and errors about single files as rows, e.g. for the error table of an extraction.
+"""
+
+ROOT_LOGGER_NAME = "mediaMetaData"
+LOG_FILE_NAME = ".mediaMetaData.log.jsonl"
+
+# The attributes every log record has; any other attribute was passed with `extra`
+_RECORD_ATTRIBUTES: frozenset[str] = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class _StdoutHandler(logging.StreamHandler):
+    # Looks up sys.stdout when a record is written, as print does, so redirecting stdout still works
+    def __init__(self) -> None:
+        logging.Handler.__init__(self)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+
+class _ConsoleFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        if record.levelno >= logging.WARNING:
+            return f"{record.levelname.capitalize()}: {message}"
+        return message
+
+
+class _JsonLinesFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        # Fields passed with `extra`, e.g. the file and EXIF tag of a decoding warning
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES})
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _ListHandler(QueueHandler):
+    # Collects prepared (picklable) records in a list
+    def enqueue(self, record: logging.LogRecord) -> None:
+        self.queue.append(record)
+
+
+class _FileErrorHandler(logging.Handler):
+    # Keeps the warnings and errors that name a file (the 'file' field passed with `extra`) as rows
+    def __init__(self, fileErrors: list[dict]) -> None:
+        super().__init__(logging.WARNING)
+        self.fileErrors = fileErrors
+
+    def emit(self, record: logging.LogRecord) -> None:
+        filePath = getattr(record, "file", None)
+        if filePath is not None:
+            self.fileErrors.append({
+                "path": filePath,
+                "level": record.levelname,
+                "logger": record.name,
+                "tag": getattr(record, "tag", None),
+                "message": record.getMessage(),
+            })
+
+
+_packageLogger = logging.getLogger(ROOT_LOGGER_NAME)
+_packageLogger.propagate = False
+_packageLogger.setLevel(logging.INFO)
+
+_defaultHandler = _StdoutHandler()
+_defaultHandler.setFormatter(_ConsoleFormatter())
+_packageLogger.addHandler(_defaultHandler)
+
+_listener: QueueListener | None = None
+_errorHandler: MemoryHandler | None = None
+_progressStyle: str = "summary"
+
+
+def getLogger(name: str | None = None) -> logging.Logger:
+    """
+    Returns the package logger, or the child logger with the given name (e.g. the module name).
+    """
+    return _packageLogger if not name else _packageLogger.getChild(name)
+
+
+def configureLogging(level: int | str = logging.INFO, sourceFolder: str | None = None,
+                     progress: str = "auto", bufferSize: int = 1000) -> None:
+    """
+    Configures the logging of a run. Call `shutdownLogging` at the end of the run.
+
+    Args:
+        level (int | str): The lowest level that is written to the console, e.g. "DEBUG" to see every file.
+        sourceFolder (str | None): If provided, warnings and errors are also written as JSON lines
+                                   to .mediaMetaData.log.jsonl in this folder.
+        progress (str): "bar" for a progress bar on stderr, "summary" for a throughput line every
+                        few seconds, "off" for neither, or "auto" for a bar if stderr is a terminal.
+        bufferSize (int): The number of warnings and errors that are buffered before they are written.
+    """
+    global _listener, _errorHandler, _progressStyle
+    shutdownLogging()
+
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    _packageLogger.setLevel(min(level, logging.WARNING) if sourceFolder is not None else level)
+
+    if progress == "auto":
+        progress = "bar" if sys.stderr.isatty() else "summary"
+    _progressStyle = progress
+
+    consoleHandler = _StdoutHandler()
+    consoleHandler.setLevel(level)
+    consoleHandler.setFormatter(_ConsoleFormatter())
+    handlers: list[logging.Handler] = [consoleHandler]
+
+    if sourceFolder is not None:
+        logPath = os.path.join(sourceFolder, LOG_FILE_NAME)
+        # The file is only created once there is something to write, so remove the one of a previous run
+        if os.path.exists(logPath):
+            os.remove(logPath)
+        fileHandler = logging.FileHandler(logPath, mode="w", encoding="utf-8", delay=True)
+        fileHandler.setFormatter(_JsonLinesFormatter())
+        _errorHandler = MemoryHandler(bufferSize, flushLevel=logging.CRITICAL, target=fileHandler, flushOnClose=True)
+        _errorHandler.setLevel(logging.WARNING)
+        handlers.append(_errorHandler)
+
+    # Records are formatted and written by the listener's thread, not by the code that logs them
+    logQueue: queue.SimpleQueue = queue.SimpleQueue()
+    _listener = QueueListener(logQueue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _packageLogger.handlers = [QueueHandler(logQueue)]
+
+
+def shutdownLogging() -> str | None:
+    """
+    Writes the remaining messages, and restores the default logging to stdout.
+
+    Returns:
+        str | None: The path of the JSON lines file, if any warnings or errors were written to it.
+    """
+    global _listener, _errorHandler, _progressStyle
+    logPath: str | None = None
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _errorHandler is not None:
+        fileHandler = _errorHandler.target
+        _errorHandler.close()
+        fileHandler.close()
+        if os.path.exists(fileHandler.baseFilename):
+            logPath = fileHandler.baseFilename
+        _errorHandler = None
+
+    _packageLogger.handlers = [_defaultHandler]
+    _progressStyle = "summary"
+    return logPath
+
+
+atexit.register(shutdownLogging)
+
+
+@contextmanager
+def captureLogRecords():
+    """
+    Collects the records logged in the block instead of writing them, e.g. in a worker process
+    whose records are passed back to the main process with `replayLogRecords`.
+    """
+    records: list[logging.LogRecord] = []
+    previousHandlers = _packageLogger.handlers
+    _packageLogger.handlers = [_ListHandler(records)]
+    try:
+        yield records
+    finally:
+        _packageLogger.handlers = previousHandlers
+
+
+@contextmanager
+def collectFileErrors():
+    """
+    Collects the warnings and errors about single files that are logged in the block (including
+    records replayed from worker processes) as rows with the 'path', 'level', 'logger', 'tag' and
+    'message' of every record. The records are still written as usual. Warnings are collected
+    even if the console only shows errors.
+    """
+    fileErrors: list[dict] = []
+    fileErrorHandler = _FileErrorHandler(fileErrors)
+    # The logger lets warnings through (also to worker processes started in the block); the console
+    # handlers keep filtering them on their own level
+    previousLevel = _packageLogger.level
+    _packageLogger.setLevel(min(previousLevel, logging.WARNING))
+    _defaultHandler.setLevel(previousLevel)
+    _packageLogger.addHandler(fileErrorHandler)
+    try:
+        yield fileErrors
+    finally:
+        _packageLogger.removeHandler(fileErrorHandler)
+        _packageLogger.setLevel(previousLevel)
+        _defaultHandler.setLevel(logging.NOTSET)
+
+
+def replayLogRecords(records: list[logging.LogRecord]) -> None:
+    """
+    Writes records collected by `captureLogRecords` as if they were logged here.
+    """
+    for record in records:
+        logging.getLogger(record.name).handle(record)
+
+
+class ProgressReporter:
+    """
+    Reports the progress and throughput of a long stage, at most once per `interval` seconds,
+    and a summary when it is closed. `advance` is cheap enough to call for every file.
+
+    Args:
+        description (str): The name of the stage, e.g. "Extracting metadata".
+        unit (str): The unit of the items, e.g. "files".
+        total (int | None): The number of items, if known in advance.
+        interval (float | None): The time between two updates. Defaults to 0.2 seconds
+                                 for a progress bar and 10 seconds for summary lines.
+    """
+
+    def __init__(self, description: str, unit: str = "files", total: int | None = None, interval: float | None = None) -> None:
+        self.description = description
+        self.unit = unit
+        self.total = total
+        self.style = _progressStyle
+        self.interval = interval if interval is not None else (0.2 if self.style == "bar" else 10.0)
+        self.count = 0
+        self.startTime = time.monotonic()
+        self.nextUpdate = self.startTime + self.interval
+        self.logger = getLogger("progress")
+
+    def advance(self, amount: int = 1) -> None:
+        self.count += amount
+        if self.style != "off" and (now := time.monotonic()) >= self.nextUpdate:
+            self.nextUpdate = now + self.interval
+            self._update(now)
+
+    def _update(self, now: float) -> None:
+        rate = self.count / max(now - self.startTime, 1e-9)
+        if self.style == "bar":
+            if self.total:
+                fraction = min(self.count / self.total, 1.0)
+                bar = "#" * int(fraction * 30)
+                sys.stderr.write(f"\r{self.description}: [{bar:<30}] {fraction:4.0%} {self.count}/{self.total} {self.unit}, {rate:.1f} {self.unit}/s ")
+            else:
+                sys.stderr.write(f"\r{self.description}: {self.count} {self.unit}, {rate:.1f} {self.unit}/s ")
+            sys.stderr.flush()
+        else:
+            totalText = f"/{self.total}" if self.total else ""
+            self.logger.info("%s: %d%s %s, %.1f %s/s", self.description, self.count, totalText, self.unit, rate, self.unit)
+
+    def close(self) -> None:
+        seconds = time.monotonic() - self.startTime
+        if self.style == "bar" and seconds >= self.interval:
+            self._update(time.monotonic())
+            sys.stderr.write("\n")
+        rate = self.count / seconds if seconds > 0 else 0.0
+        self.logger.info("%s: %d %s in %.1f s (%.1f %s/s).", self.description, self.count, self.unit, seconds, rate, self.unit)
+
+    def __enter__(self) -> "ProgressReporter":
+        return self
+
+    def __exit__(self, *exceptionInfo) -> None:
+        self.close()
@@ -0,0 +1,266 @@
+import argparse
+import os
+import re
+import zlib
+
+import pandas as pd
+
+from extraction.metadata.cache import ExtractionCache
+from extraction.metadata.dictionaries import getDataDictionary, iterDataDictionaries
+from extraction.metadata.walker import IGNORED_DIRECTORIES, SUPPORTED_TYPES, scanMediaFiles, statEntry
+from renaming.renamer import planRenames, executeRenames
+from reporting.logger import configureLogging, getLogger, shutdownLogging
+from storage.formats import FILE_FORMATS, TABLE_FILE_NAME, readTable, writeTable
+from transformation.datetimeFilter import formatIndicated
+from transformation.transformation import transformData
+
+#### SHARDED PROCESSING ####
+"""
+This module spreads the processing of one or more media trees (e.g. several volumes) over
+independent runs, for example on different machines. The trees are split into units: the
+folders `splitDepth` levels below every root (with everything below them), and the files
+directly in the folders above. Every unit is assigned to a shard by the CRC-32 of its path
+relative to the parent of its root, so the assignment is deterministic and does not depend
+on where the volumes are mounted, or on the order of the roots. `processShard` extracts and
+transforms the units of one shard into a partial table in a shared output folder, with its
+own extraction cache. `mergeShards` combines the partial tables into the global metadata
+table: files that are in more than one partial table are kept once, and the '_N' counters
+of files with the same 'indicated' date/time are numbered across all shards
+('indicatedSuffix'), so renaming gives the same names as a single run over all roots.
+`renameShard` renames the files of one shard with these global counters.
+"""
+
+logger = getLogger(__name__)
+
+SHARD_TABLE_PATTERN = re.compile(re.escape(TABLE_FILE_NAME) + r"\.shard(\d+)of(\d+)$")
+
+
+def getShardTableName(shardIndex: int, shardCount: int) -> str:
+    """
+    Returns the table name of the partial table of a shard, e.g. '.mediaMetaData.shard002of008'.
+    """
+    return f"{TABLE_FILE_NAME}.shard{shardIndex:03d}of{shardCount:03d}"
+
+
+def _addUnits(folder: str, unitKey: str, depth: int, units: list[tuple[str, str, bool]]) -> None:
+    # Folders at the split depth are a unit with everything below them; folders above it only with their own files
+    units.append((unitKey, folder, depth == 0))
+    if depth == 0:
+        return
+    try:
+        with os.scandir(folder) as entries:
+            subFolders = sorted((entry for entry in entries
+                                 if entry.is_dir(follow_symlinks=False) and entry.name not in IGNORED_DIRECTORIES),
+                                key=lambda entry: entry.name)
+    except OSError:
+        return
+    for subFolder in subFolders:
+        _addUnits(subFolder.path, f"{unitKey}/{subFolder.name}", depth - 1, units)
+
+
+def listShardUnits(roots: list[str], splitDepth: int = 1) -> list[tuple[str, str, bool]]:
+    """
+    Splits the roots into the units that are assigned to shards.
+
+    Args:
+        roots (list[str]): The root folders, e.g. one per volume.
+        splitDepth (int): The folder level below the roots at which the trees are split.
+
+    Returns:
+        list[tuple[str, str, bool]]: Per unit: its key (the path relative to the parent of its
+                                     root, with '/' separators), its folder, and whether the
+                                     folders below it are part of the unit.
+    """
+    units: list[tuple[str, str, bool]] = []
+    for root in roots:
+        root = os.path.normpath(root)
+        _addUnits(root, os.path.basename(root), splitDepth, units)
+    return units
+
+
+def assignShard(unitKey: str, shardCount: int) -> int:
+    """
+    Returns the shard of a unit. The same key always gets the same shard.
+    """
+    return zlib.crc32(unitKey.encode("utf-8")) % shardCount
+
+
+def processShard(roots: list[str], shardIndex: int, shardCount: int, outputFolder: str,
+                 supportedTypes: list[tuple[str, ...]] = SUPPORTED_TYPES, splitDepth: int = 1, workers: int = 1,
+                 fileFormat: str = "csv", exifTags: list[str] | None = None) -> str:
+    """
+    Extracts and transforms the metadata of the units of one shard into a partial table.
+
+    Args:
+        roots (list[str]): The root folders; every shard must be given the same roots.
+        shardIndex (int): The shard to process, from 0 to `shardCount` - 1.
+        shardCount (int): The number of shards.
+        outputFolder (str): The shared folder of the partial tables and the global table.
+        supportedTypes (list[tuple]): A list where each tuple contains file extensions
+                                       for a specific media type (e.g., image, video).
+        splitDepth (int): The folder level below the roots at which the trees are split.
+        workers (int): The number of concurrent workers.
+        fileFormat (str): The file format of the partial table: "csv", "parquet" or "feather".
+        exifTags (list[str] | None): If provided, only these EXIF tags are extracted.
+
+    Returns:
+        str: The path of the partial table.
+    """
+    if not 0 <= shardIndex < shardCount:
+        raise ValueError(f"Shard index {shardIndex} is not between 0 and {shardCount - 1}.")
+
+    units = [unit for unit in listShardUnits(roots, splitDepth) if assignShard(unit[0], shardCount) == shardIndex]
+    logger.info("Shard %d of %d: %d units.", shardIndex, shardCount, len(units))
+
+    # Every shard has its own cache, so shards running at the same time do not share a SQLite file
+    shardTableName = getShardTableName(shardIndex, shardCount)
+    cache = ExtractionCache(outputFolder, cacheFileName=f"{shardTableName}.cache.sqlite")
+    exifTags = frozenset(exifTags) if exifTags is not None else None
+    records: list[dict] = []
+    try:
+        for _, folder, recursive in units:
+            if recursive:
+                records.extend(iterDataDictionaries(folder, supportedTypes, workers, cache, exifTags=exifTags))
+                continue
+            for root, fileEntries, _ in scanMediaFiles(folder, supportedTypes[0] + supportedTypes[1], recursive=False):
+                records.extend(getDataDictionary(root, fileEntry.name, supportedTypes, cache, statEntry(fileEntry), exifTags=exifTags)
+                               for fileEntry in fileEntries)
+    finally:
+        cache.close()
+
+    # An empty partial table is still written, so the merge knows the shard is done
+    df = transformData(outputFolder, df=pd.DataFrame(records), saveFile=False, compactExif=False) if records else None
+    if df is None:
+        df = pd.DataFrame(index=pd.Index([], name="path", dtype="string"))
+    df["shard"] = shardIndex
+
+    return writeTable(df, outputFolder, fileFormat, shardTableName)
+
+
+def _findShardTables(outputFolder: str, fileFormat: str) -> tuple[list[str], int]:
+    extension = FILE_FORMATS[fileFormat]
+    shardTables: dict[int, str] = {}
+    shardCounts: set[int] = set()
+
+    for fileName in os.listdir(outputFolder):
+        if not fileName.endswith(extension):
+            continue
+        match = SHARD_TABLE_PATTERN.fullmatch(fileName[:-len(extension)])
+        if match is not None:
+            shardTables[int(match.group(1))] = fileName[:-len(extension)]
+            shardCounts.add(int(match.group(2)))
+
+    if not shardTables:
+        raise FileNotFoundError(f"No partial tables found in '{outputFolder}'.")
+    if len(shardCounts) > 1:
+        raise ValueError(f"The partial tables in '{outputFolder}' were made with different shard counts: {sorted(shardCounts)}.")
+
+    shardCount = shardCounts.pop()
+    missingShards = sorted(set(range(shardCount)) - shardTables.keys())
+    if missingShards:
+        logger.warning("The partial tables of shards %s are missing. Their files are not in the merged table.", missingShards)
+    return [shardTables[shardIndex] for shardIndex in sorted(shardTables)], shardCount
+
+
+def mergeShards(outputFolder: str, fileFormat: str = "csv", saveFile: bool = True) -> pd.DataFrame:
+    """
+    Merges the partial tables of all shards into the global metadata table.
+
+    Args:
+        outputFolder (str): The folder of the partial tables.
+        fileFormat (str): The file format of the partial tables and the global table.
+        saveFile (bool): If True, saves the global table to the metadata file in the output folder.
+
+    Returns:
+        pd.DataFrame: The global metadata table, indexed by path, with the 'shard' and
+                      'indicatedSuffix' columns.
+    """
+    shardTableNames, shardCount = _findShardTables(outputFolder, fileFormat)
+    df = pd.concat([readTable(outputFolder, fileFormat, shardTableName) for shardTableName in shardTableNames])
+
+    # A file can be in two partial tables if the roots overlap; the row that was modified last is kept
+    if df.index.has_duplicates:
+        duplicateCount = df.index.duplicated().sum()
+        df = df.sort_values(by="modified", kind="stable", na_position="first")
+        df = df[~df.index.duplicated(keep="last")]
+        logger.info("Dropped %d rows of files that were in more than one partial table.", duplicateCount)
+
+    if df.empty or "indicated" not in df.columns:
+        # Shards without media files write empty partial tables; the global table is empty then too
+        df["indicatedSuffix"] = pd.Series(pd.NA, index=df.index, dtype="Int64")
+    else:
+        # Sort on the path first, as transformData does, so files with the same 'indicated' value are in the same order whatever the shards
+        df = df.sort_index(kind="stable").sort_values(by="indicated", ascending=False, kind="stable")
+
+        # Number the files with the same rendered 'indicated' value across all shards, as planRenames would in a single run
+        indicatedNames = formatIndicated(df["indicated"], df.get("indicatedDateOnly"))
+        hasDate = indicatedNames.notna()
+        df["indicatedSuffix"] = indicatedNames[hasDate].groupby(indicatedNames[hasDate], sort=False).cumcount().reindex(df.index).astype("Int64")
+
+    logger.info("Merged %d partial tables of %d shards into %d rows.", len(shardTableNames), shardCount, len(df))
+    if saveFile:
+        writeTable(df, outputFolder, fileFormat)
+    return df
+
+
+def renameShard(outputFolder: str, shardIndex: int | None = None, fileFormat: str = "csv", dryRun: bool = False, workers: int = 8) -> dict[str, int]:
+    """
+    Renames the files of one shard (or of all shards) with the counters of the global table.
+
+    Args:
+        outputFolder (str): The folder of the global table made by `mergeShards`.
+        shardIndex (int | None): The shard whose files are renamed. If None, all files are renamed.
+        fileFormat (str): The file format of the global table.
+        dryRun (bool): If True, logs the planned renames without moving anything.
+        workers (int): The maximum number of threads that move files.
+
+    Returns:
+        dict[str, int]: The number of rows per status, and the number of renamed and failed files.
+    """
+    df = readTable(outputFolder, fileFormat)
+    if shardIndex is not None:
+        df = df[df["shard"] == shardIndex]
+    # The global table of roots without media files is empty, and may not have the columns of the names
+    if df.empty:
+        logger.info("No files to rename.")
+        return {"renamed": 0, "failed": 0}
+
+    journalName = f".mediaRename.shard{shardIndex:03d}.journal.jsonl" if shardIndex is not None else ".mediaRename.journal.jsonl"
+    plan = planRenames(df.reset_index())
+    return executeRenames(plan, journalPath=os.path.join(outputFolder, journalName), workers=workers, dryRun=dryRun)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process media trees in shards and merge the results into one table.")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="the lowest level of the messages shown")
+    parser.add_argument("--format", default="csv", choices=list(FILE_FORMATS), help="the format of the partial and global tables")
+    subParsers = parser.add_subparsers(dest="command", required=True)
+
+    processParser = subParsers.add_parser("process", help="extract and transform the files of one shard")
+    processParser.add_argument("roots", nargs="+", help="the root folders, the same for every shard")
+    processParser.add_argument("--output", required=True, help="the shared folder of the partial tables")
+    processParser.add_argument("--shard-index", type=int, required=True, help="the shard to process, from 0")
+    processParser.add_argument("--shard-count", type=int, required=True, help="the number of shards")
+    processParser.add_argument("--split-depth", type=int, default=1, help="the folder level below the roots at which the trees are split")
+    processParser.add_argument("--workers", type=int, default=1, help="the number of concurrent workers")
+
+    mergeParser = subParsers.add_parser("merge", help="merge the partial tables into the global table")
+    mergeParser.add_argument("--output", required=True, help="the shared folder of the partial tables")
+
+    renameParser = subParsers.add_parser("rename", help="rename the files of a shard with the global counters")
+    renameParser.add_argument("--output", required=True, help="the folder of the global table")
+    renameParser.add_argument("--shard-index", type=int, help="the shard whose files are renamed; all files if not given")
+    renameParser.add_argument("--dry-run", action="store_true", help="only show the planned renames")
+    arguments = parser.parse_args()
+
+    configureLogging(arguments.log_level, sourceFolder=arguments.output)
+    try:
+        if arguments.command == "process":
+            processShard(arguments.roots, arguments.shard_index, arguments.shard_count, arguments.output,
+                         splitDepth=arguments.split_depth, workers=arguments.workers, fileFormat=arguments.format)
+        elif arguments.command == "merge":
+            mergeShards(arguments.output, fileFormat=arguments.format)
+        else:
+            renameShard(arguments.output, arguments.shard_index, fileFormat=arguments.format, dryRun=arguments.dry_run)
+    finally:
+        shutdownLogging()
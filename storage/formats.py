@@ -0,0 +1,272 @@
+import os
+
+import pandas as pd
+
+from profiling.profiler import profiled
+
+#### METADATA TABLE FORMATS ####
+"""
+This module reads and writes the metadata table in one of the supported file formats:
+semicolon-separated CSV (the default), Parquet, or Feather. Parquet and Feather require
+the optional `pyarrow` package. The fixed columns from `getRegularData` (and the date/time
+columns added by `transformData`) get an explicit schema, so their types do not depend on
+type inference when the table is read back. The sparse EXIF tag columns are stored as nullable
+strings in the columnar formats, which are dictionary-encoded with a null bitmap, so mostly
+empty columns take little space. Tables can be written at once, or chunk by chunk with
+`openTableWriter` (CSV appends, Parquet row groups, Feather record batches).
+In memory, `compactExifColumns` stores text EXIF tags with few distinct values (e.g. 'Make',
+'Model') as categoricals, and `splitRareExifColumns` moves tags that only a few files have
+into a long (path, tag, value) side table, which is stored next to the metadata table.
+"""
+
+TABLE_FILE_NAME = ".mediaMetaData"
+RARE_TAGS_FILE_NAME = ".mediaMetaData.rareTags"
+FILE_ERRORS_FILE_NAME = ".mediaMetaData.errors"
+FILE_FORMATS: dict[str, str] = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+
+# The explicit schema of the fixed columns
+REGULAR_SCHEMA: dict[str, str] = {
+    "path": "string",
+    "file": "string",
+    "folder": "string",
+    "type": "string",
+    "fileSize": "int64",
+    "creation": "datetime64[ns]",
+    "modified": "datetime64[ns]",
+    "recorded": "datetime64[ns]",
+    "recordedDateOnly": "boolean",
+    "filtered": "datetime64[ns]",
+    "indicated": "datetime64[ns]",
+    "indicatedDateOnly": "boolean",
+    "contentHash": "string",
+    "duplicateOf": "string",
+    "perceptualHash": "string",
+    "similarTo": "string",
+    "shard": "Int64",
+    "indicatedSuffix": "Int64",
+}
+
+
+def _importPyArrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.feather
+        import pyarrow.ipc
+    except ImportError as e:
+        raise ImportError("The Parquet and Feather formats require the 'pyarrow' package. Install it with 'pip install pyarrow'.") from e
+    return pyarrow
+
+
+def getTablePath(sourceFolder: str, fileFormat: str = "csv", tableName: str = TABLE_FILE_NAME) -> str:
+    """
+    Returns the path of the metadata table (or of another table, such as the rare EXIF tags)
+    in the given format inside the source folder.
+    """
+    if fileFormat not in FILE_FORMATS:
+        raise ValueError(f"Unsupported file format '{fileFormat}'. Supported formats: {', '.join(FILE_FORMATS)}.")
+    return os.path.join(sourceFolder, tableName + FILE_FORMATS[fileFormat])
+
+
+def applySchema(df: pd.DataFrame, columnarFormat: bool = False, exifAsString: bool = False) -> pd.DataFrame:
+    """
+    Casts the fixed columns of a metadata table to the types of REGULAR_SCHEMA. For columnar
+    formats, EXIF columns that are not numeric or datetime are cast to nullable strings, since
+    they may contain mixed Python objects (e.g. tuples) that have no columnar representation.
+
+    Args:
+        df (pd.DataFrame): The metadata table.
+        columnarFormat (bool): If True, also casts the EXIF columns for Parquet or Feather.
+        exifAsString (bool): If True, casts all EXIF columns to nullable strings, so chunks
+                             written separately always have the same schema.
+
+    Returns:
+        pd.DataFrame: The metadata table with the schema applied.
+    """
+    df = df.copy()
+    for columnName in df.columns:
+        if columnName in REGULAR_SCHEMA:
+            dtype = REGULAR_SCHEMA[columnName]
+            if dtype.startswith("datetime64"):
+                df[columnName] = pd.to_datetime(df[columnName], errors="coerce").astype(dtype)
+            else:
+                df[columnName] = df[columnName].astype(dtype)
+        elif isinstance(df[columnName].dtype, pd.CategoricalDtype):
+            # Categoricals of text are stored as dictionaries by the columnar formats as they are
+            if exifAsString:
+                df[columnName] = df[columnName].astype("string")
+        elif exifAsString or (columnarFormat and not (pd.api.types.is_numeric_dtype(df[columnName])
+                                                      or pd.api.types.is_datetime64_any_dtype(df[columnName]))):
+            df[columnName] = df[columnName].where(df[columnName].isna(), df[columnName].astype(str)).astype("string")
+    return df
+
+
+def compactExifColumns(df: pd.DataFrame, maxUniqueRatio: float = 0.5) -> pd.DataFrame:
+    """
+    Converts the EXIF columns that only contain text, and have few distinct values compared to
+    the number of files that have them (e.g. 'Make', 'Model', 'Software'), to categoricals.
+    Every cell then takes one or two bytes instead of a reference to a string, empty cells included.
+
+    Args:
+        df (pd.DataFrame): The metadata table.
+        maxUniqueRatio (float): The maximum number of distinct values per non-empty cell.
+
+    Returns:
+        pd.DataFrame: The metadata table with the compact EXIF columns.
+    """
+    exifColumns = df.columns.difference(list(REGULAR_SCHEMA), sort=False)
+    for columnName in df[exifColumns].select_dtypes(include=["object", "string"]).columns:
+        values = df[columnName]
+        nonEmptyCount = values.notna().sum()
+        if nonEmptyCount == 0 or pd.api.types.infer_dtype(values, skipna=True) != "string":
+            continue
+        if values.nunique() <= max(1, maxUniqueRatio * nonEmptyCount):
+            df[columnName] = values.astype("category")
+    return df
+
+
+def splitRareExifColumns(df: pd.DataFrame, maxDensity: float, keptColumns: list[str] | None = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Moves the EXIF columns that at most a fraction `maxDensity` of the files have into a long
+    side table with one row per value, so they do not take a mostly empty column each.
+
+    Args:
+        df (pd.DataFrame): The metadata table, indexed by path.
+        maxDensity (float): The maximum fraction of non-empty cells of a rare column.
+        keptColumns (list[str] | None): EXIF columns that are never moved.
+
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame]: The metadata table without the rare columns, and
+                                           the side table with 'path', 'tag' and 'value' columns
+                                           (the values as text).
+    """
+    exifColumns = df.columns.difference(list(REGULAR_SCHEMA) + (keptColumns or []), sort=False)
+    density = df[exifColumns].notna().mean() if len(df) else pd.Series(dtype=float)
+    rareColumns = list(density.index[density <= maxDensity])
+
+    # Only the values that exist are kept
+    rareValues = df[rareColumns].astype(object).stack().dropna()
+    rareTags = pd.DataFrame({
+        "path": rareValues.index.get_level_values(0).astype(str),
+        "tag": rareValues.index.get_level_values(1).astype(str),
+        "value": rareValues.astype(str).to_numpy(),
+    })
+    return df.drop(columns=rareColumns), rareTags
+
+
+@profiled("tableRead")
+def readTable(sourceFolder: str, fileFormat: str = "csv", tableName: str = TABLE_FILE_NAME) -> pd.DataFrame:
+    """
+    Reads the metadata table from the source folder.
+
+    Args:
+        sourceFolder (str): The path to the folder containing the metadata table.
+        fileFormat (str): The file format: "csv", "parquet" or "feather".
+        tableName (str): The name of the table, e.g. RARE_TAGS_FILE_NAME for the rare EXIF tags.
+
+    Returns:
+        pd.DataFrame: The metadata table.
+    """
+    tablePath = getTablePath(sourceFolder, fileFormat, tableName)
+
+    if fileFormat == "csv":
+        # The first column is always the index from a previous save. The string columns are read
+        # as strings, so e.g. a folder named "2019" is not inferred as a number.
+        stringColumns = {columnName: dtype for columnName, dtype in REGULAR_SCHEMA.items() if dtype == "string"}
+        return applySchema(pd.read_csv(tablePath, sep=";", index_col=0, dtype=stringColumns))
+
+    _importPyArrow()
+    if fileFormat == "parquet":
+        return pd.read_parquet(tablePath)
+    return pd.read_feather(tablePath)
+
+
+@profiled("tableWrite")
+def writeTable(df: pd.DataFrame, sourceFolder: str, fileFormat: str = "csv", tableName: str = TABLE_FILE_NAME) -> str:
+    """
+    Writes the metadata table, including its index, to the source folder.
+
+    Args:
+        df (pd.DataFrame): The metadata table.
+        sourceFolder (str): The path to the folder to write the metadata table to.
+        fileFormat (str): The file format: "csv", "parquet" or "feather".
+        tableName (str): The name of the table, e.g. RARE_TAGS_FILE_NAME for the rare EXIF tags.
+
+    Returns:
+        str: The path of the written file.
+    """
+    tablePath = getTablePath(sourceFolder, fileFormat, tableName)
+
+    if fileFormat == "csv":
+        df.to_csv(tablePath, sep=";", index=True)
+        return tablePath
+
+    pyarrow = _importPyArrow()
+    table = pyarrow.Table.from_pandas(applySchema(df, columnarFormat=True), preserve_index=True)
+    if fileFormat == "parquet":
+        pyarrow.parquet.write_table(table, tablePath)
+    else:
+        # The index is kept in the pandas metadata, which DataFrame.to_feather does not allow
+        pyarrow.feather.write_feather(table, tablePath)
+    return tablePath
+
+
+class _CsvTableWriter:
+    def __init__(self, tablePath: str, columns: list[str]) -> None:
+        self.tablePath = tablePath
+        self.columns = columns
+        pd.DataFrame(columns=columns).to_csv(tablePath, sep=";")
+
+    def writeChunk(self, chunkFrame: pd.DataFrame) -> None:
+        chunkFrame.to_csv(self.tablePath, sep=";", mode="a", header=False)
+
+    def close(self) -> None:
+        pass
+
+
+class _ArrowTableWriter:
+    def __init__(self, tablePath: str, fileFormat: str, columns: list[str]) -> None:
+        self.pyarrow = _importPyArrow()
+        self.tablePath = tablePath
+        self.fileFormat = fileFormat
+        self.columns = columns
+        self.schema = None
+        self.writer = None
+
+    def writeChunk(self, chunkFrame: pd.DataFrame) -> None:
+        chunkFrame = applySchema(chunkFrame, columnarFormat=True, exifAsString=True)
+
+        # The schema of the first chunk is used for all chunks, so every row group has the same types
+        if self.schema is None:
+            self.schema = self.pyarrow.Table.from_pandas(chunkFrame, preserve_index=False).schema
+            if self.fileFormat == "parquet":
+                self.writer = self.pyarrow.parquet.ParquetWriter(self.tablePath, self.schema)
+            else:
+                self.writer = self.pyarrow.ipc.new_file(self.tablePath, self.schema,
+                                                        options=self.pyarrow.ipc.IpcWriteOptions(compression="lz4"))
+
+        table = self.pyarrow.Table.from_pandas(chunkFrame, schema=self.schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def close(self) -> None:
+        if self.writer is None:
+            # Write an empty table if no chunks were written
+            self.writeChunk(pd.DataFrame(columns=self.columns))
+        self.writer.close()
+
+
+def openTableWriter(sourceFolder: str, fileFormat: str, columns: list[str]):
+    """
+    Opens a writer that writes the metadata table chunk by chunk. Every chunk must have
+    the given columns; `writeChunk` appends a chunk and `close` finishes the file.
+
+    Args:
+        sourceFolder (str): The path to the folder to write the metadata table to.
+        fileFormat (str): The file format: "csv", "parquet" or "feather".
+        columns (list[str]): The columns of the metadata table.
+    """
+    tablePath = getTablePath(sourceFolder, fileFormat)
+
+    if fileFormat == "csv":
+        return _CsvTableWriter(tablePath, columns)
+    return _ArrowTableWriter(tablePath, fileFormat, columns)
@@ -0,0 +1,284 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import TYPE_CHECKING
+
+from reporting.logger import getLogger
+
+# pandas is only needed to update the index, so queries from the command line start quickly
+if TYPE_CHECKING:
+    import pandas as pd
+
+#### METADATA INDEX ####
+"""
+This module keeps a queryable index of the transformed metadata table in a SQLite file next
+to it, so questions such as "all photos from camera X in 2019 under folder Y" are answered
+with indexed lookups instead of loading the whole table into pandas. Every file is one row,
+with the columns that are searched on ('indicated', 'type', 'folder', 'Make', 'Model') indexed,
+and the remaining EXIF tags stored as JSON. The index is updated incrementally: every row
+carries a hash of its values, and only rows whose hash changed are written; rows of files
+that are no longer in the table are removed. Queries go through `MetadataIndex.query`, or
+the command line:
+
+    python -m storage.index SOURCE --update
+    python -m storage.index SOURCE --make Canon --year 2019 --under SOURCE/Holiday
+"""
+
+logger = getLogger(__name__)
+
+INDEX_FILE_NAME = ".mediaMetaData.index.sqlite"
+
+# Increase when the layout of the index changes, so stale indexes are rebuilt
+SCHEMA_VERSION = 1
+
+# The columns of the metadata table that get their own column in the index, and their SQLite types
+INDEXED_COLUMNS: dict[str, str] = {
+    "file": "TEXT",
+    "folder": "TEXT",
+    "type": "TEXT",
+    "fileSize": "INTEGER",
+    "modified": "TEXT",
+    "indicated": "TEXT",
+    "Make": "TEXT",
+    "Model": "TEXT",
+    "contentHash": "TEXT",
+    "duplicateOf": "TEXT",
+}
+
+# Folders with fewer files than this are searched through the paths, before the other conditions
+UNDER_PROBE_LIMIT = 20000
+
+# Date/times are stored as ISO text, which sorts and compares like the date/times themselves
+DATE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class MetadataIndex:
+    def __init__(self, sourceFolder: str, indexFileName: str = INDEX_FILE_NAME) -> None:
+        self.indexPath = os.path.join(sourceFolder, indexFileName)
+        self.connection = sqlite3.connect(self.indexPath)
+        self.connection.row_factory = sqlite3.Row
+
+        # Rebuild indexes that were written with a different layout
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS media")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+        columnDefinitions = ", ".join(f'"{columnName}" {sqlType}' for columnName, sqlType in INDEXED_COLUMNS.items())
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS media (path TEXT PRIMARY KEY, {columnDefinitions}, exifData TEXT, rowHash INTEGER NOT NULL)"
+        )
+        self._createIndexes()
+
+    def _createIndexes(self) -> None:
+        # 'indicated' is the last column of the other indexes, so their results come sorted by date
+        self.connection.execute("CREATE INDEX IF NOT EXISTS mediaIndicated ON media (indicated)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS mediaType ON media (type, indicated)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS mediaFolder ON media (folder, indicated)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS mediaMakeModel ON media (Make COLLATE NOCASE, Model COLLATE NOCASE, indicated)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS mediaModel ON media (Model COLLATE NOCASE, indicated)")
+
+    def _dropIndexes(self) -> None:
+        for indexName in ("mediaIndicated", "mediaType", "mediaFolder", "mediaMakeModel", "mediaModel"):
+            self.connection.execute(f"DROP INDEX IF EXISTS {indexName}")
+
+    def update(self, df: "pd.DataFrame", removeMissing: bool = True) -> dict[str, int]:
+        """
+        Brings the index up to date with a transformed metadata table. Only the rows that were
+        added or changed since the previous update are written.
+
+        Args:
+            df (pd.DataFrame): The transformed metadata table, indexed by path.
+            removeMissing (bool): If True, removes the rows of files that are not in the table,
+                                  e.g. files that were deleted or renamed. Pass False to add a
+                                  part of the library, such as one shard.
+
+        Returns:
+            dict[str, int]: The number of added, changed, unchanged and removed rows.
+        """
+        import pandas as pd
+
+        # The values of the indexed columns as SQLite values, and all other non-empty values as JSON
+        # Plain object indexes; lookups in Arrow-backed string indexes are many times slower
+        indexFrame = pd.DataFrame(index=pd.Index(df.index.astype(str).to_numpy(dtype=object), dtype=object))
+        for columnName in INDEXED_COLUMNS:
+            if columnName not in df.columns:
+                indexFrame[columnName] = None
+            elif pd.api.types.is_datetime64_any_dtype(df[columnName]):
+                indexFrame[columnName] = df[columnName].dt.strftime(DATE_TIME_FORMAT).to_numpy(dtype=object)
+            else:
+                indexFrame[columnName] = df[columnName].to_numpy(dtype=object)
+        indexFrame = indexFrame.astype(object).where(indexFrame.notna(), None)
+        exifColumns = df.columns.difference(list(INDEXED_COLUMNS), sort=False)
+
+        # Only the rows whose hash differs from the stored one are written
+        rowHashes = pd.util.hash_pandas_object(pd.concat([indexFrame, df[exifColumns].set_axis(indexFrame.index)], axis=1), index=True)
+        rowHashes = pd.Series(rowHashes.to_numpy().view("int64"), index=indexFrame.index)
+        storedHashes = pd.DataFrame(self.connection.execute("SELECT path, rowHash FROM media").fetchall(), columns=["path", "rowHash"])
+        storedHashes = pd.Series(storedHashes["rowHash"].to_numpy(dtype="int64"),
+                                 index=pd.Index(storedHashes["path"].to_numpy(dtype=object), dtype=object))
+        storedRowHashes = storedHashes.reindex(rowHashes.index)
+        isNew = storedRowHashes.isna().to_numpy()
+        isChanged = (rowHashes != storedRowHashes).to_numpy()
+
+        rows = []
+        exifFrame = df.loc[isChanged, exifColumns].astype(object)
+        for path, indexValues, exifValues, rowHash in zip(indexFrame.index[isChanged], indexFrame[isChanged].itertuples(index=False),
+                                                           exifFrame.to_dict("records"), rowHashes[isChanged].tolist()):
+            # Tuples and other sequences are values too; only empty scalars are left out
+            exifData = {tag: value for tag, value in exifValues.items() if not pd.api.types.is_scalar(value) or not pd.isna(value)}
+            rows.append((path, *indexValues, json.dumps(exifData, default=str) if exifData else None, rowHash))
+
+        # Rows in path order are appended to the primary key; after large changes, the other indexes are rebuilt at once
+        rows.sort(key=lambda row: row[0])
+        rebuildIndexes = len(rows) > max(10000, len(storedHashes) // 2)
+        columnNames = ", ".join(f'"{columnName}"' for columnName in ["path", *INDEXED_COLUMNS, "exifData", "rowHash"])
+        with self.connection:
+            if rebuildIndexes:
+                self._dropIndexes()
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO media ({columnNames}) VALUES ({', '.join('?' * (len(INDEXED_COLUMNS) + 3))})", rows
+            )
+            removedCount = 0
+            if removeMissing:
+                missingPaths = storedHashes.index[rowHashes.reindex(storedHashes.index).isna().to_numpy()]
+                self.connection.executemany("DELETE FROM media WHERE path = ?", ((path,) for path in missingPaths))
+                removedCount = len(missingPaths)
+            if rebuildIndexes:
+                self._createIndexes()
+        # The statistics let SQLite choose between e.g. the camera and the folder index of a query
+        self.connection.execute("ANALYZE" if rebuildIndexes else "PRAGMA optimize")
+
+        addedCount = int(isNew.sum())
+        counts = {"added": addedCount, "changed": len(rows) - addedCount,
+                  "unchanged": len(rowHashes) - len(rows), "removed": removedCount}
+        logger.info("Metadata index: %d added, %d changed, %d unchanged, %d removed.",
+                    counts["added"], counts["changed"], counts["unchanged"], counts["removed"])
+        return counts
+
+    def query(self, make: str | None = None, model: str | None = None, fileType: str | None = None,
+              folder: str | None = None, under: str | None = None, year: int | None = None,
+              since: str | None = None, until: str | None = None, limit: int | None = None) -> list[dict]:
+        """
+        Returns the files that match all given conditions, the most recent first.
+
+        Args:
+            make (str | None): The camera make ('Make' tag), ignoring case.
+            model (str | None): The camera model ('Model' tag), ignoring case.
+            fileType (str | None): The file extension, e.g. ".jpg".
+            folder (str | None): The name of the folder that directly contains the files.
+            under (str | None): A folder path; only files anywhere below it match.
+            year (int | None): The year of the 'indicated' date/time.
+            since (str | None): The earliest 'indicated' date/time, e.g. "2019-06-01".
+            until (str | None): The 'indicated' date/time before which files match, e.g. "2019-07-01".
+            limit (int | None): The maximum number of files returned.
+
+        Returns:
+            list[dict]: Per file, its path, the indexed columns and its other EXIF tags ('exifData').
+        """
+        conditions: list[str] = []
+        parameters: list = []
+        columnPrefix = ""
+        if under is not None:
+            # A range on the primary key, which matches the paths that start with the folder
+            folderPrefix = os.path.join(os.path.normpath(under), "")
+            conditions.append("path >= ? AND path < ?")
+            parameters += [folderPrefix, folderPrefix[:-1] + chr(ord(folderPrefix[-1]) + 1)]
+            # SQLite cannot estimate the size of the range, so it is counted (up to a limit); for a small
+            # folder, '+' keeps SQLite from using the index of another condition instead
+            probeCount = self.connection.execute(
+                "SELECT COUNT(*) FROM (SELECT 1 FROM media WHERE path >= ? AND path < ? LIMIT ?)", (*parameters, UNDER_PROBE_LIMIT)
+            ).fetchone()[0]
+            if probeCount < UNDER_PROBE_LIMIT:
+                columnPrefix = "+"
+        if make is not None:
+            conditions.append(f"{columnPrefix}Make = ? COLLATE NOCASE")
+            parameters.append(make)
+        if model is not None:
+            conditions.append(f"{columnPrefix}Model = ? COLLATE NOCASE")
+            parameters.append(model)
+        if fileType is not None:
+            conditions.append(f"{columnPrefix}type = ?")
+            parameters.append(fileType.lower() if fileType.startswith(".") else "." + fileType.lower())
+        if folder is not None:
+            conditions.append(f"{columnPrefix}folder = ?")
+            parameters.append(folder)
+        if year is not None:
+            since = max(since or "", f"{year:04d}-01-01")
+            until = min(until or "9999", f"{year + 1:04d}-01-01")
+        if since is not None:
+            conditions.append(f"{columnPrefix}indicated >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append(f"{columnPrefix}indicated < ?")
+            parameters.append(until)
+
+        statement = "SELECT * FROM media"
+        if conditions:
+            statement += " WHERE " + " AND ".join(conditions)
+        statement += " ORDER BY indicated DESC, path"
+        if limit is not None:
+            statement += " LIMIT ?"
+            parameters.append(limit)
+
+        results: list[dict] = []
+        for row in self.connection.execute(statement, parameters):
+            result = dict(row)
+            del result["rowHash"]
+            result["exifData"] = json.loads(result["exifData"]) if result["exifData"] is not None else {}
+            results.append(result)
+        return results
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def updateIndex(df: "pd.DataFrame", sourceFolder: str, removeMissing: bool = True) -> dict[str, int]:
+    """
+    Updates the metadata index in the source folder with a transformed metadata table.
+    """
+    metadataIndex = MetadataIndex(sourceFolder)
+    try:
+        return metadataIndex.update(df, removeMissing)
+    finally:
+        metadataIndex.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the metadata index of a media folder.")
+    parser.add_argument("sourceFolder", help="the folder with the metadata table and index")
+    parser.add_argument("--update", action="store_true", help="update the index from the metadata table first")
+    parser.add_argument("--format", default="csv", choices=["csv", "parquet", "feather"], help="the format of the metadata table")
+    parser.add_argument("--make", help="the camera make, ignoring case")
+    parser.add_argument("--model", help="the camera model, ignoring case")
+    parser.add_argument("--type", dest="fileType", help="the file extension, e.g. .jpg")
+    parser.add_argument("--folder", help="the name of the folder that directly contains the files")
+    parser.add_argument("--under", help="a folder path; only files below it are returned")
+    parser.add_argument("--year", type=int, help="the year of the indicated date/time")
+    parser.add_argument("--since", help="the earliest indicated date/time, e.g. 2019-06-01")
+    parser.add_argument("--until", help="the indicated date/time before which files are returned")
+    parser.add_argument("--limit", type=int, help="the maximum number of files returned")
+    parser.add_argument("--json", action="store_true", help="print the full rows as JSON lines instead of the paths")
+    arguments = parser.parse_args()
+
+    metadataIndex = MetadataIndex(arguments.sourceFolder)
+    try:
+        if arguments.update:
+            from storage.formats import readTable
+            from reporting.logger import configureLogging
+            configureLogging("INFO")
+            metadataIndex.update(readTable(arguments.sourceFolder, arguments.format))
+
+        startTime = time.perf_counter()
+        results = metadataIndex.query(make=arguments.make, model=arguments.model, fileType=arguments.fileType,
+                                      folder=arguments.folder, under=arguments.under, year=arguments.year,
+                                      since=arguments.since, until=arguments.until, limit=arguments.limit)
+        seconds = time.perf_counter() - startTime
+    finally:
+        metadataIndex.close()
+
+    for result in results:
+        print(json.dumps(result, default=str) if arguments.json else result["path"])
+    print(f"{len(results)} files found in {seconds * 1000:.1f} ms.", file=sys.stderr)
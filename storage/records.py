@@ -0,0 +1,71 @@
+import base64
+import json
+import numbers
+from datetime import datetime
+
+#### RECORD SERIALIZATION ####
+"""
+This module turns metadata records (the dictionaries of `getDataDictionary`, or the EXIF part
+of them) into JSON and back, for the sidecar files in the source folder: the extraction cache
+and the checkpoint of an extraction. Unlike pickle, reading such a file cannot run code, which
+matters because the source folder is often a shared network drive. JSON has no datetimes,
+tuples, bytes or non-string keys, so these are encoded explicitly as single-key objects
+('$datetime', '$tuple', '$bytes', '$dict'). Other rational numbers (e.g. an IFDRational inside
+a tuple) become floats, as the rationals of single tags already are.
+"""
+
+
+def _encodeValue(value):
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, tuple):
+        return {"$tuple": [_encodeValue(item) for item in value]}
+    if isinstance(value, list):
+        return [_encodeValue(item) for item in value]
+    if isinstance(value, (bytes, bytearray)):
+        return {"$bytes": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, dict):
+        return encodeRecord(value)
+    if isinstance(value, numbers.Real):
+        return float(value)
+    raise TypeError(f"Values of type {type(value).__name__} cannot be stored in a metadata record.")
+
+
+def encodeRecord(record: dict) -> dict:
+    """
+    Returns a JSON-serializable form of a record. Records with keys other than strings (e.g. the
+    ids of unnamed EXIF tags) are stored as a list of key-value pairs, which keeps the keys' types.
+    """
+    if all(isinstance(key, str) for key in record):
+        return {key: _encodeValue(value) for key, value in record.items()}
+    return {"$dict": [[key, _encodeValue(value)] for key, value in record.items()]}
+
+
+def _decodeObject(encodedObject: dict):
+    if len(encodedObject) == 1:
+        (key, value), = encodedObject.items()
+        if key == "$datetime":
+            return datetime.fromisoformat(value)
+        if key == "$tuple":
+            return tuple(value)
+        if key == "$bytes":
+            return base64.b64decode(value)
+        if key == "$dict":
+            return {pairKey: pairValue for pairKey, pairValue in value}
+    return encodedObject
+
+
+def dumpRecord(record: dict) -> str:
+    """
+    Returns a record as a single line of JSON.
+    """
+    return json.dumps(encodeRecord(record), ensure_ascii=False, separators=(",", ":"))
+
+
+def loadRecord(text: str | bytes) -> dict:
+    """
+    Reads a record written by `dumpRecord`.
+    """
+    return json.loads(text, object_hook=_decodeObject)
@@ -2,46 +2,115 @@ from datetime import datetime
 import pandas as pd
 import numpy as np # Import numpy for np.nan
 
+from reporting.logger import getLogger
+
+logger = getLogger(__name__)
+
+# Formats of date/time values that are not yet typed: ISO (as written by to_csv), EXIF,
+# and the 'YYYYMMDD_HHMMSS' / 'YYYYMMDD' forms used in file names.
+DATETIME_FORMATS: list[str] = ["ISO8601", "%Y:%m:%d %H:%M:%S", "%Y%m%d_%H%M%S", "%Y%m%d"]
+
+def toDateTime(values: pd.Series) -> pd.Series:
+    """
+    Converts a Series to datetime64. Values that are already datetimes are kept, strings are parsed
+    with each of the DATETIME_FORMATS in turn, and anything that cannot be parsed becomes NaT.
+
+    Args:
+        values (pd.Series): The values to convert.
+
+    Returns:
+        pd.Series: A datetime64 Series with the same index.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+
+    stringValues: pd.Series = values.where(values.notna()).astype("string")
+    dateTimes: pd.Series = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+
+    # Only parse the values that are still missing with the next format
+    for dateTimeFormat in DATETIME_FORMATS:
+        isMissing: pd.Series = dateTimes.isna() & stringValues.notna()
+        if not isMissing.any():
+            break
+        dateTimes[isMissing] = pd.to_datetime(stringValues[isMissing], format=dateTimeFormat, errors="coerce")
+
+    return dateTimes
+
+def formatIndicated(values: pd.Series, isDateOnly: pd.Series | None = None) -> pd.Series:
+    """
+    Renders date/time values as the 'YYYYMMDD_HHMMSS' strings used in file names. Values that
+    come from a date without a time (e.g. in a file name, see the 'indicatedDateOnly' column)
+    are rendered as 'YYYYMMDD'. Missing values stay missing.
+
+    Args:
+        values (pd.Series): The date/time values to render.
+        isDateOnly (pd.Series | None): True for the values that have no time of day. If None,
+                                       every value has a time, even if it is midnight.
+
+    Returns:
+        pd.Series: A Series of strings with the same index.
+    """
+    dateTimes: pd.Series = toDateTime(values)
+    dateTimes = dateTimes[dateTimes.notna()]
+    # Whether a value has a time cannot be told from the value, as '00:00:00' is a valid time
+    if isDateOnly is None:
+        isDateOnly = pd.Series(False, index=dateTimes.index)
+    else:
+        isDateOnly = isDateOnly.reindex(dateTimes.index).fillna(False).astype(bool)
+
+    # The digits are computed as integers, which is many times faster than strftime on large tables;
+    # a leading 1 keeps the zeros of e.g. '000105', and is sliced off again
+    dateNames: pd.Series = (100000000 + dateTimes.dt.year * 10000 + dateTimes.dt.month * 100 + dateTimes.dt.day).astype(str).str.slice(1)
+    timeNames: pd.Series = (1000000 + dateTimes.dt.hour * 10000 + dateTimes.dt.minute * 100 + dateTimes.dt.second).astype(str).str.slice(1)
+
+    return dateNames.where(isDateOnly, dateNames + "_" + timeNames).reindex(values.index)
+
 def filterDateTime(df: pd.DataFrame, columnName: str = "recorded", yearLimit: int = 2000) -> None:
     """
-    Cleans the 'recorded' column in the DataFrame by setting values to None if their year is outside a specified range
-    or if the year cannot be parsed. This function modifies the DataFrame in place.
+    Cleans the 'recorded' column in the DataFrame by converting it to datetime64 and setting values to NaT
+    if their year is outside a specified range or if the value cannot be parsed. This function modifies
+    the DataFrame in place.
 
     Args:
         df (pd.DataFrame): The input DataFrame. Modified in place.
         columnName (str): The name of the column to clean. Defaults to "recorded".
     """
-    # Ensure 'recorded' column is string type for consistent slicing.
-    # Convert existing None/NaN to string 'None'/'nan' for `astype(str)`.
-    # This ensures that subsequent `.str[:4]` operations don't fail for non-string types.
-    df[columnName] = df[columnName].astype(str)
-
-    # Attempt to extract the first 4 characters and convert to numeric year.
-    # `errors="coerce"` will turn any unparseable strings (like "None", "nan", or shorter strings) into NaN.
-    yearsExtracted: int = pd.to_numeric(df[columnName].str[:4], errors="coerce")
+    # A column that no file had (e.g. DateTime in a folder of videos) has nothing to clean.
+    if columnName not in df.columns:
+        return
+
+    # Ensure the column is typed, so the year can be taken without any string conversions.
+    df[columnName] = toDateTime(df[columnName])
+
+    yearsExtracted: pd.Series = df[columnName].dt.year
     # Get the current year for comparison.
     currentYear: int = datetime.now().year
 
-    # Create a boolean mask for values that should be set to None:
-    # 1. Where year extraction resulted in NaN (meaning invalid format/missing).
-    # 2. Where the extracted year is outside the valid range ( > currentYear or < 2000).
-    maskToNull: bool = yearsExtracted.isna() | ((yearsExtracted > currentYear) | (yearsExtracted < yearLimit))
+    # Create a boolean mask for values that should be set to NaT:
+    # 1. Where the value is missing or could not be parsed.
+    # 2. Where the year is outside the valid range ( > currentYear or < 2000).
+    maskToNull: pd.Series = yearsExtracted.isna() | ((yearsExtracted > currentYear) | (yearsExtracted < yearLimit))
 
-    # Apply the mask to set the 'recorded' column values to None where conditions are met.
-    # Using `None` will allow Pandas to represent missing values as `NaN` where appropriate,
-    # and simplifies `pd.notna()` checks later.
-    df.loc[maskToNull, columnName] = None
+    # Apply the mask to set the column values to NaT where conditions are met.
+    df.loc[maskToNull, columnName] = pd.NaT
 
-    print(f"Cleaned {columnName} column. {maskToNull.sum()} entries were set to None, because they were either invalid or outside the range {yearLimit} - {currentYear}.\n")
+    logger.info("Cleaned %s column. %d entries were set to None, because they were either invalid or outside the range %d - %d.",
+                columnName, maskToNull.sum(), yearLimit, currentYear)
 
 def selectDateTime(df: pd.DataFrame, dateTimeCol: str = "DateTime", recordedCol: str = "recorded",
                    modifiedCol: str = "modified", creationCol: str = "creation", newColumn: str = "filtered") -> pd.DataFrame:
     """
-    Selects the most appropriate date/time value for each row based on a set of rules
-    and inserts it into a new column.
+    Selects the most appropriate date/time value for each row and inserts it into a new column.
+    The value with the earliest year is selected; on equal years, the first column in the order
+    recorded, DateTime, modified, creation wins. The selection is done with column operations
+    instead of a row-wise apply, and both new columns are datetime64.
+
+    Rows without any valid date/time value are reported, and their new column and "indicated"
+    values are left empty. "indicatedDateOnly" is True where the selected value is a recorded
+    date without a time (see 'recordedDateOnly').
 
     Args:
-        df (pd.DataFrame): The input DataFrame.
+        df (pd.DataFrame): The input DataFrame. Modified in place.
         dateTimeCol (str): Name of the primary date/time column. Defaults to "DateTime".
         recordedCol (str): Name of the "recorded" date/time column. Defaults to "recorded".
         modifiedCol (str): Name of the "modified" date/time column. Defaults to "modified".
@@ -54,96 +123,37 @@ def selectDateTime(df: pd.DataFrame, dateTimeCol: str = "DateTime", recordedCol:
 
     # If dateTimeCol doesn't exist, default to creationCol
     if dateTimeCol not in df.columns:
-        dateTimeCol: str = "creation"
-
-    def _getYearFromColumn(rowVal) -> int | None:
-        """
-        Safely extracts the first 4 characters from a value and converts to an integer year.
-        Returns None if the value is missing, not string-like, or year conversion fanewColils.
-        """
-        if pd.notna(rowVal):
-            sVal = str(rowVal)
-            if len(sVal) >= 4:
-                try:
-                    return int(sVal[:4])
-                except ValueError:
-                    pass # Conversion failed, fall through to return None
-        return None
-
-    # --- Optimized Helper Function (from our previous discussion) ---
-    def get_filtered_value_lambda_optimized(recordedYear, dateTimeYear, modifiedYear, creationYear,
-                                            recordedValue, dateTimeValue, modifiedValue, creationValue) -> str | None:
-        """
-        Determines the filtered value based on the provided years and associated values,
-        optimized for efficiency using a lambda function.
-
-        Args:
-            recordedYear (int/None): The year of the recorded value.
-            dateTimeYear (int/None): The year of the datetime value.
-            modifiedYear (int/None): The year of the modified value.
-            creationYear (int/None): The year of the creation value.
-            recordedValue: The value associated with recordedYear.
-            dateTimeValue: The value associated with dateTimeYear.
-            modifiedValue: The value associated with modifiedYear.
-            creationValue: The value associated with creationYear.
-
-        Returns:
-            The filtered value based on the logic.
-            Exits the program if no valid date/time values are found.
-        """
-        available_dates = []
-        if recordedYear is not None:
-            available_dates.append((recordedYear, recordedValue))
-        if dateTimeYear is not None:
-            available_dates.append((dateTimeYear, dateTimeValue))
-        if modifiedYear is not None:
-            available_dates.append((modifiedYear, modifiedValue))
-        if creationYear is not None:
-            available_dates.append((creationYear, creationValue))
-
-        if not available_dates:
-            print("No valid date/time values found for row. Exiting program to prevent issues.")
-            exit()
-
-        min_date_tuple = min(available_dates, key=lambda x: x[0])
-        return min_date_tuple[1]
-
-    # --- Your _calculateFilteredValue function, now using the optimized helper ---
-    def _calculateFilteredValue(row: dict) -> str | None:
-        """
-        Helper function to apply row-wise. Determines the "filtered" value for a single row.
-        """
-        # Safely get year integers for comparison
-        # Important: Ensure _getYearFromColumn can handle None and returns int | None
-        dateTimeYear: int | None = _getYearFromColumn(row.get(dateTimeCol))
-        recordedYear: int | None = _getYearFromColumn(row.get(recordedCol))
-        modifiedYear: int | None = _getYearFromColumn(row.get(modifiedCol))
-        creationYear: int | None = _getYearFromColumn(row.get(creationCol))
-
-        # Retrieve original string values (not years) for the final result
-        dateTimeValue: str | None = row.get(dateTimeCol)
-        recordedValue: str | None = row.get(recordedCol)
-        modifiedValue: str | None = row.get(modifiedCol)
-        creationValue: str | None = row.get(creationCol)
-
-        # Call the optimized helper function
-        return get_filtered_value_lambda_optimized(
-            recordedYear, dateTimeYear, modifiedYear, creationYear,
-            recordedValue, dateTimeValue, modifiedValue, creationValue
-        )
-
-    # Apply the helper function row-wise to create the new "filtered" Series.
-    # This automatically ensures the Series has the same length and index as the DataFrame.
-    filteredSeries: pd.Series = df.apply(_calculateFilteredValue, axis=1)
+        dateTimeCol: str = creationCol
+
+    # The order of the candidate columns decides which value is selected on equal years
+    candidateCols: list[str] = [recordedCol, dateTimeCol, modifiedCol, creationCol]
+    candidates: list[pd.Series] = [
+        toDateTime(df[col]) if col in df.columns else pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+        for col in candidateCols
+    ]
+
+    # Build a (rows x candidates) matrix of years, where missing years never win the comparison
+    years: np.ndarray = np.column_stack([candidate.dt.year.to_numpy(dtype=float) for candidate in candidates])
+    hasNoDate: np.ndarray = np.isnan(years).all(axis=1)
+    selectedCandidate: np.ndarray = np.where(np.isnan(years), np.inf, years).argmin(axis=1)
+
+    # Pick the date/time of the selected candidate for every row; rows without a date get NaT
+    values: np.ndarray = np.column_stack([candidate.to_numpy(dtype="datetime64[ns]") for candidate in candidates])
+    filteredSeries: pd.Series = pd.Series(values[np.arange(len(df)), selectedCandidate], index=df.index)
+
+    if hasNoDate.any():
+        missingRows = df.loc[hasNoDate, "path"] if "path" in df.columns else df.index[hasNoDate]
+        logger.warning("No valid date/time values found for %d rows. Their '%s' and 'indicated' values are left empty:\n%s",
+                       hasNoDate.sum(), newColumn, "\n".join(f"  {missingRow}" for missingRow in list(missingRows)[:10]))
 
     # Insert the Series into the DataFrame at the specified location.
-    # The .copy() is crucial here to ensure df is not modified in-place and to return a new DataFrame.
-    # If the function is meant to modify in-place and return None, remove the .copy() and the return statement.
-    # Given the return type hint `-> pd.DataFrame`, it's safer to return a copy.
     df.insert(6, newColumn, filteredSeries)
 
-    # Process the new "filtered" column to create "indicated"
-    # Ensure to handle potential NaNs by converting to string first.
-    df["indicated"] = df[newColumn].astype(str).str.replace(":", "", regex=False).str.replace(" ", "_", regex=False)
+    # "indicated" stays typed; its string form is only rendered by formatIndicated when renaming files.
+    df["indicated"] = filteredSeries
+    # A date without a time (from a file name) is only known as such while it is the selected value
+    recordedDateOnly: np.ndarray = df["recordedDateOnly"].fillna(False).to_numpy(dtype=bool) \
+        if "recordedDateOnly" in df.columns else np.zeros(len(df), dtype=bool)
+    df["indicatedDateOnly"] = (selectedCandidate == 0) & ~hasNoDate & recordedDateOnly
 
-    return df
\ No newline at end of file
+    return df
@@ -1,66 +1,145 @@
-import pandas as pd
+import io
+import logging
 import os
 
+import pandas as pd
+
 # Assuming these are in transformation/datetimeFilter.py and can be imported at the top
-from transformation.datetimeFilter import filterDateTime, selectDateTime
+from transformation.datetimeFilter import filterDateTime, selectDateTime, toDateTime
+from storage.formats import REGULAR_SCHEMA, RARE_TAGS_FILE_NAME, compactExifColumns, getTablePath, readTable, splitRareExifColumns, writeTable
+from profiling.profiler import profileStage, profiled
+from reporting.logger import getLogger
 
 #### DATA TRANSFORMATION ####
 """
-This module transforms metadata extracted from image and video files. It reads metadata
-from a CSV, cleans and selects date/time columns, sets the index, sorts the DataFrame,
-and optionally drops empty or float columns. The transformed data is then saved back
-to the CSV file.
+This module transforms metadata extracted from image and video files. It takes the metadata
+as a DataFrame from `extractData`, or reads it from a CSV (or Parquet/Feather) file,
+restores and cleans the datetime64 date/time columns, selects the indicated date/time, sets
+the index, sorts the DataFrame, and optionally drops empty or float columns. EXIF tags that
+only a few files have can be moved to a long side table, and text tags with few distinct
+values are kept as categoricals. The transformed data is then saved to the metadata file and
+returned, so it can be passed on without reading the CSV file again.
 """
 
-def transformData(sourceFolder: str, dropEmptyCols: bool = True, dropFloatCols: bool = True) -> None:
-    """
-    Transforms metadata from a CSV file.
+logger = getLogger(__name__)
 
-    Args:
-        sourceFolder (str): The path to the folder containing the .mediaMetaData.csv file.
-        dropEmptyCols (bool): If True, drops columns that are entirely empty (NaN).
-        dropFloatCols (bool): If True, drops float64 columns, except for "GPSInfo".
+# EXIF columns that are used downstream, so they always stay in the metadata table
+KEPT_EXIF_COLUMNS: list[str] = ["DateTime", "GPSLatitude", "GPSLongitude", "GPSAltitude", "duration"]
+
+def _inferNumericColumns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts EXIF columns whose values are all numeric to numeric dtypes, as `pd.read_csv`
+    does when the metadata is read from a CSV file. This keeps `dropFloatCols` consistent
+    between a DataFrame passed in memory, one read from the CSV file, and one read from a
+    columnar file in which the EXIF columns are stored as strings.
     """
-    csvFilePath = os.path.join(sourceFolder, ".mediaMetaData.csv")
+    exifColumns = df.columns.difference(list(REGULAR_SCHEMA), sort=False)
+    for columnName in df[exifColumns].select_dtypes(include=["object", "string"]).columns:
+        values = df[columnName]
+        # Convert through object values, so the result has numpy dtypes (float64) instead of nullable ones
+        numericValues = pd.to_numeric(values.astype(object), errors="coerce")
+        if numericValues.notna().sum() == values.notna().sum():
+            df[columnName] = numericValues
+    return df
 
+def _readMetaDataTable(sourceFolder: str, fileFormat: str) -> pd.DataFrame | None:
+    tablePath = getTablePath(sourceFolder, fileFormat)
     try:
-        # Use index_col=0 if the first column is always an unnamed index from a previous save.
-        # This prevents pandas from creating a new default index and avoids the need to drop it later.
-        df = pd.read_csv(csvFilePath, sep=";", index_col=0)
+        return readTable(sourceFolder, fileFormat)
     except FileNotFoundError:
-        print(f"Error: CSV file not found at {csvFilePath}. Transformation aborted.")
-        return
+        logger.error("%s file not found at %s. Transformation aborted.", fileFormat, tablePath)
     except pd.errors.EmptyDataError:
-        print(f"Warning: CSV file at {csvFilePath} is empty. No data to transform.")
-        return
+        logger.warning("%s file at %s is empty. No data to transform.", fileFormat, tablePath)
     except Exception as e:
-        print(f"An error occurred while reading the CSV file: {e}. Transformation aborted.")
-        return
+        logger.error("An error occurred while reading the %s file: %s. Transformation aborted.", fileFormat, e)
+    return None
+
+
+@profiled("transform")
+def transformData(sourceFolder: str, dropEmptyCols: bool = True, dropFloatCols: bool = True,
+                  df: pd.DataFrame | None = None, saveFile: bool = True, fileFormat: str = "csv",
+                  compactExif: bool = True, rareTagDensity: float | None = None) -> pd.DataFrame | None:
+    """
+    Transforms metadata from a DataFrame or a metadata file.
+
+    Args:
+        sourceFolder (str): The path to the folder containing the .mediaMetaData.csv file.
+        dropEmptyCols (bool): If True, drops columns that are entirely empty (NaN).
+        dropFloatCols (bool): If True, drops float64 columns, except for the GPS coordinates and the video "duration".
+        df (pd.DataFrame | None): The metadata returned by `extractData(..., returnDataFrame=True)`.
+                                  If None, the metadata is read from the CSV file.
+        saveFile (bool): If True, saves the transformed DataFrame to the metadata file.
+        fileFormat (str): The format of the metadata file: "csv", "parquet" or "feather".
+        compactExif (bool): If True, text EXIF columns with few distinct values become categoricals.
+        rareTagDensity (float | None): If provided, EXIF columns that at most this fraction of the
+                                       files have are moved to a (path, tag, value) side table,
+                                       which is saved next to the metadata file.
+
+    Returns:
+        pd.DataFrame | None: The transformed DataFrame, indexed by path, or None if the
+                             transformation was aborted.
+    """
+    if df is None:
+        df = _readMetaDataTable(sourceFolder, fileFormat)
+        if df is None:
+            return None
+    elif df.empty:
+        logger.warning("No metadata was extracted. No data to transform.")
+        return None
+
+    # Give the DataFrame the numeric dtypes a CSV round trip would give it
+    df = _inferNumericColumns(df)
+
+    # Restore the datetime64 types of the file system times, which the CSV stores as text
+    for columnName in ("creation", "modified"):
+        if columnName in df.columns:
+            df[columnName] = toDateTime(df[columnName])
 
     # Filter and select date and time columns
     # Assuming filterDateTime and selectDateTime modify the DataFrame in-place.
-    filterDateTime(df, columnName="recorded")
-    filterDateTime(df, columnName="DateTime")
-    selectDateTime(df)
+    with profileStage("filterDateTime"):
+        filterDateTime(df, columnName="recorded")
+        filterDateTime(df, columnName="DateTime")
+    with profileStage("selectDateTime"):
+        selectDateTime(df)
 
-    # Set index as the path column and sort descending by the "indicated" column
-    df = df.set_index("path").sort_values(by="indicated", ascending=False)
+    # Set index as the path column and sort descending by the "indicated" column; files with the same
+    # "indicated" value stay sorted by path, so their '_N' counters do not depend on the walk order
+    df = df.set_index("path").sort_index(kind="stable").sort_values(by="indicated", ascending=False, kind="stable")
 
     # Drop empty columns if requested
     if dropEmptyCols:
         df = df.dropna(axis=1, how="all")
 
-    # Drop columns with data type float64, except the GPSInfo column, if requested
+    # Drop columns with data type float64, except the GPS and duration columns, if requested
     if dropFloatCols:
         floatCols = df.select_dtypes(include=["float64"]).columns
-        # Drop columns that are float64 type, but exclude "GPSInfo"
-        colsToDrop = floatCols.difference(["GPSInfo"])
+        # Drop columns that are float64 type, but exclude the columns that are used downstream
+        colsToDrop = floatCols.difference(KEPT_EXIF_COLUMNS)
         df = df.drop(columns=colsToDrop)
 
-    # Get and print the information of the DataFrame
-    # df.info() prints directly to stdout and returns None.
-    print("\n--- DataFrame Information ---") # A simpler, clear header
-    df.info(verbose=True, show_counts=True)
+    # Move rare tags out of the table, and store repeated text values once
+    rareTags: pd.DataFrame | None = None
+    if rareTagDensity is not None:
+        df, rareTags = splitRareExifColumns(df, rareTagDensity, keptColumns=KEPT_EXIF_COLUMNS)
+        logger.info("Moved %d values of rare EXIF tags to the side table.", len(rareTags))
+    if compactExif:
+        df = compactExifColumns(df)
+
+    # Get and log the information of the DataFrame
+    # df.info() writes to a buffer and returns None; it is skipped entirely below INFO level.
+    if logger.isEnabledFor(logging.INFO):
+        dataFrameInfo = io.StringIO()
+        df.info(verbose=True, show_counts=True, buf=dataFrameInfo)
+        logger.info("\n--- DataFrame Information ---\n%s", dataFrameInfo.getvalue()) # A simpler, clear header
+
+    # Save the transformed DataFrame to the metadata file, if requested, with the side table of a previous run replaced
+    if saveFile:
+        writeTable(df, sourceFolder, fileFormat)
+        rareTagsPath = getTablePath(sourceFolder, fileFormat, RARE_TAGS_FILE_NAME)
+        if rareTags is not None:
+            writeTable(rareTags, sourceFolder, fileFormat, RARE_TAGS_FILE_NAME)
+        elif os.path.exists(rareTagsPath):
+            os.remove(rareTagsPath)
 
-    # Save the transformed DataFrame to a CSV file
-    df.to_csv(csvFilePath, sep=";", index=True)
\ No newline at end of file
+    return df
@@ -0,0 +1,219 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from extraction.metadata.walker import IGNORED_DIRECTORIES, scanMediaFiles
+from reporting.logger import getLogger
+
+#### FILE SYSTEM EVENTS ####
+"""
+This module reports which media files in a folder tree were created, modified or removed.
+On Linux, `InotifyWatcher` uses the kernel's inotify interface through ctypes, with a watch
+on every folder; new folders get a watch as soon as they appear, and the files that were
+copied into them before that are reported too. Elsewhere, or when inotify is not available
+(e.g. on network shares, or when the limit of watches is reached), `PollingWatcher` compares
+snapshots of the size and modification time of every file. Both have the same interface:
+`poll` waits for at most `timeout` seconds and returns the changed and the removed paths;
+a removed path may also be a folder, which stands for all files below it. The pipeline's
+own sidecar files and folders (see SIDECAR_PREFIXES), such as the checkpoint of an extraction,
+are never reported.
+"""
+
+logger = getLogger(__name__)
+
+# inotify flags, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")
+
+# The names of the files and folders the pipeline writes next to the media, e.g. '.mediaMetaData.checkpoint'
+SIDECAR_PREFIXES: tuple[str, ...] = (".mediaMetaData", ".mediaRename")
+
+
+def _isSupported(filePath: str, supportedExtensions: tuple[str, ...]) -> bool:
+    return os.path.splitext(filePath)[1].lower() in supportedExtensions
+
+
+def _listMediaFiles(folder: str, supportedExtensions: tuple[str, ...]) -> dict[str, tuple[int, int]]:
+    # The size and modification time of every supported file in a folder tree
+    snapshot: dict[str, tuple[int, int]] = {}
+    for _, fileEntries, _ in scanMediaFiles(folder, supportedExtensions):
+        for fileEntry in fileEntries:
+            try:
+                fileStat = fileEntry.stat()
+            except OSError:
+                continue
+            snapshot[fileEntry.path] = (fileStat.st_size, fileStat.st_mtime_ns)
+    return snapshot
+
+
+class PollingWatcher:
+    """
+    Reports changes by comparing snapshots of the folder tree every `interval` seconds.
+    """
+
+    def __init__(self, sourceFolder: str, supportedExtensions: tuple[str, ...], interval: float = 10.0) -> None:
+        self.sourceFolder = sourceFolder
+        self.supportedExtensions = supportedExtensions
+        self.interval = interval
+        self.snapshot = _listMediaFiles(sourceFolder, supportedExtensions)
+        self.lastScan = time.monotonic()
+
+    def poll(self, timeout: float) -> tuple[set[str], set[str]]:
+        remaining = self.interval - (time.monotonic() - self.lastScan)
+        if remaining > 0:
+            time.sleep(min(timeout, remaining))
+            if remaining > timeout:
+                return set(), set()
+
+        snapshot = _listMediaFiles(self.sourceFolder, self.supportedExtensions)
+        self.lastScan = time.monotonic()
+        changedPaths = {filePath for filePath, fileState in snapshot.items() if self.snapshot.get(filePath) != fileState}
+        removedPaths = self.snapshot.keys() - snapshot.keys()
+        self.snapshot = snapshot
+        return changedPaths, removedPaths
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """
+    Reports changes with inotify. Raises OSError if inotify is not available.
+    """
+
+    def __init__(self, sourceFolder: str, supportedExtensions: tuple[str, ...]) -> None:
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fileDescriptor = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fileDescriptor < 0:
+            errorNumber = ctypes.get_errno()
+            raise OSError(errorNumber, os.strerror(errorNumber))
+
+        self.sourceFolder = sourceFolder
+        self.supportedExtensions = supportedExtensions
+        self.watchedFolders: dict[int, str] = {}
+        try:
+            self._watchTree(sourceFolder)
+        except OSError:
+            os.close(self.fileDescriptor)
+            raise
+
+    def _watchFolder(self, folder: str) -> None:
+        watchDescriptor = self.libc.inotify_add_watch(self.fileDescriptor, os.fsencode(folder), WATCH_MASK)
+        if watchDescriptor < 0:
+            errorNumber = ctypes.get_errno()
+            # Folders that disappeared in the meantime are not an error; running out of watches is
+            if errorNumber not in (errno.ENOENT, errno.ENOTDIR):
+                raise OSError(errorNumber, f"Could not watch folder '{folder}': {os.strerror(errorNumber)}")
+            return
+        self.watchedFolders[watchDescriptor] = folder
+
+    def _watchTree(self, folder: str) -> set[str]:
+        # Watch a folder and its subfolders, and return the files that are already in them
+        self._watchFolder(folder)
+        existingPaths: set[str] = set()
+        for root, subFolders, files in os.walk(folder):
+            subFolders[:] = [subFolder for subFolder in subFolders
+                             if subFolder not in IGNORED_DIRECTORIES and not subFolder.startswith(SIDECAR_PREFIXES)]
+            for subFolder in subFolders:
+                self._watchFolder(os.path.join(root, subFolder))
+            existingPaths.update(os.path.join(root, fileName) for fileName in files if _isSupported(fileName, self.supportedExtensions))
+        return existingPaths
+
+    def poll(self, timeout: float) -> tuple[set[str], set[str]]:
+        changedPaths: set[str] = set()
+        removedPaths: set[str] = set()
+
+        readable, _, _ = select.select([self.fileDescriptor], [], [], timeout)
+        if not readable:
+            return changedPaths, removedPaths
+
+        while True:
+            try:
+                eventData = os.read(self.fileDescriptor, 65536)
+            except BlockingIOError:
+                break
+
+            position = 0
+            while position < len(eventData):
+                watchDescriptor, mask, _, nameLength = EVENT_HEADER.unpack_from(eventData, position)
+                name = os.fsdecode(eventData[position + EVENT_HEADER.size:position + EVENT_HEADER.size + nameLength].rstrip(b"\0"))
+                position += EVENT_HEADER.size + nameLength
+
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost, so every file in the tree is reported as changed
+                    logger.warning("The inotify event queue overflowed. Rescanning the whole folder.")
+                    changedPaths.update(_listMediaFiles(self.sourceFolder, self.supportedExtensions))
+                    continue
+                if mask & (IN_IGNORED | IN_DELETE_SELF):
+                    self.watchedFolders.pop(watchDescriptor, None)
+                    continue
+
+                folder = self.watchedFolders.get(watchDescriptor)
+                if folder is None or not name or name.startswith(SIDECAR_PREFIXES):
+                    continue
+                eventPath = os.path.join(folder, name)
+
+                if mask & IN_ISDIR:
+                    # New folders (created or moved in) are watched, and their files reported
+                    if mask & (IN_CREATE | IN_MOVED_TO) and name not in IGNORED_DIRECTORIES:
+                        changedPaths.update(self._watchTree(eventPath))
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        # A removed folder stands for all files below it; the watches of a moved
+                        # folder are removed too, since they keep following it under its old path
+                        removedPaths.add(eventPath)
+                        for movedDescriptor, movedFolder in list(self.watchedFolders.items()):
+                            if movedFolder == eventPath or movedFolder.startswith(eventPath + os.sep):
+                                self.libc.inotify_rm_watch(self.fileDescriptor, movedDescriptor)
+                                self.watchedFolders.pop(movedDescriptor)
+                        changedPaths.difference_update({filePath for filePath in changedPaths if filePath.startswith(eventPath + os.sep)})
+                    continue
+
+                if not _isSupported(name, self.supportedExtensions):
+                    continue
+                if mask & (IN_DELETE | IN_MOVED_FROM):
+                    removedPaths.add(eventPath)
+                    changedPaths.discard(eventPath)
+                else:
+                    changedPaths.add(eventPath)
+                    removedPaths.discard(eventPath)
+
+        return changedPaths, removedPaths
+
+    def close(self) -> None:
+        os.close(self.fileDescriptor)
+
+
+def openWatcher(sourceFolder: str, supportedExtensions: tuple[str, ...], usePolling: bool = False,
+                pollInterval: float = 10.0) -> InotifyWatcher | PollingWatcher:
+    """
+    Opens an inotify watcher for the folder tree, or a polling watcher if inotify is not
+    available or `usePolling` is True.
+    """
+    if not usePolling:
+        try:
+            return InotifyWatcher(sourceFolder, supportedExtensions)
+        except (OSError, AttributeError) as e:
+            logger.warning("Inotify is not available (%s). Polling every %s seconds instead.", e, pollInterval)
+    return PollingWatcher(sourceFolder, supportedExtensions, pollInterval)
@@ -0,0 +1,307 @@
+import argparse
+import os
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from extraction.extraction import extractData
+from extraction.metadata.cache import ExtractionCache
+from extraction.metadata.dictionaries import getDataDictionary
+from extraction.metadata.walker import SUPPORTED_TYPES, scanMediaFiles
+from renaming.renamer import JOURNAL_FILE_NAME, RENAME, planRenames, executeRenames
+from storage.formats import getTablePath, readTable, writeTable
+from transformation.datetimeFilter import formatIndicated
+from transformation.transformation import transformData
+from watching.events import openWatcher
+from reporting.logger import configureLogging, getLogger, shutdownLogging
+
+#### WATCH MODE ####
+"""
+This module keeps the metadata table of a folder up to date while files arrive, instead of
+rescanning the whole folder on every run. At startup, files that are new or changed since
+the table was written are indexed (or the whole folder, if there is no table yet). After
+that, only the files reported by the watcher (inotify, or polling) are extracted and
+transformed, with the same extraction cache and EXIF tag allow-list as the initial index, so
+their rows have the same columns, and their rows are merged into the table; rows of removed
+files are dropped. Events are debounced: a file is only processed once it has had no events
+for `debounceSeconds`, and during a bulk copy the settled files are collected until the copy
+pauses (or `maxBatchDelay` has passed), so they are handled as one batch. Optionally, newly
+arrived files are renamed with the usual rules; the events caused by these renames are
+ignored. Their '_N' counters continue after the files in the table with the same date and
+time, so a new file never gets the name of a file that was renamed in an earlier batch.
+"""
+
+logger = getLogger(__name__)
+
+
+def _isBelow(paths: pd.Index, removedPaths: set[str]) -> pd.Series:
+    # Removed paths may be files or folders
+    if not removedPaths:
+        return pd.Series(False, index=paths)
+    folderPrefixes = tuple(removedPath + os.sep for removedPath in removedPaths)
+    pathValues = pd.Series(paths.astype(str), index=paths)
+    return pathValues.isin(removedPaths) | pathValues.str.startswith(folderPrefixes)
+
+
+def _readExistingTable(sourceFolder: str, fileFormat: str) -> pd.DataFrame | None:
+    if not os.path.exists(getTablePath(sourceFolder, fileFormat)):
+        return None
+    try:
+        return readTable(sourceFolder, fileFormat)
+    except (OSError, ValueError, pd.errors.EmptyDataError) as e:
+        logger.warning("Could not read the metadata table (%s). It is rebuilt from the changed files.", e)
+        return None
+
+
+def updateMetaDataTable(sourceFolder: str, newRows: pd.DataFrame | None, removedPaths: set[str], fileFormat: str = "csv",
+                        table: pd.DataFrame | None = None) -> pd.DataFrame | None:
+    """
+    Merges transformed rows into the persisted metadata table, and drops the rows of removed files.
+
+    Args:
+        sourceFolder (str): The path to the folder containing the metadata table.
+        newRows (pd.DataFrame | None): Rows returned by `transformData`, indexed by path. Rows with
+                                       the same path replace the existing rows.
+        removedPaths (set[str]): The paths of removed files or folders.
+        fileFormat (str): The file format: "csv", "parquet" or "feather".
+        table (pd.DataFrame | None): The persisted table, if it was already read.
+
+    Returns:
+        pd.DataFrame | None: The updated metadata table, or None if it is empty.
+    """
+    if table is None:
+        table = _readExistingTable(sourceFolder, fileFormat)
+
+    if table is not None:
+        replacedPaths = set(newRows.index) if newRows is not None else set()
+        table = table[~(table.index.isin(replacedPaths) | _isBelow(table.index, removedPaths).to_numpy())]
+        if newRows is not None and not newRows.empty:
+            table = pd.concat([table, newRows]) if not table.empty else newRows
+    else:
+        table = newRows
+
+    if table is None:
+        return None
+    table = table.sort_values(by="indicated", ascending=False)
+    writeTable(table, sourceFolder, fileFormat)
+    return table
+
+
+def _findChangesSinceTable(sourceFolder: str, supportedTypes: list[tuple[str, ...]], table: pd.DataFrame) -> tuple[set[str], set[str]]:
+    # Files that are not in the table, or whose modified time differs from the table, and rows of files that are gone
+    tableModified: dict[str, pd.Timestamp] = table["modified"].to_dict() if "modified" in table.columns else {}
+    changedPaths: set[str] = set()
+    diskPaths: set[str] = set()
+
+    for _, fileEntries, _ in scanMediaFiles(sourceFolder, supportedTypes[0] + supportedTypes[1]):
+        for fileEntry in fileEntries:
+            diskPaths.add(fileEntry.path)
+            try:
+                modifiedTime = datetime.fromtimestamp(fileEntry.stat().st_mtime).replace(microsecond=0)
+            except OSError:
+                continue
+            if fileEntry.path not in tableModified or tableModified[fileEntry.path] != pd.Timestamp(modifiedTime):
+                changedPaths.add(fileEntry.path)
+
+    return changedPaths, set(map(str, table.index)) - diskPaths
+
+
+def _continueSuffixes(newRows: pd.DataFrame, table: pd.DataFrame | None) -> pd.DataFrame:
+    # Number the new files with the same 'indicated' value after the files already in the table
+    newNames = formatIndicated(newRows["indicated"], newRows.get("indicatedDateOnly"))
+    hasDate = newNames.notna()
+    offsets = pd.Series(0, index=pd.Index(newNames[hasDate].unique()), dtype="int64")
+
+    if table is not None and not table.empty and "indicated" in table.columns:
+        # Rows of files that are extracted again are replaced, so they do not count
+        existingRows = table[~table.index.isin(newRows.index)]
+        existingNames = formatIndicated(existingRows["indicated"], existingRows.get("indicatedDateOnly"))
+        offsets = offsets.add(existingNames.value_counts(), fill_value=0)
+        if "indicatedSuffix" in existingRows.columns:
+            # Counters given by an earlier batch (or a shard merge) may have gaps
+            nextSuffixes = existingRows["indicatedSuffix"].astype("Float64").groupby(existingNames).max().dropna() + 1
+            offsets = pd.concat([offsets, nextSuffixes.astype("int64")], axis=1).max(axis=1)
+
+    suffixes = newNames[hasDate].groupby(newNames[hasDate], sort=False).cumcount() + newNames[hasDate].map(offsets).astype("int64")
+    newRows = newRows.copy()
+    newRows["indicatedSuffix"] = suffixes.reindex(newRows.index).astype("Int64")
+    return newRows
+
+
+class _FolderIndexer:
+    def __init__(self, sourceFolder: str, supportedTypes: list[tuple[str, ...]], fileFormat: str, ignoreSeconds: float,
+                 exifTags: frozenset | None = None, useCache: bool = True) -> None:
+        self.sourceFolder = sourceFolder
+        self.supportedTypes = supportedTypes
+        self.fileFormat = fileFormat
+        self.ignoreSeconds = ignoreSeconds
+        self.exifTags = exifTags
+        self.useCache = useCache
+        # The events the indexer's own renames cause (a new target, a removed source), each ignored
+        # once, until the time they are expected by
+        self.ownChanges: dict[str, float] = {}
+        self.ownRemovals: dict[str, float] = {}
+
+    @staticmethod
+    def _filterOwnEvents(paths: set[str], ownEvents: dict[str, float]) -> set[str]:
+        now = time.monotonic()
+        for path, until in list(ownEvents.items()):
+            if until <= now:
+                del ownEvents[path]
+        ownPaths = paths & ownEvents.keys()
+        for path in ownPaths:
+            del ownEvents[path]
+        return paths - ownPaths
+
+    def filterOwnChanges(self, paths: set[str]) -> set[str]:
+        return self._filterOwnEvents(paths, self.ownChanges)
+
+    def filterOwnRemovals(self, paths: set[str]) -> set[str]:
+        return self._filterOwnEvents(paths, self.ownRemovals)
+
+    def _renameNewFiles(self, newRows: pd.DataFrame, table: pd.DataFrame | None) -> pd.DataFrame:
+        newRows = _continueSuffixes(newRows, table)
+        plan = planRenames(newRows.reset_index())
+        try:
+            executeRenames(plan, journalPath=os.path.join(self.sourceFolder, JOURNAL_FILE_NAME))
+        except FileExistsError as e:
+            # The interrupted run has to be resumed or rolled back first; until then, new files keep their names
+            logger.warning("Not renaming new files: %s", e)
+            return newRows
+
+        # Keep the table in line with the files that were actually renamed
+        renames = plan.loc[plan["status"] == RENAME]
+        renames = renames.loc[[os.path.exists(target) and not os.path.exists(source)
+                               for source, target in renames[["source", "target"]].itertuples(index=False)]]
+        # A batch can have nothing to rename, e.g. if every new file conflicts
+        if renames.empty:
+            return newRows
+        ignoreUntil = time.monotonic() + self.ignoreSeconds
+        for source, target in renames[["source", "target"]].itertuples(index=False):
+            self.ownRemovals[source] = ignoreUntil
+            self.ownChanges[target] = ignoreUntil
+
+        newRows = newRows.rename(index=dict(zip(renames["source"], renames["target"])))
+        newRows.loc[renames["target"], "file"] = [os.path.basename(target) for target in renames["target"]]
+        return newRows
+
+    def processChanges(self, changedPaths: set[str], removedPaths: set[str], renameFiles: bool) -> None:
+        records: list[dict] = []
+        cache = ExtractionCache(self.sourceFolder) if self.useCache and changedPaths else None
+        try:
+            for filePath in sorted(changedPaths):
+                # Files can be gone again by the time they are processed
+                if not os.path.isfile(filePath):
+                    removedPaths.add(filePath)
+                    continue
+                root, fileName = os.path.split(filePath)
+                records.append(getDataDictionary(root, fileName, self.supportedTypes, cache, exifTags=self.exifTags))
+        finally:
+            # A batch only sees a few files, so the entries of the others are kept
+            if cache is not None:
+                cache.close(evictUnseen=False)
+
+        newRows: pd.DataFrame | None = None
+        if records:
+            newRows = transformData(self.sourceFolder, df=pd.DataFrame(records), saveFile=False)
+        table = _readExistingTable(self.sourceFolder, self.fileFormat)
+        if newRows is not None and renameFiles:
+            newRows = self._renameNewFiles(newRows, table)
+
+        updateMetaDataTable(self.sourceFolder, newRows, removedPaths, self.fileFormat, table)
+        logger.info("Indexed %d new or changed files, removed %d files or folders from the metadata table.", len(records), len(removedPaths))
+
+
+def watchFolder(sourceFolder: str, supportedTypes: list[tuple[str, ...]] = SUPPORTED_TYPES, fileFormat: str = "csv",
+                renameFiles: bool = False, debounceSeconds: float = 2.0, maxBatchDelay: float = 60.0,
+                usePolling: bool = False, pollInterval: float = 10.0, stopEvent: threading.Event | None = None,
+                exifTags: list[str] | None = None, useCache: bool = True) -> None:
+    """
+    Watches a folder and keeps its metadata table up to date until interrupted.
+
+    Args:
+        sourceFolder (str): The path to the folder to watch.
+        supportedTypes (list[tuple]): A list where each tuple contains file extensions
+                                       for a specific media type (e.g., image, video).
+        fileFormat (str): The file format of the metadata table: "csv", "parquet" or "feather".
+        renameFiles (bool): If True, newly arrived files are renamed based on their metadata.
+        debounceSeconds (float): The time without events after which a file is processed.
+        maxBatchDelay (float): The maximum time a settled file waits for a bulk copy to pause.
+        usePolling (bool): If True, polls the folder instead of using inotify.
+        pollInterval (float): The time between two scans of the polling watcher.
+        stopEvent (threading.Event | None): If provided, the watcher stops when it is set.
+        exifTags (list[str] | None): If provided, only these EXIF tags are extracted.
+        useCache (bool): If True, the extraction cache is used, as by `extractData`.
+    """
+    supportedExtensions = supportedTypes[0] + supportedTypes[1]
+    indexer = _FolderIndexer(sourceFolder, supportedTypes, fileFormat,
+                             ignoreSeconds=2 * max(debounceSeconds, pollInterval if usePolling else 0) + 5,
+                             exifTags=frozenset(exifTags) if exifTags is not None else None, useCache=useCache)
+
+    # Start watching before catching up, so files arriving in the meantime are not missed
+    watcher = openWatcher(sourceFolder, supportedExtensions, usePolling, pollInterval)
+    try:
+        table = _readExistingTable(sourceFolder, fileFormat)
+        if table is None:
+            logger.info("No metadata table found. Indexing the whole folder '%s' first.", sourceFolder)
+            transformData(sourceFolder, df=extractData(sourceFolder, supportedTypes=supportedTypes, returnDataFrame=True,
+                                                       exifTags=exifTags, useCache=useCache), fileFormat=fileFormat)
+        else:
+            # Files that changed while nothing was watching are indexed, but never renamed
+            changedPaths, removedPaths = _findChangesSinceTable(sourceFolder, supportedTypes, table)
+            if changedPaths or removedPaths:
+                indexer.processChanges(changedPaths, removedPaths, renameFiles=False)
+
+        logger.info("Watching folder '%s' for new files. Press Ctrl+C to stop.", sourceFolder)
+        pendingPaths: dict[str, float] = {}
+        removedPaths: set[str] = set()
+
+        while stopEvent is None or not stopEvent.is_set():
+            changedPaths, newlyRemovedPaths = watcher.poll(debounceSeconds)
+            now = time.monotonic()
+
+            for filePath in indexer.filterOwnChanges(changedPaths):
+                pendingPaths[filePath] = now
+            for filePath in indexer.filterOwnRemovals(newlyRemovedPaths):
+                pendingPaths.pop(filePath, None)
+                removedPaths.add(filePath)
+
+            # Wait until a file has settled, and until a bulk copy pauses (or has taken too long)
+            settledPaths = {filePath for filePath, lastEvent in pendingPaths.items() if now - lastEvent >= debounceSeconds}
+            oldestEvent = min(pendingPaths.values(), default=now)
+            copyPaused = not changedPaths or now - oldestEvent >= maxBatchDelay
+
+            if (settledPaths and copyPaused) or (removedPaths and not pendingPaths):
+                for filePath in settledPaths:
+                    del pendingPaths[filePath]
+                indexer.processChanges(settledPaths, removedPaths, renameFiles)
+                removedPaths = set()
+    except KeyboardInterrupt:
+        logger.info("Stopped watching.")
+    finally:
+        watcher.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the metadata table of a folder up to date while files arrive.")
+    parser.add_argument("sourceFolder", help="the folder to watch")
+    parser.add_argument("--rename", action="store_true", help="rename newly arrived files based on their metadata")
+    parser.add_argument("--format", default="csv", choices=["csv", "parquet", "feather"], help="the format of the metadata table")
+    parser.add_argument("--debounce", type=float, default=2.0, help="seconds without events before a file is processed")
+    parser.add_argument("--polling", action="store_true", help="poll the folder instead of using inotify")
+    parser.add_argument("--interval", type=float, default=10.0, help="seconds between two scans when polling")
+    parser.add_argument("--exif-tags", type=lambda value: [tag.strip() for tag in value.split(",") if tag.strip()],
+                        help="a comma-separated list of the EXIF tags to extract, e.g. 'Make,Model,DateTime'; all tags if not given")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="the lowest level of the messages shown")
+    arguments = parser.parse_args()
+
+    # A watcher runs unattended, so its progress is reported as lines instead of a bar
+    configureLogging(arguments.log_level, sourceFolder=arguments.sourceFolder, progress="summary")
+    try:
+        watchFolder(arguments.sourceFolder, fileFormat=arguments.format, renameFiles=arguments.rename,
+                    debounceSeconds=arguments.debounce, usePolling=arguments.polling, pollInterval=arguments.interval,
+                    exifTags=arguments.exif_tags)
+    finally:
+        shutdownLogging()